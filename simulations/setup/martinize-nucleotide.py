@@ -0,0 +1,6681 @@
+#!/usr/bin/env python
+
+# EDITABLE SECTIONS ARE MARKED WITH #@# 
+
+version="2.2"
+authors=["Djurre de Jong", "Jaakko J. Uusitalo", "Tsjerk A. Wassenaar"]
+
+# Parameters are defined for the following (protein) forcefields:
+forcefields = ['martini22nucleic','elnedyn22nucleic']
+
+# Time at which the program started, for reporting the startup time
+import time
+startTime = time.time()
+
+# 
+# This program has grown to be pretty complete and complex. 
+# The routines have been organized in sections, which are 
+# tagged to make jumping to a particular section easy.
+# For working versions, the sections are in different modules
+#
+# Index of this file:
+#
+#   1. Options and documentation                             @DOC
+#   2. Description, options and command line parsing         @CMD
+#   3. Helper functions and macros                           @FUNC
+#   4. Finegrained to coarsegrained mapping                  @MAP
+#   5. Secondary structure determination and interpretation  @SS
+#   6. Force field parameters (MARTINI/ELNEDYN)              @FF
+#   7. Elastic network                                       @ELN
+#   8. Structure I/O                                         @IO
+#   9. Topology generation                                   @TOP
+#  10. Main                                                  @MAIN
+#  11. Web-interface                                         @WEB
+#  
+
+def cat(file_out):
+    '''Function to 'compile' the martinize script into one file.'''
+    import re
+    files_in = 'martinize.py DOC.py CMD.py FUNC.py MAP.py SS.py '+'.py '.join(forcefields)+'.py ELN.py IO.py TOP.py MAIN.py '
+    pattern1 = re.compile(files_in.replace('.py ','|')[:-1])
+    pattern2 = re.compile(files_in.replace('.py ','\.|')[:-1])
+    file_out = open(file_out,'w')
+    tail = ''; head = True
+    for f in files_in.split():
+        for line in open(f).readlines():
+            # Split the string to avoid the function finding itself
+            if '__na'+'me__' in line:
+                head = False
+            if head:
+                file_out.write(line)
+            elif (f == 'martinize.py' and not head) and not ('import' in line and pattern1.search(line)):
+                tail += pattern2.sub('',line)
+            elif line[0] == '#':
+                file_out.write(line)
+            elif not ('import' in line and pattern1.search(line)):
+                file_out.write(pattern2.sub('',line))
+    file_out.write(tail)
+
+###################################
+## 1 # OPTIONS AND DOCUMENTATION ##  -> @DOC <-
+###################################
+
+    
+# This is a simple and versatily option class that allows easy
+# definition and parsing of options. 
+class Option:
+    def __init__(self,func=str,num=1,default=None,description=""):
+        self.func        = func
+        self.num         = num
+        self.value       = default
+        self.description = description
+    def __nonzero__(self): 
+        if self.func == bool:
+            return self.value != False
+        return bool(self.value)
+    def __str__(self):
+        return self.value and str(self.value) or ""
+    def setvalue(self,v):
+        if len(v) == 1:
+            self.value = self.func(v[0])
+        else:
+            self.value = [ self.func(i) for i in v ]
+    
+
+# Lists for gathering arguments to options that can be specified 
+# multiple times on the command line.
+lists = {
+    'cystines': [],
+    'merges'  : [],
+    'links'   : [],
+    'multi'   : [],
+    }
+
+# List of Help text and options. 
+# This way we can simply print this list if the user wants help. 
+options = [
+#   NOTE: Options marked with (+) can be given multiple times on the command line
+#   option              type number default description
+    """
+MARTINIZE.py is a script to create Coarse Grain Martini input files of
+proteins, ready for use in the molecular dynamics simulations package 
+Gromacs. For more information on the Martini forcefield, see:
+www.cgmartini.nl
+and read our papers:
+Monticelli et al., J. Chem. Theory Comput., 2008, 4(5), 819-834
+de Jong et al., J. Chem. Theory Comput., 2013, DOI:10.1021/ct300646g
+
+Primary input/output
+--------------------
+The input file (-f) should be a coordinate file in PDB or GROMOS
+format. The format is inferred from the structure of the file. The 
+input can also be provided through stdin, allowing piping of 
+structures. The input structure can have multiple frames/models. If an output
+structure file (-x) is given, each frame will be coarse grained,
+resulting in a multimodel output structure. The output structure is
+gzip compressed if its name ends with .gz, and is accompanied by an 
+index file (.idx) listing the byte offset of each model and chain in 
+the (uncompressed) structure. Having multiple frames may
+also affect the topology. If secondary structure is determined
+internally, the structure will be averaged over the frames. Likewise,
+interatomic distances, as used for backbone bond lengths in Elnedyn
+and in elastic networks, are also averaged over the frames available.
+
+With -mdl only the given models of a multimodel PDB file (.pdb or 
+.pdb.gz) are read, e.g. -mdl 1,5-10. The models are found through the
+index file (.idx) of the input, which is made on the first use if it is
+missing or older than the file. A gzipped file can only be decompressed from the start 
+of a gzip member, so to jump to a model quickly it should have a member
+per model, as in the compressed output structures (-x). 
+
+If an output file (-o) is indicated for the topology, that file will
+be used for the master topology, using #include statements to link the
+moleculetype definitions, which are written to separate files. If no
+output filename is given, the topology and the moleculetype
+definitions are written to stdout.
+
+Secondary structure
+-------------------
+The secondary structure plays a central role in the assignment of atom
+types and bonded interactions in MARTINI. Martinize allows
+specification of the secondary structure as a string (-ss), or as a
+file containing a specification in GROMACS' ssdump format
+(-ss). Alternatively, DSSP can be used for an on-the-fly assignment of
+the secondary structure. For this, the option -dssp has to be used
+giving the location of the executable as the argument. 
+The option -collagen will set the whole structure to collagen. If this
+is not what you want (eg only part of the structure is collagen, you
+can give a secondary structure file/string (-ss) and specifiy collagen
+as "F". Parameters for collagen are taken from: Gautieri et al., 
+J. Chem. Theory Comput., 2010, 6, 1210-1218. 
+With multimodel input files, the secondary structure as determined with
+DSSP will be averaged over the frames. In this case, a cutoff
+can be specified (-ssc) indicating the fraction of frames to match a
+certain secondary structure type for designation.
+
+Topology
+--------
+Several options are available to tune the resulting topology. By
+default, termini are charged, and chain breaks are kept neutral. This
+behaviour can be changed using -nt and -cb, respectively.
+
+Disulphide bridges can be specified using -cys. This option can be
+given multiple times on the command line. The argument is a pair of
+cysteine residues, using the format
+chain/resn/resi,chain/resn/resi. For disulphide bridges, the residue
+name is not required, and the chain identifier is optional. If no
+chain identifier is given, all matching residue pairs will be checked,
+and pairs within the cutoff distance (0.22 nm) will be linked. It is
+also possible to let martinize detect cysteine pairs based on this
+cut-off distance, by giving the keyword 'auto' as argument to -cys.
+Alternatively, a different cut-off distance can be specified, which
+will also trigger a search of pairs satisfying the distance
+criterion.
+
+In addition to cystine bridges, links between other atoms can be
+specified using -link. This requires specification of the atoms, using
+the format
+chain/resi/resn/atom,chain/resi/resn/atom,bondlength,forceconstant.
+If only two atoms are given, a constraint will be added with length
+equal to the (average) distance in the coordinate file. If a bond
+length is added, but no force constant, then the bondlength will be
+used to set a constraint.
+
+Linking atoms requires that the atoms are part of the same
+moleculetype. Therefore any link between chains will cause the chains
+to be merged. Merges can also be specified explicitly, using the
+option -merge with a comma-separated list of chain identifiers to be
+joined into one moleculetype. The option -merge can be used several
+times. Note that specifying a chain in several merge groups will cause
+all chains involved to be merged into a single moleculetype.
+
+The moleculetype definitions are written to topology include (.itp)
+files, using a name consisting of the molecule class (e.g. Protein)
+and the chain identifier. With -name a name can be specified instead.
+By default, martinize only writes a moleculetype for each unique
+molecule, inferred from the sequence and the secondary structure
+definition. It is possible to force writing a moleculetype definition
+for every single molecule, using -sep.
+The option -zitp causes the moleculetype definitions to be written 
+gzip compressed (.itp.gz); these need to be decompressed for grompp.
+
+With -cache a directory is given for keeping the coarse grained
+structure and the candidate elastic bonds between runs. The entries are
+named after a digest of the input structure, the mapping and the elastic
+network cutoff, so a run on the same structure with other output options,
+position restraints or force constants reuses them. The topologies of
+the moleculetypes (.itp) are kept too, named after the chains, all 
+options and the version of this script, so a repeated run with the same
+options reuses them (not with -bmap). The size of the cache is limited 
+with -cachesize, removing the entries used least recently.
+
+The option -p can be used to write position restraints, using the 
+force constant specified with -pf, which is set to 1000 kJ/mol 
+by default.
+
+For stability, elastic bonds are used to retain the structure of 
+extended strands. The option -ed causes dihedrals to be used 
+instead.
+
+Different forcefields can be specified with -ff. All the parameters and
+options belonging to that forcefield  will be set (eg. bonded interactions,
+BB-bead positions, Elastic Network, etc.). By default martini 2.1 is
+used.
+
+Elastic network
+---------------
+Martinize can write an elastic network for atom pairs within a cutoff
+distance. The force constant (-ef) and the upper distance bound (-eu) 
+can be speficied. If a force field with an intrinsic Elastic
+network is specified (eg. Elnedyn) with -ff, -elastic in implied and
+the default values for the force constant and upper cutoff are used.
+However, these can be overwritten.
+
+The topology types (-type) for nucleic acids set the force field and
+the elastic network parameters. Several types can be given as a comma
+separated list, e.g. -type ss-stiff,ss-soft,ss-limp, provided they only
+differ in the elastic network. The structure is then mapped and searched
+for elastic bonds once, and the topology for each type is written to a
+directory named after it (STIFF, SOFT, SOFT2, LIMP, SPARSE).
+
+By default the elastic network is built from the last frame of the
+input. With -eavg the bond lengths are averaged over all frames: the
+candidate pairs within the upper cutoff plus a margin (-eskin) in the
+first frame are followed through the frames, keeping only running sums
+per pair. Bonds are made for pairs with a mean distance below the upper
+cutoff, and -evar can be used to skip pairs with a standard deviation 
+larger than the value given (nm).
+
+Each elastic bond costs time in the simulation. With -ek the number of
+elastic bonds per bead is limited, keeping the shortest (and strongest)
+ones. By default (-ekm max) a bond is only kept if it is among the -ek 
+shortest of both beads, so no bead has more. With -ekm min a bond is 
+kept if it is among the -ek shortest of either bead, so that every bead
+stays bound to its nearest neighbours. The number of bonds per bead is
+reported for each moleculetype, as 'bonds:beads' pairs.
+
+The domain decomposition in mdrun is limited by the longest bonded 
+interaction. The range of the bonded interactions is reported for each 
+moleculetype, together with suggested values for the mdrun options -rdd
+and -rcon (with a 10% margin, for lincs-order 4). With -elong, elastic 
+bonds longer than the given length (nm) are removed. With -esplit these
+are kept in a separate block, which is left out if SHORT_RUBBER_BANDS is
+defined (e.g. grompp -DSHORT_RUBBER_BANDS).
+
+Each moleculetype gets its own elastic network, so contacts between
+chains are only restrained if the chains are merged. With -eic elastic
+bonds are also made between the beads of different molecules, using
+the same parameters. These are written to the master topology in an
+[ intermolecular_interactions ] section, numbered as in the system. The
+search divides the system in slabs, which are handled in parallel by the
+number of processes given with -enp. This is not available for
+multiscaled chains.
+
+With -eicf only the elastic bonds between the chains of an assembled 
+coarse grained structure (PDB) are made, e.g. of a whole ribosome put
+together from separate runs for the proteins and the nucleic acids. 
+Each chain is taken as a molecule and the beads are numbered as in the
+structure, which should follow the order of the [ molecules ]. Of the 
+nucleic acids the beads given with -eb are used, of other residues 
+(proteins) only the backbone beads (BB), as in the elastic networks of
+elnedyn. The [ intermolecular_interactions ] are written to -o, which
+can be included at the end of the system topology.
+
+Mapping trajectories
+--------------------
+With -nmap an index file is written with the atoms mapped to each bead,
+which can be used to map atomistic trajectories with external tools.
+The same mapping can be written with -mapop as a sparse, mass-weighted
+atom to bead operator (numpy NPZ file). An atomistic trajectory given
+with -ft is mapped with this operator frame by frame and written as a 
+coarse grained trajectory to -xt. The atomistic trajectory must have 
+the same atom order as the input structure.
+
+Multiscaling
+------------
+Martinize can process a structure to yield a multiscale system,
+consisting of a coordinate file with atomistic parts and
+corresponding, overlaid coarsegrained parts. For chains that are
+multiscaled, rather than writing a full moleculetype definition, 
+additional [atoms] and [virtual_sitesn] sections are written, to 
+be appended to the atomistic moleculetype definitions. 
+The option -multi can be specified multiple times, and takes a chain
+identifier as argument. Alternatively, the keyword 'all' can be given
+as argument, causing all chains to be multiscaled.
+========================================================================\n
+""",
+    ("-f",        Option(str,                      1,     None, "Input file (PDB|GRO)")),
+    ("-mdl",      Option(str,                      1,     None, "Models to read from a multimodel PDB input file, e.g. 1,5-10 (default: all)")),
+    ("-o",        Option(str,                      1,     None, "Output topology (TOP)")),
+    ("-x",        Option(str,                      1,     None, "Output coarse grained structure (PDB)")),
+    ("-n",        Option(str,                      1,     None, "Output index file with CG (and multiscale) beads.")),
+    ("-nmap",     Option(str,                      1,     None, "Output index file containing per bead mapping.")),
+    ("-mapop",    Option(str,                      1,     None, "Output sparse atom to bead mapping operator (NPZ).")),
+    ("-ft",       Option(str,                      1,     None, "Input atomistic trajectory to map (PDB|GRO, multiple frames)")),
+    ("-xt",       Option(str,                      1,     None, "Output coarse grained trajectory mapped from -ft (PDB)")),
+    ("-seq",      Option(str,                      1,     None, "Output list of bead numbers.")),
+    ("-bmap",     Option(str,                      1,     None, "Output index files containing bonded terms, also stored as arrays (-bonded.npz).")),
+    ("-zitp",     Option(bool,                     0,    False, "Write the moleculetype topologies gzip compressed (.itp.gz).")),
+    ("-cache",    Option(str,                      1,     None, "Directory for caching mapped structures, elastic network pairs and topologies between runs.")),
+    ("-cachesize",Option(float,                    1,     1000, "Maximum size of the cache (MB); 0 is no limit (default: 1000)")),
+    ("-v",        Option(bool,                     0,    False, "Verbose. Be load and noisy.")), 
+    ("-h",        Option(bool,                     0,    False, "Display this help.")),
+    ("-ss",       Option(str,                      1,     None, "Secondary structure (File or string)")),
+    ("-ssc",      Option(float,                    1,      0.5, "Cutoff fraction for ss in case of ambiguity (default: 0.5).")),
+    ("-dssp",     Option(str,                      1,     None, "DSSP executable for determining structure")),
+#    ("-pymol",    Option(str,                      1,     None, "PyMOL executable for determining structure")),
+    ("-collagen", Option(bool,                     0,    False, "Use collagen parameters")),
+    ("-his",      Option(bool,                     0,    False, "Interactively set the charge of each His-residue.")),
+    ("-nt",       Option(bool,                     0,    False, "Set neutral termini (charged is default)")), 
+    ("-cb",       Option(bool,                     0,    False, "Set charges at chain breaks (neutral is default)")), 
+    ("-cys",      Option(lists['cystines'].append, 1,     None, "Disulphide bond (+)")),
+    ("-link",     Option(lists['links'].append,    1,     None, "Link (+)")),
+    ("-merge",    Option(lists['merges'].append,   1,     None, "Merge chains: e.g. -merge A,B,C (+)")),
+#    ("-mixed",    Option(bool,                     0,    False, "Allow chains of mixed type (default: False)")),
+    ("-name",     Option(str,                      1,     None, "Moleculetype name")),
+    ("-p",        Option(str,                      1,   'None', "Output position restraints (None/All/Backbone) (default: None)")),
+    ("-pf",       Option(float,                    1,     1000, "Position restraints force constant (default: 1000 kJ/mol/nm^2)")),
+    ("-ed",       Option(bool,                     0,    False, "Use dihedrals for extended regions rather than elastic bonds)")),
+    ("-sep",      Option(bool,                     0,    False, "Write separate topologies for identical chains.")),
+    ("-ff",       Option(str,                      1,'martini21', "Which forcefield to use: "+' ,'.join(n for n in forcefields[:-1]))),
+# Fij = Fc exp( -a (rij - lo)**p )
+    ("-elastic",  Option(bool,                     0,    False, "Write elastic bonds")),
+    ("-ef",       Option(float,                    1,      500, "Elastic bond force constant Fc")),
+    ("-el",       Option(float,                    1,        0, "Elastic bond lower cutoff: F = Fc if rij < lo")),
+    ("-eu",       Option(float,                    1,     0.90, "Elastic bond upper cutoff: F = 0  if rij > up")),
+    ("-ea",       Option(float,                    1,        0, "Elastic bond decay factor a")),
+    ("-ep",       Option(float,                    1,        1, "Elastic bond decay power p")),
+    ("-em",       Option(float,                    1,        0, "Remove elastic bonds with force constant lower than this")),
+    ("-eb",       Option(str,                      1,     'BB', "Comma separated list of bead names for elastic bonds")),
+    ("-eavg",     Option(bool,                     0,    False, "Average elastic bond lengths over the frames of the input")),
+    ("-eskin",    Option(float,                    1,      0.1, "Margin beyond the upper cutoff for candidate elastic bonds with -eavg (nm)")),
+    ("-evar",     Option(float,                    1,        0, "Skip averaged elastic bonds with a larger standard deviation (nm); 0 is no limit")),
+    ("-ek",       Option(int,                      1,        0, "Maximum number of elastic bonds per bead, keeping the shortest; 0 is no limit")),
+    ("-ekm",      Option(str,                      1,    'max', "Elastic bond limit: at most -ek per bead (max), or the -ek nearest of each bead (min)")),
+    ("-elong",    Option(float,                    1,        0, "Remove elastic bonds longer than this (nm), or split them off with -esplit; 0 is no limit")),
+    ("-esplit",   Option(bool,                     0,    False, "Write elastic bonds longer than -elong separately, to be left out with -DSHORT_RUBBER_BANDS")),
+    ("-eic",      Option(bool,                     0,    False, "Add elastic bonds between molecules ([ intermolecular_interactions ])")),
+    ("-enp",      Option(int,                      1,        1, "Number of processes for the elastic network between molecules")),
+    ("-eicf",     Option(str,                      1,     None, "Only add elastic bonds between the chains of this coarse grained structure (PDB), written to -o")),
+    ("-type",     Option(str,                      1,     'ss', "Type of DNA/RNA topology (ss/ds-stiff/ds-soft/ss-stiff/ss-soft/ss-soft-two/ss-limp/ss-sparse) to create. A comma separated list writes each type to its own directory. (default: ss)")),
+#    ("-hetatm",   Option(bool,                     0,    False, "Include HETATM records from PDB file (Use with care!)")),
+    ("-multi",    Option(lists['multi'].append,    1,     None, "Chain to be set up for multiscaling (+)")),
+    ]
+
+## Martini Quotes
+martiniq = [
+    ("Robert Benchley",
+     "Why don't you get out of that wet coat and into a dry martini?"),
+    ("James Thurber",
+     "One martini is all right, two is two many, three is not enough"),
+    ("Philip Larkin",
+     "The chromatic scale is what you use to give the effect of drinking a quinine martini and having an enema simultaneously."),
+    ("William Emerson, Jr.",
+     "And when that first martini hits the liver like a silver bullet, there is a sigh of contentment that can be heard in Dubuque."),
+    ("Alec Waugh",
+     "I am prepared to believe that a dry martini slightly impairs the palate, but think what it does for the soul."),
+    ("Gerald R. Ford",
+     "The three-martini lunch is the epitome of American efficiency. Where else can you get an earful, a bellyful and a snootful at the same time?"),
+    ("P. G. Wodehouse",
+     "He was white and shaken, like a dry martini."),
+    ]
+
+desc = ""
+    
+def help():
+    """Print help text and list of options and end the program."""
+    import sys
+    for item in options:
+        if type(item) == str:
+            print (item)
+    for item in options:
+        if type(item) != str:
+            print ("%10s  %s"%(item[0],item[1].description))
+    print
+    sys.exit()
+##############################
+## 2 # COMMAND LINE PARSING ##  -> @CMD <-
+##############################
+import sys,logging
+
+# Helper function to parse atom strings given on the command line:
+#   resid
+#   resname/resid
+#   chain/resname/resid
+#   resname/resid/atom
+#   chain/resname/resid/atom
+#   chain//resid
+#   chain/resname/atom
+def str2atom(a):
+    a = a.split("/")   
+    if len(a) == 1: # Only a residue number:
+        return (None,None,int(a[0]),None)
+    if len(a) == 2: # Residue name and number (CYS/123):
+        return (None,a[0],int(a[1]),None)
+    if len(a) == 3:
+        if a[2].isdigit(): # Chain, residue name, residue number
+            return (None,a[1],int(a[2]),a[0])
+        else: # Residue name, residue number, atom name
+            return (a[2],a[0],int(a[1]),None)
+    return (a[3],a[1],int(a[2]),a[0])
+
+# Topology types (-type) and the options they set:
+#   force field, merged chains, elastic network upper bound (-eu),
+#   force constant (-ef) and beads (-eb), and the directory used when
+#   several types are written in one run.
+topologyTypes = {
+    'ss':          ('martini22nucleic', None,  None,  None,  None,                          'SS'),
+    'ds-stiff':    ('elnedyn22nucleic', 'A,B', '1.0', '500', 'BB1,BB2,BB3,SC1,SC2,SC3,SC4', 'DS_STIFF'),
+    'ds-soft':     ('elnedyn22nucleic', 'A,B', '1.2', '13',  'BB1,BB2,BB3,SC1',             'DS_SOFT'),
+    'ss-stiff':    ('elnedyn22nucleic', None,  '1.0', '500', 'BB1,BB2,BB3,SC1,SC2,SC3,SC4', 'STIFF'),
+    'ss-soft':     ('elnedyn22nucleic', None,  '1.2', '13',  'BB1,BB2,BB3,SC1',             'SOFT'),
+    'ss-soft-two': ('elnedyn22nucleic', None,  '1.0', '13',  'BB1,BB2,BB3,SC1,SC2,SC3,SC4', 'SOFT2'),
+    'ss-limp':     ('elnedyn22nucleic', None,  '0.5', '13',  'BB1,BB2,BB3,SC1,SC2,SC3,SC4', 'LIMP'),
+    'ss-sparse':   ('elnedyn22nucleic', None,  '1.0', '13',  'BB1,SC1',                     'SPARSE'),
+    'ignore':      (None,               None,  None,  None,  None,                          'IGNORE'),
+    }
+
+def option_parser(args,options,lists,version=0):
+
+    # Check whether there is a request for help
+    if '-h' in args or '--help' in args:
+        help()
+
+    # Convert the option list to a dictionary, discarding all comments
+    options = dict([i for i in options if not type(i) == str])
+
+    # This information we would like to print to some files, so let's put it in our information class
+    options['Version']             = version
+    options['Arguments']           = args[:]
+   
+    while args:
+        ar = args.pop(0)
+        options[ar].setvalue([args.pop(0) for i in range(options[ar].num)])
+
+    ## LOGGING ##
+    # Set the log level and communicate which options are set and what is happening
+    # If 'Verbose' is set, change the logger level
+    logLevel = options["-v"] and logging.DEBUG or logging.INFO
+    logging.basicConfig(format='%(levelname)-7s    %(message)s',level=logLevel)
+
+    logging.info('MARTINIZE, script version %s'%version)
+    logging.info('If you use this script please cite:')
+    logging.info('de Jong et al., J. Chem. Theory Comput., 2013, DOI:10.1021/ct300646g')
+
+    # Write options based on selected topology type.
+    # Several types can be given as a comma separated list, in which case
+    # a topology is written for each of them, in a directory named after
+    # the type (see topologyTypes). The first type sets the options.
+    types = options['-type'].value.split(',')
+    for t in types:
+        if not t in topologyTypes:
+            logging.error('Undefined topology type. Giving up...')
+            sys.exit()
+    options['type'] = types[0]
+    ff, merges, eu, ef, eb, label = topologyTypes[options['type']]
+    if ff:     options['-ff'].setvalue([ff])
+    if merges: lists['merges'].append(merges)
+    if eu:     options['-eu'].setvalue([eu])
+    if ef:     options['-ef'].setvalue([ef])
+    if eb:     options['-eb'].setvalue([eb])
+
+    # The variants can only share the topology if they differ in
+    # the elastic network alone.
+    options['Variants'] = []
+    if len(types) > 1:
+        if len(set([topologyTypes[t][:2] for t in types])) > 1:
+            logging.error('Topology types %s differ in force field or merges. Giving up...'%", ".join(types))
+            sys.exit()
+        if not options['-o']:
+            logging.error('Writing several topology types requires an output topology (-o).')
+            sys.exit()
+        for t in types:
+            ff, merges, eu, ef, eb, label = topologyTypes[t]
+            options['Variants'].append({
+                'type':                t,
+                'Directory':           label,
+                'ElasticUpperBound':   eu and float(eu) or options['-eu'].value,
+                'ElasticMaximumForce': ef and float(ef) or options['-ef'].value,
+                'ElasticBeads':        (eb or options['-eb'].value).split(','),
+                })
+     
+    # The make the program flexible, the forcefield parameters are defined
+    # for multiple forcefield. Check if a existing one is defined:
+    ###_tmp  = __import__(options['-ff'].value.lower())
+    ###options['ForceField']  = getattr(_tmp,options['-ff'].value.lower())()
+    ffStart = time.time()
+    try:
+        try:
+            # Try to load the forcefield class from a different file
+            _tmp  = __import__(options['-ff'].value.lower())
+            options['ForceField']  = getattr(_tmp,options['-ff'].value.lower())()
+        except:
+            # Try to load the forcefield class from the current file
+            options['ForceField']  = globals()[options['-ff'].value.lower()]()
+    except:
+        logging.error("Forcefield '%s' can not be found."%(options['-ff']))
+        sys.exit()
+
+    # The program is compiled before it starts, unless it is run from bytecode (.pyc)
+    logging.debug("Startup: %.3f s for loading the modules, %.3f s for the force field %s."%(
+        ffStart-startTime,time.time()-ffStart,options['-ff'].value))
+
+    # Process the raw options from the command line
+    # Boolean options are set to more intuitive variables
+    options['Collagen']            = options['-collagen']
+    options['chHIS']               = options['-his']
+    options['ChargesAtBreaks']     = options['-cb']
+    options['NeutralTermini']      = options['-nt']
+    options['ExtendedDihedrals']   = options['-ed']
+    options['RetainHETATM']        = False # options['-hetatm']
+    options['SeparateTop']         = options['-sep']
+    options['CompressITP']         = options['-zitp']
+    options['MixedChains']         = False # options['-mixed']
+    options['ElasticNetwork']      = options['-elastic']
+ 
+    # Parsing of some other options into variables
+    options['ElasticMaximumForce'] = options['-ef'].value 
+    options['ElasticMinimumForce'] = options['-em'].value
+    options['ElasticLowerBound']   = options['-el'].value
+    options['ElasticUpperBound']   = options['-eu'].value
+    options['ElasticDecayFactor']  = options['-ea'].value
+    options['ElasticDecayPower']   = options['-ep'].value
+    options['ElasticBeads']        = options['-eb'].value.split(',')
+    options['ElasticAverage']      = options['-eavg']
+    options['ElasticSkin']         = options['-eskin'].value
+    options['ElasticMaximumDeviation'] = options['-evar'].value
+    options['ElasticMaximumBonds'] = options['-ek'].value
+    options['ElasticBondLimit']    = options['-ekm'].value.lower()
+    if not options['ElasticBondLimit'] in ("max","min"):
+        logging.error("Undefined elastic bond limit '%s' (max/min). Giving up..."%options['-ekm'].value)
+        sys.exit()
+    options['ElasticLongBound']    = options['-elong'].value
+    options['ElasticSplitLong']    = options['-esplit']
+    options['InterElastic']        = options['-eic']
+    options['ElasticProcesses']    = options['-enp'].value
+    options['PosResForce']         = options['-pf'].value
+    options['Models']              = []
+    if options['-mdl'].value:
+        try:
+            for i in options['-mdl'].value.split(","):
+                i = i.split("-")
+                options['Models'].extend(range(int(i[0]),int(i[-1])+1))
+        except ValueError:
+            logging.error("Can not read the models to read (-mdl %s). Giving up..."%options['-mdl'].value)
+            sys.exit()
+        if not options['-f']:
+            logging.error("Models can only be selected (-mdl) from an input file (-f). Giving up...")
+            sys.exit()
+        name = options['-f'].value.lower()
+        if not (name.endswith(".pdb") or name.endswith(".pdb.gz")):
+            logging.error("Models can only be selected (-mdl) from a PDB file (.pdb or .pdb.gz). Giving up...")
+            sys.exit()
+    options['Cache']               = options['-cache'].value and Cache(options['-cache'].value,int(options['-cachesize'].value*2**20)) or None
+
+    options['PosRes']              = [i.lower() for i in options['-p'].value.split(",")]
+    if "none"     in options['PosRes']: options['PosRes'] = []
+    if "backbone" in options['PosRes']: options['PosRes'].append("BB")
+    
+    if options['ForceField'].ElasticNetwork:
+        # Some forcefields, like elnedyn, always use an elatic network. This is set in the 
+        # forcefield file, with the parameter ElasticNetwork.
+        options['ElasticNetwork']  = True
+    
+    # Merges, links and cystines
+    options['mergeList'] = "all" in lists['merges'] and ["all"] or [i.split(",") for i in lists['merges']]
+
+
+    # Process links
+    linkList   = []
+    linkListCG = []
+    for i in lists['links']:
+        ln     = i.split(",")
+        a, b   = str2atom(ln[0]), str2atom(ln[1])
+        if len(ln) > 3: # Bond with given length and force constant
+            bl, fc = (ln[2] and float(ln[2]) or None, float(ln[3]))
+        elif len(a) == 3: # Constraint at given distance
+            bl, fc = float(a[2]), None
+        else: # Constraint at distance in structure
+            bl, fc = None, None
+        # Store the link, but do not list the atom name in the
+        # atomistic link list. Otherwise it will not get noticed 
+        # as a valid link when checking for merging chains
+        linkList.append(((None,a[1],a[2],a[3]),(None,b[1],b[2],b[3])))
+        linkListCG.append((a,b,bl,fc))
+    
+    
+    # Cystines -- This should be done for all special bonds listed in the _special_ dictionary
+    CystineCheckBonds = False   # By default, do not detect cystine bridges
+    CystineMaxDist2   = (10*0.22)**2 # Maximum distance (A) for detection of SS bonds
+    for i in lists['cystines']:
+        if i.lower() == "auto":
+            CystineCheckBonds = True
+        elif i.replace(".","").isdigit():
+            CystineCheckBonds = True
+            CystineMaxDist2   = (10*float(i))**2
+        else:
+            # This item should be a pair of cysteines
+            cysA, cysB = [str2atom(j) for j in i.split(",")]
+            # Internally we handle the residue number shifted by ord(' ')<<20. We have to add this to the
+            # cys-residue numbers given here as well.
+            constant = 32<<20
+            linkList.append((("SG","CYS",cysA[2]+constant,cysA[3]),("SG","CYS",cysB[2]+constant,cysB[3])))
+            linkListCG.append((("SC1","CYS",cysA[2]+constant,cysA[3]),("SC1","CYS",cysB[2]+constant,cysB[3]),-1,-1))
+
+    # Now we have done everything to it, we can add Link/cystine related stuff to options
+    # 'multi' is not stored anywhere else, so that we also add
+    options['linkList']          = linkList
+    options['linkListCG']        = linkListCG
+    options['CystineCheckBonds'] = CystineCheckBonds
+    options['CystineMaxDist2']   = CystineMaxDist2
+    options['multi']             = lists['multi']
+
+    logging.info("Chain termini will%s be charged"%(options['NeutralTermini'] and " not" or ""))
+    
+    logging.info("Residues at chain brakes will%s be charged"%((not options['ChargesAtBreaks']) and " not" or ""))
+
+    if options.has_key('ForceField'):
+        logging.info("The %s forcefield will be used."%(options['ForceField'].name))
+        cacheLookups(options['ForceField'])
+    else:
+        logging.error("Forcefield '%s' has not been implemented."%(options['-ff']))
+        sys.exit()
+    
+    if options['ExtendedDihedrals']:  
+        logging.info('Dihedrals will be used for extended regions. (Elastic bonds may be more stable)')
+    else:                  
+        logging.info('Local elastic bonds will be used for extended regions.')
+    
+    
+    if options['PosRes']:
+        logging.info("Position restraints will be generated.")
+        logging.warning("Position restraints are only enabled if -DPOSRES is set in the MDP file")
+    
+    
+    if options['MixedChains']:
+        logging.warning("So far no parameters for mixed chains are available. This might crash the program!")
+    
+    
+    if options['RetainHETATM']:
+        logging.warning("I don't know how to handle HETATMs. This will probably crash the program.")
+
+    return options 
+#################################################
+## 3 # HELPER FUNCTIONS, CLASSES AND SHORTCUTS ##  -> @FUNC <-
+#################################################
+
+import math
+import numpy
+
+#----+------------------+
+## A | STRING FUNCTIONS |
+#----+------------------+
+
+# Split a string                                                              
+def spl(x):                                                                   
+    return x.split()                                                          
+
+
+# Split each argument in a list                                               
+def nsplit(*x):                                                               
+    return [i.split() for i in x]                                             
+
+
+# Make a dictionary from two lists                                            
+def hash(x,y):                                                                
+    return dict(zip(x,y))                                                     
+
+
+# Function to reformat pattern strings                                        
+def pat(x,c="."):                                                             
+    return x.replace(c,"\x00").split()                                        
+
+
+# Function to generate formatted strings according to the argument type       
+def formatString(i):                                                          
+    if type(i) == str:                                                        
+        return i                                                              
+    if type(i) == int:                                                        
+        return "%5d"%i                                                        
+    if type(i) == float and 0<abs(i)<1e-5:                                                      
+        return "%2.1e"%i                                                      
+    elif type(i) == float:                                                      
+        return "%8.5f"%i                                                      
+    else:                                                                     
+        return str(i)                                                         
+
+
+#----+----------------+
+## B | MATH FUNCTIONS |
+#----+----------------+
+
+
+def cos_angle(a,b):
+    p = sum([i*j for i,j in zip(a,b)])
+    q = math.sqrt(sum([i*i for i in a])*sum([j*j for j in b]))
+    return min(max(-1,p/q),1)
+
+
+def norm2(a):
+    return sum([i*i for i in a])
+
+
+def norm(a):
+    return math.sqrt(norm2(a))
+
+
+def distance2(a,b):
+    return (a[0]-b[0])**2+(a[1]-b[1])**2+(a[2]-b[2])**2
+
+
+# Cell list neighbour search. Returns the index pairs (i<j) of the coordinates
+# lying closer than the cutoff, together with their squared distances, sorted
+# on (i,j). The coordinates are binned in cubic cells with an edge equal to the
+# cutoff, so only pairs from the same or from adjacent cells need to be checked.
+# The squared distances are summed in the same order as in distance2, to give
+# identical results. With a cache (see Cache), the pairs found earlier for the 
+# same coordinates and cutoff are reused.
+def neighborPairs(coords,cutoff,cache=None):
+    x = numpy.asarray(coords,dtype=float).reshape((-1,3))
+    n = len(x)
+    if cache:
+        key   = cache.key("pairs",x,cutoff)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["I"], entry["J"], entry["D2"]
+        I, J, D2 = neighborPairs(x,cutoff)
+        cache.put(key,I=I,J=J,D2=D2)
+        return I, J, D2
+    if n < 2 or cutoff <= 0:
+        return numpy.zeros(0,dtype=int), numpy.zeros(0,dtype=int), numpy.zeros(0)
+    # Cell indices per dimension and a single key per cell
+    cell  = numpy.floor((x-x.min(axis=0))/cutoff).astype(int)
+    dim   = cell.max(axis=0)+1
+    key   = (cell[:,0]*dim[1]+cell[:,1])*dim[2]+cell[:,2]
+    # Atoms sorted on cell, with the first and last position of each cell
+    order = numpy.argsort(key,kind="mergesort")
+    skey  = key[order]
+    I, J  = [], []
+    for dx in (-1,0,1):
+        for dy in (-1,0,1):
+            for dz in (-1,0,1):
+                nc    = cell+(dx,dy,dz)
+                valid = ((nc >= 0) & (nc < dim)).all(axis=1)
+                nkey  = (nc[:,0]*dim[1]+nc[:,1])*dim[2]+nc[:,2]
+                start = numpy.searchsorted(skey,nkey,side="left")
+                count = numpy.where(valid,numpy.searchsorted(skey,nkey,side="right")-start,0)
+                total = count.sum()
+                if not total:
+                    continue
+                # Expand each atom over the atoms in the neighbouring cell
+                i     = numpy.repeat(numpy.arange(n),count)
+                first = numpy.repeat(numpy.cumsum(count)-count,count)
+                j     = order[numpy.repeat(start,count)+numpy.arange(total)-first]
+                keep  = i < j
+                I.append(i[keep])
+                J.append(j[keep])
+    if not I:
+        return numpy.zeros(0,dtype=int), numpy.zeros(0,dtype=int), numpy.zeros(0)
+    I, J = numpy.concatenate(I), numpy.concatenate(J)
+    d    = x[I]-x[J]
+    d2   = d[:,0]**2+d[:,1]**2+d[:,2]**2
+    keep = d2 < cutoff**2
+    I, J, d2 = I[keep], J[keep], d2[keep]
+    srt  = numpy.lexsort((J,I))
+    return I[srt], J[srt], d2[srt]
+
+
+#----+----------------+
+## C | CACHED LOOKUPS |
+#----+----------------+
+
+# Wrap a lookup function, remembering the results for the arguments seen.
+# The cache is emptied when it reaches the given size, as done for the
+# compiled expressions in the re module; keeping track of the order of use
+# would cost more than most lookups. Arguments that can not be hashed are
+# passed on directly. The numbers of hits and misses are kept in 'counts'.
+def cachedLookup(function,size=4096):
+    results = {}
+    counts  = [0,0]
+    def lookup(*args):
+        try:
+            result = results[args]
+        except KeyError:
+            if len(results) >= size:
+                results.clear()
+            result = results[args] = function(*args)
+            counts[1] += 1
+            return result
+        except TypeError:
+            counts[1] += 1
+            return function(*args)
+        counts[0] += 1
+        return result
+    lookup.cached = function
+    lookup.counts = counts
+    return lookup
+
+# Cache the backbone parameter lookups of a force field, which only depend
+# on the residue names, the bead positions (ca) and the secondary structure.
+def cacheLookups(forceField,size=4096,names=("bbGetBond","bbGetAngle","bbGetDihedral")):
+    for name in names:
+        if hasattr(forceField,name) and not hasattr(getattr(forceField,name),"cached"):
+            setattr(forceField,name,cachedLookup(getattr(forceField,name),size))
+    return forceField
+
+# Hit and miss counts of the cached lookups of a force field
+def lookupCounts(forceField):
+    return [(name,i.counts[0],i.counts[1]) for name,i in sorted(vars(forceField).items()) if hasattr(i,"cached")]
+
+
+
+##########################
+## 4 # FG -> CG MAPPING ##  -> @MAP <-
+##########################
+import numpy,hashlib
+
+
+dnares3 = ["DA","DC","DG","DT"] 
+dnares1 = ["dA","dC","dG","dT"]
+rnares3 = [ "A", "C", "G", "U"]
+rnares1 = [ "A", "C", "G", "U"] # 
+
+# Amino acid nucleic acid codes:                                                                                 
+# The naming (AA and '3') is not strictly correct when adding DNA/RNA, but we keep it like this for consistincy.
+AA3     = dnares3+rnares3 #@#
+AA1     = dnares1+rnares1 #@#
+
+
+# Dictionaries for conversion from one letter code to three letter code v.v.                         
+AA123, AA321 = hash(AA1,AA3),hash(AA3,AA1)                                                           
+
+
+# Residue classes:
+nucleic = spl("DAD DCY DGU DTH ADE CYT GUA THY URA DA DC DG DT A C G U")
+
+
+residueTypes = dict([(i,"Nucleic") for i in nucleic ])
+
+class CoarseGrained:
+    # Class for mapping an atomistic residue list to a coarsegrained one
+    # Should get an __init__ function taking a residuelist, atomlist, Pymol selection or ChemPy model
+    # The result should be stored in a list-type attribute
+    # The class should have pdbstr and grostr methods
+
+    # Standard mapping groups
+    dna_bb = nsplit("P OP1 OP2 O5' O3'","C5' O4' C4'","C3' C2' C1'")
+    rna_bb = nsplit("P OP1 OP2 O5' O3'","C5' O4' C4'","C3' C2' O2' C1'")
+
+    # This is the mapping dictionary
+    # For each residue it returns a list, each element of which
+    # lists the atom names to be mapped to the corresponding bead.
+    # The order should be the standard order of the coarse grained
+    # beads for the residue. Only atom names matching with those 
+    # present in the list of atoms for the residue will be used
+    # to determine the bead position. This adds flexibility to the
+    # approach, as a single definition can be used for different 
+    # states of a residue (e.g., GLU/GLUH).
+    # For convenience, the list can be specified as a set of strings,
+    # converted into a list of lists by 'nsplit' defined above.
+    mapping = {
+        "DA": nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' C1'",
+                          "N9 C4",
+                          "C2 N3",
+                          "C6 N6 N1",
+                          "C8 N7 C5"),
+        "DG": nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' C1'",
+                          "N9 C4",
+                          "C2 N2 N3",
+                          "C6 O6 N1",
+                          "C8 N7 C5"),
+        "DC": nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' C1'",
+                          "N1 C6",
+                          "N3 C2 O2",
+                          "C5 C4 N4"),
+        "DT": nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' C1'",
+                          "N1 C6",
+                          "N3 C2 O2",
+                          "C5 C4 O4 C7 C5M"),
+        "A":  nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' O2' C1'",
+                          "N9 C4",
+                          "C2 N3",
+                          "C6 N6 N1",
+                          "C8 N7 C5"),
+        "G":  nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' O2' C1'",
+                          "N9 C4",
+                          "C2 N2 N3",
+                          "C6 O6 N1",
+                          "C8 N7 C5"),
+        "C":  nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' O2' C1'",
+                          "N1 C6",
+                          "N3 C2 O2",
+                          "C5 C4 N4"),
+        "U":  nsplit("P OP1 OP2 O5' H5T O3' H3T O1P O2P",
+                          "C5' O4' C4'",
+                          "C3' C2' O2' C1'",
+                          "N1 C6",
+                          "N3 C2 O2",
+                          "C5 C4 O4 C7 C5M"),
+        }
+
+    # Generic names for DNA beads
+    residue_bead_names_dna = spl("BB1 BB2 BB3 SC1 SC2 SC3 SC4")
+    # Generic names for RNA beads
+    residue_bead_names_rna = spl("BB1 BB2 BB3 SC1 SC2 SC3 SC4")
+
+    # This dictionary contains the bead names for all residues,
+    # following the order in 'mapping'
+    names  = {}
+    # Add the default bead names for all DNA/RNA nucleic acids
+    names.update([(i,("BB1","BB2","BB3","SC1","SC2","SC3","SC4")) for i in nucleic])
+
+    # This dictionary allows determining four letter residue names
+    # for ones specified with three letters, e.g., resulting from
+    # truncation to adhere to the PDB format.
+    # Each entry returns a prototypical test, given as a string,
+    # and the residue name to be applied if eval(test) is True.
+    # This is particularly handy to determine lipid types.
+    # The test assumes there is a local or global array 'atoms'
+    # containing the atom names of the residue in correct order.
+    restest = {
+        "POP": [('atoms[0] == "CA"', "POPG"),
+                ('atoms[0] == "N"',  "POPE")]
+        }
+
+    # Crude mass for weighted average. No consideration of united atoms.
+    # This will probably give only minor deviations, while also giving less headache
+    mass = {'H': 1,'C': 12,'N': 14,'O': 16,'S': 32,'P': 31,'M': 0}
+
+# Atom name lookup table for the mapping of a residue, giving
+# the beads every atom name is mapped to.
+def mapTable(beads):
+    table = {}
+    for b,names in enumerate(beads):
+        for name in names:
+            table.setdefault(name,[]).append(b)
+    return table
+
+# The lookup tables are precompiled for all residues in the mapping above
+mapTables = dict([(i,mapTable(j)) for i,j in CoarseGrained.mapping.items()])
+
+# Digest of the mapping definitions, to identify mapped structures in the cache
+mapDigest = hashlib.sha1(repr([sorted(getattr(CoarseGrained,i).items()) for i in ("mapping","names","mass")])).hexdigest()
+
+# Return, for each bead of the atomistic residue 'r', the indices of the 
+# atoms (in the residue) that are mapped to it, in the order of the atoms.
+def mapIndices(r):
+    table = mapTables[r[0][1]]
+    q     = [[] for i in CoarseGrained.mapping[r[0][1]]]
+    for k,atom in enumerate(r):
+        for b in table.get(atom[0],()):
+            q[b].append(k)
+    return q
+
+# Determine the centres of mass for a number of beads at once.
+# 'coords' is an array of atom coordinates, 'weights' an array of atom 
+# masses and 'groups' a list with, for each bead, the indices of its atoms.
+# The groups are laid out as a padded table of atom indices and weights,
+# and the weighted coordinates are summed column by column, i.e. in the 
+# same order as the atoms are listed for each bead.
+def mapCoordinates(coords,weights,groups):
+    counts = numpy.array([len(g) for g in groups],dtype=int)
+    if not len(counts):
+        return numpy.zeros((0,3))
+    flat   = numpy.array([i for g in groups for i in g],dtype=int)
+    bead   = numpy.repeat(numpy.arange(len(counts)),counts)
+    column = numpy.arange(len(flat)) - numpy.repeat(numpy.cumsum(counts)-counts,counts)
+    index  = numpy.zeros((len(counts),counts.max()),dtype=int)
+    weight = numpy.zeros((len(counts),counts.max()))
+    index[bead,column]  = flat
+    weight[bead,column] = weights[flat]
+    mwx    = numpy.zeros((len(counts),3))
+    for k in range(index.shape[1]):
+        mwx += weight[:,k,None]*coords[index[:,k]]
+    return mwx/weight.sum(axis=1)[:,None]
+
+# Return the CG beads for an atomistic residue, using the mapping specified above
+# The residue 'r' is simply a list of atoms, and each atom is a list:
+# [ name, resname, resid, chain, x, y, z ]
+def map(r):
+    q = mapIndices(r)
+    if not all(q):
+        raise ValueError("Atoms missing for bead")
+    weights = numpy.array([CoarseGrained.mass.get(i[0][0],0) for i in r])
+    coords  = numpy.array([i[4:7] for i in r],dtype=float)
+    return [tuple(i) for i in mapCoordinates(coords,weights,q).tolist()], [tuple(i) for i in q]
+
+# Mapping for index file
+def mapIndex(r):
+    # Get the name, mass and coordinates for all atoms in the residue
+    a = [(i[0],CoarseGrained.mass.get(i[0][0],0),i[4:]) for i in r]                    
+    # Store weight, coordinate and index for atoms that match a bead
+    return [[a[k][1:]+(k,) for k in i] for i in mapIndices(r)]
+
+# Bead groups for mapping atomistic trajectories, as written with -nmap.
+# Yields for every bead the bead and residue numbers used for the index
+# group, the residue, the bead name, and the (1-based) atom numbers with
+# the corresponding atom names.
+# In DNA the first bead of the 5' end is omitted. Also, the O3' atom is
+# mapped together with atoms from the next residue.
+def mapGroups(atoms,chains):
+    atid          = 1
+    current_chain = 0
+    ci            = chains[current_chain]
+    atom_limit    = ci.natoms
+    chain_residue = 0
+    o3_shift      = ''
+    for i_count, i in enumerate(residues(atoms)):
+        if i[0][1] in ("SOL","HOH","TIP"):
+            continue
+        if not i[0][1] in CoarseGrained.mapping.keys():
+            continue
+        names = [j[0] for j in i]
+        shift = 0
+        for j_count, j in enumerate(mapIndices(i)):
+            if atid == atom_limit + 1:
+                current_chain += 1
+                ci = chains[current_chain]
+                atom_limit += ci.natoms
+                chain_residue = 0
+            ids = []
+            if ci.type() == 'Nucleic':
+                for k in j:
+                    if names[k] == "O3'":
+                        ids.append(o3_shift)
+                        o3_shift = k+atid
+                    else:
+                        ids.append(k+atid)
+                    if k > shift:
+                        shift = k
+            else:
+                ids = [k+atid for k in j]
+            # On the first residue of a DNA chain the bead numbers are shifted down by one.
+            number = j_count+1
+            if ci.type() == 'Nucleic' and chain_residue == 0:
+                if j_count == 0:
+                    continue
+                number = j_count
+            yield number, i_count+1, i, CoarseGrained.names[i[0][1]][j_count], ids, [names[k] for k in j]
+        atid += shift+1
+        chain_residue += 1
+
+# Sparse atoms x beads operator for mapping atomistic coordinates to beads,
+# built from the bead groups above. The operator is stored as a dictionary
+# with arrays in coordinate format (atom, bead, weight), with the atom masses
+# as weights and the total mass per bead, together with the bead names and
+# residues for writing structures. The mass-weighted operator is given by
+# weight/mass[bead]; the division is done last when mapping, to obtain the
+# same positions as written with -x.
+def mapOperator(groups):
+    atom, bead, weight, total, beads = [], [], [], [], []
+    for number,resnr,residue,name,ids,names in groups:
+        mass = [(i-1,CoarseGrained.mass.get(n[0],0)) for i,n in zip(ids,names) if i != '']
+        atom.extend([i for i,m in mass])
+        bead.extend(len(mass)*[len(beads)])
+        weight.extend([m for i,m in mass])
+        total.append(sum([m for i,m in mass]))
+        beads.append((name,residue[0][1][:3],residue[0][2],residue[0][3]))
+    name, resn, resi, chain = beads and zip(*beads) or 4*[()]
+    return {"atom":   numpy.array(atom,dtype=int),
+            "bead":   numpy.array(bead,dtype=int),
+            "weight": numpy.array(weight,dtype=float),
+            "mass":   numpy.array(total,dtype=float),
+            "name":   numpy.array(name,dtype=str),
+            "resn":   numpy.array(resn,dtype=str),
+            "resi":   numpy.array(resi,dtype=int),
+            "chain":  numpy.array(chain,dtype=str)}
+
+# Apply a mapping operator to an array of atom coordinates
+def mapFrame(operator,xyz):
+    n  = len(operator["mass"])
+    wx = operator["weight"][:,None]*xyz[operator["atom"]]
+    return numpy.column_stack([numpy.bincount(operator["bead"],weights=wx[:,d],minlength=n) for d in range(3)])/operator["mass"][:,None]
+
+def writeMapOperator(filename,operator):
+    out = open(filename,"wb")
+    numpy.savez_compressed(out,**operator)
+    out.close()
+
+def readMapOperator(filename):
+    f = numpy.load(filename)
+    return dict([(i,f[i]) for i in f.files])
+#############################
+## 5 # SECONDARY STRUCTURE ##  -> @SS <-
+#############################
+import logging,os,sys
+import subprocess as subp
+
+#----+--------------------------------------+
+## A | SECONDARY STRUCTURE TYPE DEFINITIONS |
+#----+--------------------------------------+
+
+# This table lists all coarse grained secondary structure types
+# The following are matched lists. Make sure they stay matched.
+# The lists do not need to be of the same length. The longer list
+# will be truncated when combined with a shorter list, e.g. with
+# dihedral definitions, which are not present for coil and termini
+#
+ss_names = {
+ "F": "Collagenous Fiber",                                                                  #@#
+ "E": "Extended structure (beta sheet)",                                                    #@#
+ "H": "Helix structure",                                                                    #@#
+ "1": "Helix start (H-bond donor)",                                                         #@#
+ "2": "Helix end (H-bond acceptor)",                                                        #@#
+ "3": "Ambivalent helix type (short helices)",                                              #@#
+ "T": "Turn",                                                                               #@#
+ "S": "Bend",                                                                               #@#
+ "C": "Coil",                                                                               #@#
+}
+
+bbss     =    spl("  F     E     H     1     2     3     T     S     C")  # SS one letter 
+
+
+# The following dictionary contains secondary structure types as assigned by
+# different programs. The corresponding Martini secondary structure types are               
+# listed in cgss                                                                            
+#                                                                                           
+# NOTE:                                                                                     
+#  Each list of letters in the dictionary ss should exactly match the list                  
+#  in cgss.                                                                                 
+#                                                                                           
+ssdefs = {
+    "dssp":  list(".HGIBETSC~"),             # DSSP one letter secondary structure code     #@#
+    "pymol": list(".H...S...L"),             # Pymol one letter secondary structure code    #@# 
+    "gmx":   list(".H...ETS.C"),             # Gromacs secondary structure dump code        #@#    
+    "self":  list("FHHHEETSCC")              # Internal CG secondary structure codes        #@#
+}
+cgss     =   list("FHHHEETSCC")              # Corresponding CG secondary structure types   #@#
+
+
+#----+-------------------------------------------+
+## B | SECONDARY STRUCTURE PATTERN SUBSTITUTIONS |
+#----+-------------------------------------------+
+
+
+# For all structure types specific dihedrals may be used if four or
+# more consecutive residues are assigned that type.                
+
+# Helix start and end regions are special and require assignment of
+# specific types. The following pattern substitutions are applied 
+# (in the given order). A dot matches any other type.             
+# Patterns can be added to the dictionaries. This only makes sense
+# if for each key in patterns there is a matching key in pattypes.
+patterns = {
+    "H": pat(".H. .HH. .HHH. .HHHH. .HHHHH. .HHHHHH. .HHHHHHH. .HHHH HHHH.")                #@#
+}
+pattypes = {
+    "H": pat(".3. .33. .333. .3333. .13332. .113322. .1113222. .1111 2222.")                #@#
+}
+
+    
+#----+----------+
+## C | INTERNAL |
+#----+----------+
+
+
+# Pymol Colors
+#           F   E   H   1   2   3   T   S   C
+ssnum  = ( 13,  4,  2,  2,  2,  2,  6, 22,  0 )                                             #@#
+
+# Dictionary returning a number for a given type of secondary structure
+# This can be used for setting the b-factor field for coloring         
+ss2num = hash(bbss,ssnum)                                                                   
+
+
+# List of programs for which secondary structure definitions can be processed
+programs = ssdefs.keys()                                                                    
+
+
+# Dictionaries mapping ss types to the CG ss types                                          
+ssd = dict([ (i, hash(ssdefs[i],cgss)) for i in programs ])                                 
+
+
+# From the secondary structure dictionaries we create translation tables
+# with which all secondary structure types can be processed. Anything
+# not listed above will be mapped to C (coil).
+# Note, a translation table is a list of 256 characters to map standard  
+# ascii characters to.
+def tt(program):                                                                            
+    return  "".join([ssd[program].get(chr(i),"C") for i in range(256)])                     
+
+
+# The translation table depends on the program used to obtain the 
+# secondary structure definitions
+sstt = dict([(i,tt(i)) for i in programs])                                                  
+
+
+# The following translation tables are used to identify stretches of 
+# a certain type of secondary structure. These translation tables have
+# every character, except for the indicated secondary structure, set to
+# \x00. This allows summing the sequences after processing to obtain
+# a single sequence summarizing all the features.
+null = "\x00"                                                                               
+sstd = dict([ (i,ord(i)*null+i+(255-ord(i))*null) for i in cgss ])                          
+
+
+# Pattern substitutions
+def typesub(seq,patterns,types):                                                            
+    seq = null+seq+null
+    for i,j in zip(patterns,types):                                                         
+        seq = seq.replace(i,j)                                                              
+    return seq[1:-1]                                                                              
+
+
+# The following function translates a string encoding the secondary structure
+# to a string of corresponding Martini types, taking the origin of the 
+# secondary structure into account, and replacing termini if requested.
+def ssClassification(ss,program="dssp"):                                                    
+    # Translate dssp/pymol/gmx ss to Martini ss                                             
+    ss  = ss.translate(sstt[program])                                                       
+    # Separate the different secondary structure types                                      
+    sep = dict([(i,ss.translate(sstd[i])) for i in sstd.keys()])                            
+    # Do type substitutions based on patterns                                               
+    # If the ss type is not in the patterns lists, do not substitute                        
+    # (use empty lists for substitutions)                                                   
+    typ = [ typesub(sep[i],patterns.get(i,[]),pattypes.get(i,[]))                           
+            for i in sstd.keys()]                                                           
+    # Translate all types to numerical values                                               
+    typ = [ [ord(j) for j in list(i)] for i in typ ]                                        
+    # Sum characters back to get a full typed sequence                                      
+    typ = "".join([chr(sum(i)) for i in zip(*typ)])                                         
+    # Return both the actual as well as the fully typed sequence                             
+    return ss, typ                                                                          
+
+
+# The following functions are for determination of secondary structure, 
+# given a list of atoms. The atom format is generic and can be written out
+# as PDB or GRO. The coordinates are in Angstrom.
+# NOTE: There is the *OLD* DSSP and the *NEW* DSSP, which require 
+# different calls. The old version uses '--' to indicate reading from stdin
+# whereas the new version uses '-i /dev/stdin'
+def call_dssp(chain,atomlist,executable='dsspcmbi'):
+    '''Get the secondary structure, by calling to dssp'''
+    ssdfile = 'chain_%s.ssd'%chain.id 
+
+    try:
+        if os.system(executable+" -V >/dev/null"):
+            logging.debug("New version of DSSP; Executing '%s -i /dev/stdin -o %s'"%(executable,ssdfile))
+            p = subp.Popen([executable,"-i","/dev/stdin","-o",ssdfile],stderr=subp.PIPE,stdout=subp.PIPE,stdin=subp.PIPE)
+        else:
+            logging.debug("Old version of DSSP; Executing '%s -- %s'"%(executable,ssdfile))
+            p = subp.Popen([executable,"--",ssdfile],stderr=subp.PIPE,stdout=subp.PIPE,stdin=subp.PIPE)
+    except OSError:
+        logging.error("A problem occured calling %s."%executable)
+        sys.exit(1)
+
+    for atom in atomlist: 
+        if atom[0][:2] == 'O1': atom=('O',)+atom[1:]
+        if atom[0][0]!='H' and atom[0][:2]!='O2': p.stdin.write(pdbOut(atom))
+    p.stdin.write('TER\n')
+    data = p.communicate()
+    p.wait()
+    main,ss = 0,''
+    for line in open(ssdfile).readlines(): 
+      if main and not line[13] == "!": ss+=line[16]
+      if line[:15] == '  #  RESIDUE AA': main=1
+    return ss
+     
+ssDetermination = {
+    "dssp": call_dssp
+    }
+
+class martini22nucleic:
+    def __init__(self):
+
+        # parameters are defined here for the following forcefield:
+        self.name = 'martini22nucleic'
+        
+        # Charged types:
+        self.charges = {"Qd":1, "Qa":-1, "SQd":1, "SQa":-1, "RQd":1, "AQa":-1}                                                           #@#
+        self.bbcharges = {"BB1":-1}                                                                                                      #@#
+        
+        ##################
+        # DNA PARAMETERS #
+        ##################
+
+        # DNA BACKBONE PARAMETERS
+        self.dna_bb = {
+            'atom'  : spl("Q0 SN0 SC2"),
+            'bond'  : [(1,  0.360, 20000),          
+                       (1,  0.198, 80000),          
+                       (1,  0.353, 10000)],         
+            'angle' : [(2,  110.0, 200),            
+                       (2,  102.0, 150),           
+                       (2,  106.0,  75)],           
+            'dih'   : [(2,   95.0,  25),
+                       (1,  180.0,   2, 3),
+                       (9,   85.0,   2, 2,  9,  160.0,  2, 3)],
+            'excl'  : [(), (), ()],
+            'pair'  : [],
+        }
+        # DNA BACKBONE CONNECTIVITY
+        self.dna_con  = {
+            'bond'  : [(0, 1),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0),(2, 1)],
+            'pair'  : [],
+        }
+
+        # For bonds, angles, and dihedrals the first parameter should always 
+        # be the type. It is pretty annoying to check the connectivity from 
+        # elsewhere so we update these one base at a time.
+
+        # ADENINE
+        self.bases = {
+            "DA": [spl("TN0 TA2 TA3 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.229,  None), (1,  0.266,  None),             # BONDS
+                    (1,  0.326, 20000), (1,  0.288,  None), (1,  0.162,  None),],     
+                   [(2,   94.0,   250), (2,  160.0,   200), (2,  140.0,   200),             # ANGLES
+                    (1,   85.0,   200), (2,  158.0,   200), (1,  125.0,   200),
+                    (1,   74.0,   200), (1,   98.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -116.0,   0.5), (2,   98.0,    15)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS
+            }
+        self.base_connectivity = {
+            "DA": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),],                # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],
+                   []],                                                                     # PAIRS                     
+            }
+
+        # CYTOSINE
+        self.bases.update({
+            "DC": [spl("TN0 TY2 TY3"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.220,  None), (1,  0.285,  None),             # BONDS
+                    (1,  0.268,  None),],
+                   [(2,   95.0,   210), (2,   95.0,   300), (1,  150.0,   500),             # ANGLES
+                    (1,  180.0,    30), (1,   61.0,   200), (1,   71.0,   200), 
+                    (1,   47.0,   200)],
+                   [(2,  -78.0,    25), (2,  -90.0,    20), (2, -142.0,    50)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DC": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5)],                  # DIHEDRALS
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # GUANINE
+        self.bases.update({
+            "DG": [spl("TN0 TG2 TG3 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.295,  None), (1,  0.295,  None),             # BONDS
+                    (1,  0.389, 20000), (1,  0.285,  None), (1,  0.161,  None),],     
+                   [(2,   94.5,   250), (2,  137.0,   300), (2,  130.0,   250),             # ANGLES
+                    (1,   69.5,   200), (2,  157.0,   150), (1,  125.0,   200),
+                    (1,   84.0,   200), (1,   94.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -117.0,     1), (2,   92.0,    15)],            # DIHEDRALS  
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DG": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),],                 # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # THYMINE
+        self.bases.update({
+            "DT": [spl("TN0 TT2 TT3"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.217,  None), (1,  0.322,  None),             # BONDS
+                    (1,  0.265,  None),],
+                   [(2,   92.0,   220), (2,  107.0,   300), (1,  145.0,   400),             # ANGLES
+                    (1,  180.0,    30), (1,   55.0,   100), (1,   83.0,   100),
+                    (1,   42.0,   100)],
+                   [(2,  -75.0,    40), (2, -110.0,    15), (2, -145.0,    65)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DT": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5)],                  # DIHEDRALS
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        ##################
+        # RNA PARAMETERS #
+        ##################
+
+        # RNA BACKBONE PARAMETERS
+        self.rna_bb = {
+            'atom'  : spl("Q0 SN0 SNda"),     # Have a look at BB3 bead type
+            'bond'  : [(1,  0.363, 20000),          
+                       (1,  0.202, 40000),    #8  , 0.202 50000    
+                       (1,  0.354, 10000)],         
+            'angle' : [(2,  117.0, 175),      #2, 117.0, 140       
+                       (2,   95.0, 105),           
+                       (1,   93.0,  75)],           
+            'dih'   : [(2,    0.0, 3.5),
+                       (1,    0.0,   1, 4),
+                       (9,  -10.0, 1.5, 2,  9,  10.0, 1.5, 2)],
+            'excl'  : [(), (), ()],
+            'pair'  : [],
+        }
+        # RNA BACKBONE CONNECTIVITY
+        self.rna_con  = {
+            'bond'  : [(0, 1),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0),(2, 1)],
+            'pair'  : [],
+        }
+
+        # For bonds, angles, and dihedrals the first parameter should always 
+        # be the type. It is pretty annoying to check the connectivity from 
+        # elsewhere so we update these one base at a time.
+
+        # ADENINE
+        self.bases.update({
+            "A":  [spl("TN0 TA2 TA3 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.293, 28000), (1,  0.234,  None), (1,  0.263,  None),             # BONDS 
+                    (1,  0.335, 40000), (1,  0.299,  None), (1,  0.162,  None),],     
+                   [(2,  101.0,   260), (2,  153.0,    90), (2,  135.0,   185),             # ANGLES
+                    (1,   87.0,   200), (2,  160.0,    15), (1,  115.0,   200),
+                    (1,   74.0,   200), (1,   92.0,   200)],                           
+                   [(2,  180.0,   1.5), (1,  -40.0,  4, 2), (1,  -10.0,  5, 2),             # DIHEDRALS
+                    (2,  180.0,     0), (2,  180.0,     2), (2,   80.0,   0.5),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS
+            })
+        self.base_connectivity.update({
+            "A":  [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3),],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),                   # DIHEDRALS        
+                    (0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],
+                   []],                                                                     # PAIRS                     
+            })
+
+        # CYTOSINE
+        self.bases.update({
+            "C":  [spl("TN0 TY2 TY3"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.280, 11000), (1,  0.224,  None), (1,  0.281,  None),             # BONDS
+                    (1,  0.267,  None),],
+                   [(2,   94.0,   230), (2,  103.0,   170), (1,  155.0,   100),             # ANGLES
+                    (1,  130.0,   0.5), (1,   61.0,   200), (1,   71.0,   200), 
+                    (1,   47.0,   200)],
+                   [(1,   55.0,  3,  2), (2,  180.0,     3), (2, -130.0,      1),           # DIHEDRALS
+                    (1,    0.0,  2,  6)],                                                   
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "C":  [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (0, 1, 2, 3),                     # DIHEDRALS
+                    (1, 2, 3, 4)],                                                          
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # GUANINE
+        self.bases.update({
+            "G":  [spl("TN0 TG2 TG3 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.292, 20000), (1,  0.296,  None), (1,  0.291,  None),             # BONDS
+                    (1,  0.385, 40000), (1,  0.296,  None), (1,  0.162,  None),],     
+                   [(2,  103.0,   260), (2,  129.0,    80), (2,  137.0,   120),             # ANGLES
+                    (1,   72.0,   200), (2,  170.0,    20), (1,  117.0,   200),
+                    (1,   84.0,   200), (1,   96.5,   200)],                           
+                   [(1,  -20.0,  1, 2), (2,  180.0,   3.5), (1,    0.0,     5, 2),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS  
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "G":  [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3),],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # URACIL
+        self.bases.update({
+            "U":  [spl("TN0 TT2 TT3"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.286, 18000), (1,  0.224,  None), (1,  0.289,  None),             # BONDS
+                    (1,  0.276,  None),],
+                   [(2,   95.0,   225), (2,   99.0,   200), (1,  155.0,   100),             # ANGLES
+                    (1,  180.0,     5), (1,   55.0,   100), (1,   83.0,   100),
+                    (1,   42.0,   100)],
+                   [(1,    0.0,  2, 2), (2,  180.0,     4), (1,    0.0,  2, 6)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "U":  [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (1, 2, 3, 4)],                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        #----+----------------+
+        ## D | SPECIAL BONDS  |
+        #----+----------------+
+        
+        self.special = {
+            # Used for sulfur bridges
+            # ATOM 1         ATOM 2          BOND LENGTH   FORCE CONSTANT
+            (("SC1","CYS"), ("SC1","CYS")):     (0.39,         5000),
+            }
+        
+        # By default use an elastic network
+        self.ElasticNetwork = False 
+
+        # Elastic networks bond shouldn't lead to exclusions (type 6) 
+        # But Elnedyn has been parametrized with type 1.
+        self.EBondType = 6
+        
+        #----+----------------+
+        ## D | INTERNAL STUFF |
+        #----+----------------+
+
+        ## DNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between DNA backbone beads
+        self.dnaBbBondDictC = dict(zip(self.dna_con['bond'],self.dna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between DNA backbone beads
+        self.dnaBbAngleDictC = dict(zip(self.dna_con['angle'],self.dna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between DNA backbone beads
+        self.dnaBbDihDictC = dict(zip(self.dna_con['dih'],self.dna_bb['dih']))
+        # Dictionary for exclusions for DNA backbone beads
+        self.dnaBbExclDictC = dict(zip(self.dna_con['excl'],self.dna_bb['excl']))
+        # Dictionary for pairs for DNA backbone beads
+        self.dnaBbPairDictC = dict(zip(self.dna_con['pair'],self.dna_bb['pair']))
+
+        ## RNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between rna backbone beads
+        self.rnaBbBondDictC = dict(zip(self.rna_con['bond'],self.rna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between rna backbone beads
+        self.rnaBbAngleDictC = dict(zip(self.rna_con['angle'],self.rna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between rna backbone beads
+        self.rnaBbDihDictC = dict(zip(self.rna_con['dih'],self.rna_bb['dih']))
+        # Dictionary for exclusions for rna backbone beads
+        self.rnaBbExclDictC = dict(zip(self.rna_con['excl'],self.rna_bb['excl']))
+        # Dictionary for pairs for rna backbone beads
+        self.rnaBbPairDictC = dict(zip(self.rna_con['pair'],self.rna_bb['pair']))
+        
+        
+    # The following function returns the backbone bead for a given residue and                   
+    # secondary structure type.                                                                 
+    # 1. Check if the residue is DNA/RNA and return the whole backbone for those
+    # 2. Look up the proper dictionary for the residue                                          
+    # 3. Get the proper type from it for the secondary structure                                
+    # If the residue is not in the dictionary of specials, use the default                      
+    # If the secondary structure is not listed (in the residue specific                         
+    # dictionary) revert to the default.                                                        
+    def bbGetBead(self,r1,ss="C"):                                                               
+        if r1 in dnares3:
+            return self.dna_bb['atom']
+        elif r1 in rnares3:
+            return self.rna_bb['atom']
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetBond(self,r,ca,ss):
+        # Retrieve parameters for each residue from tables defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbBondDictC.keys() and self.dnaBbBondDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbBondDictC.keys() and self.rnaBbBondDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetAngle(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbAngleDictC.keys() and self.dnaBbAngleDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbAngleDictC.keys() and self.rnaBbAngleDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetExclusion(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbExclDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbExclDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetPair(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbPairDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbPairDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetDihedral(self,r,ca,ss):
+        # Retrieve parameters for each residue from table defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbDihDictC.keys() and self.dnaBbDihDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbDihDictC.keys() and self.rnaBbDihDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def getCharge(self,atype,aname):
+        return self.charges.get(atype,self.bbcharges.get(aname,0))
+        
+    def messages(self):
+        '''Prints any force-field specific logging messages.'''
+        import logging
+        logging.warning('################################################################################')
+        logging.warning('This is a beta of Martini-nucleotide and should NOT be used for production runs.')
+        logging.warning('################################################################################')
+        pass
+
+
+class elnedyn22nucleic:
+    def __init__(self):
+
+        # parameters are defined here for the following (protein) forcefields:
+        self.name = 'elnedyn22nucleic'
+        
+        # Charged types:
+        self.charges = {"Qd":1, "Qa":-1, "SQd":1, "SQa":-1, "RQd":1, "AQa":-1}                                                           #@#
+        self.bbcharges = {"BB1":-1}                                                                                                      #@#
+        
+        # Not all (eg Elnedyn) forcefields use backbone-backbone-sidechain angles and BBBB-dihedrals.
+        self.UseBBSAngles          = False 
+        self.UseBBBBDihedrals      = False
+        
+        ##################
+        # DNA PARAMETERS #
+        ##################
+
+        # DNA BACKBONE PARAMETERS
+        self.dna_bb = {
+            'atom'  : spl("Q0 SN0 SC2"),
+            'bond'  : [(1,  0.360, 20000),          
+                       (1,  0.198, 80000),          
+                       (1,  0.353, 10000)],         
+            'angle' : [(2,  110.0, 200),            
+                       (2,  102.0, 150),           
+                       (2,  106.0,  75)],           
+            'dih'   : [(2,   95.0,  25),
+                       (1,  180.0,   2, 3),
+                       (9,   85.0,   2, 2,  9,  160.0,  2, 3)],
+            'excl'  : [(), (), ()],
+            'pair'  : [],
+        }
+        # DNA BACKBONE CONNECTIVITY
+        self.dna_con  = {
+            'bond'  : [(0, 1),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0),(2, 1)],
+            'pair'  : [],
+        }
+
+        # For bonds, angles, and dihedrals the first parameter should always 
+        # be the type. It is pretty annoying to check the connectivity from 
+        # elsewhere so we update these one base at a time.
+
+        # ADENINE
+        self.bases = {
+            "DA": [spl("TN0 TA2 TA3 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.229,  None), (1,  0.266,  None),             # BONDS
+                    (1,  0.326, 20000), (1,  0.288,  None), (1,  0.162,  None),],     
+                   [(2,   94.0,   250), (2,  160.0,   200), (2,  140.0,   200),             # ANGLES
+                    (1,   85.0,   200), (2,  158.0,   200), (1,  125.0,   200),
+                    (1,   74.0,   200), (1,   98.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -116.0,   0.5), (2,   98.0,    15)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS
+            }
+        self.base_connectivity = {
+            "DA": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),],                # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],
+                   []],                                                                     # PAIRS                     
+            }
+
+        # CYTOSINE
+        self.bases.update({
+            "DC": [spl("TN0 TY2 TY3"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.220,  None), (1,  0.285,  None),             # BONDS
+                    (1,  0.268,  None),],
+                   [(2,   95.0,   210), (2,   95.0,   300), (1,  150.0,   500),             # ANGLES
+                    (1,  180.0,    30), (1,   61.0,   200), (1,   71.0,   200), 
+                    (1,   47.0,   200)],
+                   [(2,  -78.0,    25), (2,  -90.0,    20), (2, -142.0,    50)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DC": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5)],                  # DIHEDRALS
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # GUANINE
+        self.bases.update({
+            "DG": [spl("TN0 TG2 TG3 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.295,  None), (1,  0.295,  None),             # BONDS
+                    (1,  0.389, 20000), (1,  0.285,  None), (1,  0.161,  None),],     
+                   [(2,   94.5,   250), (2,  137.0,   300), (2,  130.0,   250),             # ANGLES
+                    (1,   69.5,   200), (2,  157.0,   150), (1,  125.0,   200),
+                    (1,   84.0,   200), (1,   94.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -117.0,     1), (2,   92.0,    15)],            # DIHEDRALS  
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DG": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),],                 # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # THYMINE
+        self.bases.update({
+            "DT": [spl("TN0 TT2 TT3"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.217,  None), (1,  0.322,  None),             # BONDS
+                    (1,  0.265,  None),],
+                   [(2,   92.0,   220), (2,  107.0,   300), (1,  145.0,   400),             # ANGLES
+                    (1,  180.0,    30), (1,   55.0,   100), (1,   83.0,   100),
+                    (1,   42.0,   100)],
+                   [(2,  -75.0,    40), (2, -110.0,    15), (2, -145.0,    65)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "DT": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5)],                  # DIHEDRALS
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        ##################
+        # RNA PARAMETERS #
+        ##################
+
+        # RNA BACKBONE PARAMETERS
+        self.rna_bb = {
+            'atom'  : spl("Q0 SN0 SNda"),     # Have a look at BB3 bead type
+            'bond'  : [(1,  0.363, 20000),          
+                       (1,  0.202, 40000),    #8  , 0.202 50000    
+                       (1,  0.354, 10000)],         
+            'angle' : [(2,  117.0, 175),      #2, 117.0, 140       
+                       (2,   95.0, 105),           
+                       (1,   93.0,  75)],           
+            'dih'   : [(2,    0.0, 3.5),
+                       (1,    0.0,   1, 4),
+                       (9,  -10.0, 1.5, 2,  9,  10.0, 1.5, 2)],
+            'excl'  : [(), (), ()],
+            'pair'  : [],
+        }
+        # RNA BACKBONE CONNECTIVITY
+        self.rna_con  = {
+            'bond'  : [(0, 1),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0),(2, 1)],
+            'pair'  : [],
+        }
+
+        # For bonds, angles, and dihedrals the first parameter should always 
+        # be the type. It is pretty annoying to check the connectivity from 
+        # elsewhere so we update these one base at a time.
+
+        # ADENINE
+        self.bases.update({
+            "A":  [spl("TN0 TA2 TA3 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.293, 28000), (1,  0.234,  None), (1,  0.263,  None),             # BONDS 
+                    (1,  0.335, 40000), (1,  0.299,  None), (1,  0.162,  None),],     
+                   [(2,  101.0,   260), (2,  153.0,    90), (2,  135.0,   185),             # ANGLES
+                    (1,   87.0,   200), (2,  160.0,    15), (1,  115.0,   200),
+                    (1,   74.0,   200), (1,   92.0,   200)],                           
+                   [(2,  180.0,   1.5), (1,  -40.0,  4, 2), (1,  -10.0,  5, 2),             # DIHEDRALS
+                    (2,  180.0,     0), (2,  180.0,     2), (2,   80.0,   0.5),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS
+            })
+        self.base_connectivity.update({
+            "A":  [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3),],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),                   # DIHEDRALS        
+                    (0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],
+                   []],                                                                     # PAIRS                     
+            })
+
+        # CYTOSINE
+        self.bases.update({
+            "C":  [spl("TN0 TY2 TY3"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.280, 11000), (1,  0.224,  None), (1,  0.281,  None),             # BONDS
+                    (1,  0.267,  None),],
+                   [(2,   94.0,   230), (2,  103.0,   170), (1,  155.0,   100),             # ANGLES
+                    (1,  130.0,   0.5), (1,   61.0,   200), (1,   71.0,   200), 
+                    (1,   47.0,   200)],
+                   [(1,   55.0,  3,  2), (2,  180.0,     3), (2, -130.0,      1),           # DIHEDRALS
+                    (1,    0.0,  2,  6)],                                                   
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "C":  [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (0, 1, 2, 3),                     # DIHEDRALS
+                    (1, 2, 3, 4)],                                                          
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # GUANINE
+        self.bases.update({
+            "G":  [spl("TN0 TG2 TG3 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.292, 20000), (1,  0.296,  None), (1,  0.291,  None),             # BONDS
+                    (1,  0.385, 40000), (1,  0.296,  None), (1,  0.162,  None),],     
+                   [(2,  103.0,   260), (2,  129.0,    80), (2,  137.0,   120),             # ANGLES
+                    (1,   72.0,   200), (2,  170.0,    20), (1,  117.0,   200),
+                    (1,   84.0,   200), (1,   96.5,   200)],                           
+                   [(1,  -20.0,  1, 2), (2,  180.0,   3.5), (1,    0.0,     5, 2),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS  
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "G":  [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3),],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # URACIL
+        self.bases.update({
+            "U":  [spl("TN0 TT2 TT3"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.286, 18000), (1,  0.224,  None), (1,  0.289,  None),             # BONDS
+                    (1,  0.276,  None),],
+                   [(2,   95.0,   225), (2,   99.0,   200), (1,  155.0,   100),             # ANGLES
+                    (1,  180.0,     5), (1,   55.0,   100), (1,   83.0,   100),
+                    (1,   42.0,   100)],
+                   [(1,    0.0,  2, 2), (2,  180.0,     4), (1,    0.0,  2, 6)],            # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "U":  [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (1, 2, 3, 4)],                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+        
+        # By default use an elastic network
+        self.ElasticNetwork = True  
+
+        # Elastic networks bond shouldn't lead to exclusions (type 6) 
+        # But Elnedyn has been parametrized with type 1.
+        self.EBondType = 6
+        
+        #----+----------------+
+        ## D | INTERNAL STUFF |
+        #----+----------------+
+
+        ## DNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between DNA backbone beads
+        self.dnaBbBondDictC = dict(zip(self.dna_con['bond'],self.dna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between DNA backbone beads
+        self.dnaBbAngleDictC = dict(zip(self.dna_con['angle'],self.dna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between DNA backbone beads
+        self.dnaBbDihDictC = dict(zip(self.dna_con['dih'],self.dna_bb['dih']))
+        # Dictionary for exclusions for DNA backbone beads
+        self.dnaBbExclDictC = dict(zip(self.dna_con['excl'],self.dna_bb['excl']))
+        # Dictionary for pairs for DNA backbone beads
+        self.dnaBbPairDictC = dict(zip(self.dna_con['pair'],self.dna_bb['pair']))
+
+        ## RNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between rna backbone beads
+        self.rnaBbBondDictC = dict(zip(self.rna_con['bond'],self.rna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between rna backbone beads
+        self.rnaBbAngleDictC = dict(zip(self.rna_con['angle'],self.rna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between rna backbone beads
+        self.rnaBbDihDictC = dict(zip(self.rna_con['dih'],self.rna_bb['dih']))
+        # Dictionary for exclusions for rna backbone beads
+        self.rnaBbExclDictC = dict(zip(self.rna_con['excl'],self.rna_bb['excl']))
+        # Dictionary for pairs for rna backbone beads
+        self.rnaBbPairDictC = dict(zip(self.rna_con['pair'],self.rna_bb['pair']))
+        
+        
+    # The following function returns the backbone bead for a given residue and                   
+    # secondary structure type.                                                                 
+    # 1. Check if the residue is DNA/RNA and return the whole backbone for those
+    # 2. Look up the proper dictionary for the residue                                          
+    # 3. Get the proper type from it for the secondary structure                                
+    # If the residue is not in the dictionary of specials, use the default                      
+    # If the secondary structure is not listed (in the residue specific                         
+    # dictionary) revert to the default.                                                        
+    def bbGetBead(self,r1,ss="C"):                                                               
+        if r1 in dnares3:
+            return self.dna_bb['atom']
+        elif r1 in rnares3:
+            return self.rna_bb['atom']
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetBond(self,r,ca,ss):
+        # Retrieve parameters for each residue from tables defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbBondDictC.keys() and self.dnaBbBondDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbBondDictC.keys() and self.rnaBbBondDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetAngle(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbAngleDictC.keys() and self.dnaBbAngleDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbAngleDictC.keys() and self.rnaBbAngleDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetExclusion(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbExclDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbExclDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetPair(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbPairDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbPairDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetDihedral(self,r,ca,ss):
+        # Retrieve parameters for each residue from table defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbDihDictC.keys() and self.dnaBbDihDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbDihDictC.keys() and self.rnaBbDihDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def getCharge(self,atype,aname):
+        return self.charges.get(atype,self.bbcharges.get(aname,0))
+        
+    def messages(self):
+        '''Prints any force-field specific logging messages.'''
+        import logging
+        logging.warning('################################################################################')
+        logging.warning('This is a beta of Martini-nucleotide and should NOT be used for production runs.')
+        logging.warning('################################################################################')
+        pass
+
+
+class dna22plot:
+    def __init__(self):
+
+        # parameters are defined here for the following (protein) forcefields:
+        self.name = 'rna22plot'
+        
+        # Charged types:
+        self.charges = {"Qd":1, "Qa":-1, "SQd":1, "SQa":-1, "RQd":1, "AQa":-1}                                                           #@#
+        self.bbcharges = {"BB1":-1}                                                                                                      #@#
+
+        # DNA BACKBONE PARAMETERS
+        self.dna_bb = {
+            'atom'  : FUNC.spl("Q0 SN0 SC2"),
+            'bond'  : [(1,  0.360, 30000),          
+                       (1,  0.400, 10000),          
+                       (1,  0.200, 50000),          
+                       (1,  0.355, 10000)],         
+            'angle' : [(2,  115.0,  85),           
+                       (2,  102.0, 105),           
+                       (2,  110.0,  60)],           
+            'dih'   : [(2,  100.0,  1),           
+                       (2, -120.0,  5),           
+                       (2,  140.0,  5)],          
+            'excl'  : [(), (), ()],
+        }
+        # DNA BACKBONE CONNECTIVITY
+        self.dna_con  = {
+            'bond'  : [(0, 1),
+                       (0, 2),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0), (2, 1)],
+        }
+        # ADENINE
+        self.bases = {
+            "DA": [FUNC.spl("TNa TNa TP1 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.330, 30000), (1,  0.229, 30000), (1,  0.266, 30000),             # BONDS BB3-SC1 bond lengthened by 0.030 nm.
+                    (1,  0.325, 30000), (1,  0.288, 30000), (1,  0.162, 30000),],     
+                   [(2,   93.0,   250), (2,  160.0,   200), (2,  140.0,   200),             # ANGLES
+                    (2,   85.0,   200), (2,  148.0,   350), (2,  125.0,   200),
+                    (2,   74.0,   200), (2,   98.0,   200)],                           
+                   [(2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1)],
+                   [(2,    0.0,   500)],                                                    # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()]],               # EXCLUSIONS
+            }
+        self.base_connectivity = {
+            "DA": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (0, 2, 3, 4),       (0, 2, 3, 6),                  # DIHEDRALS        
+                    (1, 2, 3, 4),       (1, 2, 3, 6),       (2, 8, 9,10),
+                    (3, 2, 7, 8),       (3, 2, 7, 9),       (3, 2, 7,10),
+                    (3, 7, 8,10),       (3, 8, 9,10),       (4, 2, 7, 8),
+                    (7, 2, 3, 4),       (7, 2, 3, 6)],
+                   [(3, 4, 5, 6)],                                                          # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)]],                                           
+            }
+
+        # CYTOSINE
+        self.bases.update({
+            "DC": [FUNC.spl("TNa TPa TPd"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.290, 30000), (1,  0.220, 30000), (1,  0.285, 30000),             # BONDS BB3-SC1 bond lenghtened by 0.020 nm.
+                    (1,  0.268, 30000),],
+                   [(2,   93.0,   200), (2,  108.0,   250), (2,  170.0,   350),             # ANGLES
+                    (2,  180.0,     1), (2,   62.0,   200), (2,   71.0,   200), 
+                    (2,   47.0,   200), (2,  100.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1)],
+                   [(2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1)],
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()]],                                   # EXCLUSIONS
+        })
+        self.base_connectivity.update({
+            "DC": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3),        (1, 3, 5),          (1, 5, 3),
+                    (2, 3, 6),        (2, 1, 3),          (2, 1, 5)],
+                   [(0, 1, 2, 3),       (0, 2, 3, 4),       (0, 2, 3, 5),                  # DIHEDRALS        
+                    (1, 2, 3, 4),       (1, 2, 3, 5),       (2, 7, 8, 9),
+                    (3, 2, 6, 7),       (3, 2, 6, 8),       (3, 2, 6, 9),
+                    (3, 6, 7, 9),       (3, 7, 8, 9),       (4, 2, 6, 7),
+                    (6, 2, 3, 4),       (6, 2, 3, 5),       (2, 1, 3, 5),
+                    (2, 1, 5, 3)],
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)]],                                           
+        })
+
+        # GUANINE
+        self.bases.update({
+            "DG": [FUNC.spl("TNa TPd TP1 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.295, 30000), (1,  0.295, 30000),             # BONDS BB3-SC1 bond stays the same.
+                    (1,  0.390, 30000), (1,  0.285, 30000), (1,  0.161, 30000),],     
+                   [(2,   95.0,   250), (2,  137.0,   300), (2,  128.0,   250),             # ANGLES
+                    (2,   69.0,   200), (2,  145.0,   350), (2,  125.0,   200),
+                    (2,   84.0,   200), (2,   94.0,   200)],                           
+                   [(2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1)],
+                   [(2,    0.0,   150)],                                                    # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()]],               # EXCLUSIONS
+        })
+        self.base_connectivity.update({
+            "DG": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (0, 2, 3, 4),       (0, 2, 3, 6),                  # DIHEDRALS        
+                    (1, 2, 3, 4),       (1, 2, 3, 6),       (2, 8, 9,10),
+                    (3, 2, 7, 8),       (3, 2, 7, 9),       (3, 2, 7,10),
+                    (3, 7, 8,10),       (3, 8, 9,10),       (4, 2, 7, 8),
+                    (7, 2, 3, 4),       (7, 2, 3, 6)],
+                   [(3, 4, 5, 6)],                                                          # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)]],                                           
+        })
+
+        # THYMINE
+        self.bases.update({
+            "DT": [FUNC.spl("TNa TP1 TPa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.310, 30000), (1,  0.217, 30000), (1,  0.322, 30000),             # BONDS BB3-SC1 bond lengthened by 0.040 nm.
+                    (1,  0.265, 30000),],
+                   [(2,   93.0,   250), (2,  108.0,   350), (2,  165.0,   550),             # ANGLES
+                    (2,  165.0,   400), (2,   55.0,   200), (2,   83.0,   200),
+                    (2,   42.0,   200), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1)],
+                   [(2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1),
+                    (2,    0.0,     1), (2,    0.0,     1), (2,    0.0,     1)],
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()]],                                   # EXCLUSIONS
+        })
+        self.base_connectivity.update({
+            "DT": [[(2, 3),           (3, 4),             (4, 5),                         # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (2, 3, 5),                      # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3),        (2, 3, 6),          (1, 3, 5),
+                    (2, 1, 3),        (2, 1, 5)],
+                   [(0, 1, 2, 3),       (0, 2, 3, 4),       (0, 2, 3, 5),                  # DIHEDRALS        
+                    (1, 2, 3, 4),       (1, 2, 3, 5),       (2, 7, 8, 9),
+                    (3, 2, 6, 7),       (3, 2, 6, 8),       (3, 2, 6, 9),
+                    (3, 6, 7, 9),       (3, 7, 8, 9),       (4, 2, 6, 7),
+                    (6, 2, 3, 4),       (6, 2, 3, 5),       (2, 1, 3, 5)],
+                   [],                                                                    # IMPROPERS
+                   [],                                                                    # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)]],                                           
+        })
+
+        # By default use an elastic network
+        self.ElasticNetwork = False 
+
+        # Elastic networks bond shouldn't lead to exclusions (type 6) 
+        # But Elnedyn has been parametrized with type 1.
+        self.EBondType = 6
+        
+        #----+----------------+
+        ## D | INTERNAL STUFF |
+        #----+----------------+
+
+        ## RNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between rna backbone beads
+        self.rnaBbBondDictC = dict(zip(self.rna_con['bond'],self.rna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between rna backbone beads
+        self.rnaBbAngleDictC = dict(zip(self.rna_con['angle'],self.rna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between rna backbone beads
+        self.rnaBbDihDictC = dict(zip(self.rna_con['dih'],self.rna_bb['dih']))
+        # Dictionary for exclusions for rna backbone beads
+        self.rnaBbExclDictC = dict(zip(self.rna_con['excl'],self.rna_bb['excl']))
+        # Dictionary for pairs for rna backbone beads
+        self.rnaBbPairDictC = dict(zip(self.rna_con['pair'],self.rna_bb['pair']))
+        
+
+    # The following function returns the backbone bead for a given residue and                   
+    # secondary structure type.                                                                 
+    # 1. Check if the residue is DNA/RNA and return the whole backbone for those
+    # 2. Look up the proper dictionary for the residue                                          
+    # 3. Get the proper type from it for the secondary structure                                
+    # If the residue is not in the dictionary of specials, use the default                      
+    # If the secondary structure is not listed (in the residue specific                         
+    # dictionary) revert to the default.                                                        
+    def bbGetBead(self,r1,ss="C"):                                                               
+        if r1 in dnares3:
+            return self.dna_bb['atom']
+        elif r1 in rnares3:
+            return self.rna_bb['atom']
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetBond(self,r,ca,ss):
+        # Retrieve parameters for each residue from tables defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbBondDictC.keys() and self.dnaBbBondDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbBondDictC.keys() and self.rnaBbBondDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetAngle(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbAngleDictC.keys() and self.dnaBbAngleDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbAngleDictC.keys() and self.rnaBbAngleDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetExclusion(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbExclDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbExclDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetPair(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbPairDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbPairDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetDihedral(self,r,ca,ss):
+        # Retrieve parameters for each residue from table defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbDihDictC.keys() and self.dnaBbDihDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbDihDictC.keys() and self.rnaBbDihDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def getCharge(self,atype,aname):
+        return self.charges.get(atype,self.bbcharges.get(aname,0))
+        
+    def messages(self):
+        '''Prints any force-field specific logging messages.'''
+        import logging
+        logging.warning('################################################################################')
+        logging.warning('This is a beta of Martini-nucleotide and should NOT be used for production runs.')
+        logging.warning('################################################################################')
+        pass
+
+
+class rna22plot:
+    def __init__(self):
+
+        # parameters are defined here for the following (protein) forcefields:
+        self.name = 'rna22plot'
+        
+        # Charged types:
+        self.charges = {"Qd":1, "Qa":-1, "SQd":1, "SQa":-1, "RQd":1, "AQa":-1}                                                           #@#
+        self.bbcharges = {"BB1":-1}                                                                                                      #@#
+
+        # RNA BACKBONE PARAMETERS
+        self.rna_bb = {
+            'atom'  : spl("Q0 SN0 SNda"),
+            'bond'  : [(1,  0.360, 20000),          
+                       (1,  0.198, 80000),          
+                       (1,  0.198, 80000),          
+                       (1,  0.353, 10000)],         
+            'angle' : [(2,  110.0, 200),            
+                       (2,  102.0, 150),           
+                       (2,  106.0,  75)],           
+            'dih'   : [(2,   95.0,  25),
+                       (1,  180.0,   2, 3),
+                       (9,   85.0,   2, 2,  9,  160.0,  2, 3)],
+            'excl'  : [(), (), ()],
+            'pair'  : [],
+        }
+        # RNA BACKBONE CONNECTIVITY
+        self.rna_con  = {
+            'bond'  : [(0, 1),
+                       (0, 2),
+                       (1, 2),
+                       (2, 0)],
+            'angle' : [(0, 1, 2),
+                       (1, 2, 0),
+                       (2, 0, 1)],
+            'dih'   : [(0, 1, 2, 0),
+                       (1, 2, 0, 1),
+                       (2, 0, 1, 2)],
+            'excl'  : [(0, 2), (1, 0),(2, 1)],
+            'pair'  : [],
+        }
+
+        # For bonds, angles, and dihedrals the first parameter should always 
+        # be the type. It is pretty annoying to check the connectivity from 
+        # elsewhere so we update these one base at a time.
+
+        # ADENINE
+        self.bases = {
+            "RA": [spl("TN0 TA2 TA3 TNa"),                                      
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.229,  None), (1,  0.266,  None),             # BONDS BB3-SC1 bond lengthened by 0.048 nm.
+                    (1,  0.326, 20000), (1,  0.288,  None), (1,  0.162,  None),],     
+                   [(2,   94.0,   250), (2,  160.0,   200), (2,  140.0,   200),             # ANGLES
+                    (1,   85.0,   200), (2,  158.0,   200), (1,  125.0,   200),
+                    (1,   74.0,   200), (1,   98.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -116.0,   0.5), (2,   98.0,    15),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS
+            }
+        self.base_connectivity = {
+            "RA": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],   
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6),
+                    (4, 5, 6),          (5, 6, 3)], 
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],
+                   []],                                                                     # PAIRS                     
+            }
+
+        # CYTOSINE
+        self.bases.update({
+            "RC": [spl("TN0 TY2 TY3"),                                                     
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.220,  None), (1,  0.285,  None),             # BONDS BB3-SC1 bond lenghtened by 0.033 nm.
+                    (1,  0.268,  None),],
+                   [(2,   95.0,   210), (2,   95.0,   300), (1,  150.0,   500),             # ANGLES
+                    (1,  180.0,    30), (1,   61.0,   200), (1,   71.0,   200), 
+                    (1,   47.0,   200)],
+                   [(2,  -78.0,    25), (2,  -90.0,    20), (2, -142.0,    50),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "RC": [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5),
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5),
+                    (1, 2, 3, 5)],                                                          # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # GUANINE
+        self.bases.update({
+            "RG": [spl("TN0 TG2 TG3 TNa"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.300, 30000), (1,  0.295,  None), (1,  0.295,  None),             # BONDS BB3-SC1 bond lengthened by 0.053 nm.
+                    (1,  0.389, 20000), (1,  0.285,  None), (1,  0.161,  None),],     
+                   [(2,   94.5,   250), (2,  137.0,   300), (2,  130.0,   250),             # ANGLES
+                    (1,   69.5,   200), (2,  157.0,   150), (1,  125.0,   200),
+                    (1,   84.0,   200), (1,   94.0,   200)],                           
+                   [(2,  -90.0,    20), (2, -117.0,     1), (2,   92.0,    15),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS  
+                   [],                                                                      # IMPROPERS 
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), (), (), (), (), (), ()],                # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "RG": [[(2, 3),             (3, 4),             (4, 5),                         # BONDS
+                    (4, 6),             (5, 6),             (6, 3)],
+                   [(1, 2, 3),          (2, 3, 4),          (2, 3, 6),                      # ANGLES
+                    (3, 4, 5),          (3, 2, 7),          (4, 3, 6), 
+                    (4, 5, 6),          (5, 6, 3)],
+                   [(0, 1, 2, 3),       (1, 2, 3, 4),       (1, 2, 3, 6),
+                    (3, 4, 5, 6)],                                                          # DIHEDRALS        
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (0, 6),             (1, 3),             (1, 4),
+                    (1, 5),             (1, 6),             (2, 3),
+                    (2, 4),             (2, 5),             (2, 6),
+                    (3, 5),             (4, 6)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # URACIL
+        self.bases.update({
+            "RU": [spl("TN0 TT2 TT3"),
+            #     TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS TYPE   EQUIL   OPTS
+                   [(1,  0.270, 30000), (1,  0.217,  None), (1,  0.322,  None),             # BONDS BB3-SC1 bond lengthened by 0.056 nm.
+                    (1,  0.265,  None),],
+                   [(2,   92.0,   220), (2,  107.0,   300), (1,  145.0,   400),             # ANGLES
+                    (1,  180.0,    30), (1,   55.0,   100), (1,   83.0,   100),
+                    (1,   42.0,   100)],
+                   [(2,  -75.0,    40), (2, -110.0,    15), (2, -145.0,    65),
+                    (2,    0.0,    10)],                                                    # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(), (), (), (), (), (), (), (), ()],                                    # EXCLUSIONS
+                   []],                                                                     # PAIRS                     
+        })
+        self.base_connectivity.update({
+            "RU": [[(2, 3),           (3, 4),             (4, 5),                           # BONDS
+                    (5, 3)],
+                   [(1, 2, 3),        (2, 3, 4),          (1, 3, 5),                        # ANGLES
+                    (3, 2, 6),        (3, 4, 5),          (4, 3, 5), 
+                    (4, 5, 3)],
+                   [(0, 1, 2, 3),     (1, 2, 3, 4),       (2, 1, 3, 5),
+                    (1, 2, 3, 5)],                                                          # DIHEDRALS
+                   [],                                                                      # IMPROPERS
+                   [],                                                                      # VSITES
+                   [(0, 3),             (0, 4),             (0, 5),                         # EXCLUSIONS
+                    (1, 3),             (1, 4),             (1, 5),             
+                    (2, 3),             (2, 4),             (2, 5)],                                           
+                   []],                                                                     # PAIRS                     
+        })
+
+        # By default use an elastic network
+        self.ElasticNetwork = False 
+
+        # Elastic networks bond shouldn't lead to exclusions (type 6) 
+        # But Elnedyn has been parametrized with type 1.
+        self.EBondType = 6
+        
+        #----+----------------+
+        ## D | INTERNAL STUFF |
+        #----+----------------+
+
+        ## RNA DICTIONARIES ##
+        # Dictionary for the connectivities and parameters of bonds between rna backbone beads
+        self.rnaBbBondDictC = dict(zip(self.rna_con['bond'],self.rna_bb['bond']))
+        # Dictionary for the connectivities and parameters of angles between rna backbone beads
+        self.rnaBbAngleDictC = dict(zip(self.rna_con['angle'],self.rna_bb['angle']))
+        # Dictionary for the connectivities and parameters of dihedrals between rna backbone beads
+        self.rnaBbDihDictC = dict(zip(self.rna_con['dih'],self.rna_bb['dih']))
+        # Dictionary for exclusions for rna backbone beads
+        self.rnaBbExclDictC = dict(zip(self.rna_con['excl'],self.rna_bb['excl']))
+        # Dictionary for pairs for rna backbone beads
+        self.rnaBbPairDictC = dict(zip(self.rna_con['pair'],self.rna_bb['pair']))
+        
+
+    # The following function returns the backbone bead for a given residue and                   
+    # secondary structure type.                                                                 
+    # 1. Check if the residue is DNA/RNA and return the whole backbone for those
+    # 2. Look up the proper dictionary for the residue                                          
+    # 3. Get the proper type from it for the secondary structure                                
+    # If the residue is not in the dictionary of specials, use the default                      
+    # If the secondary structure is not listed (in the residue specific                         
+    # dictionary) revert to the default.                                                        
+    def bbGetBead(self,r1,ss="C"):                                                               
+        if r1 in dnares3:
+            return self.dna_bb['atom']
+        elif r1 in rnares3:
+            return self.rna_bb['atom']
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetBond(self,r,ca,ss):
+        # Retrieve parameters for each residue from tables defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbBondDictC.keys() and self.dnaBbBondDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbBondDictC.keys() and self.rnaBbBondDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+    
+    def bbGetAngle(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbAngleDictC.keys() and self.dnaBbAngleDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbAngleDictC.keys() and self.rnaBbAngleDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetExclusion(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbExclDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbExclDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetPair(self,r,ca,ss):
+        if r[0] in dnares3:
+            return ca in self.dnaBbPairDictC.keys() and ' ' or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbPairDictC.keys() and ' ' or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def bbGetDihedral(self,r,ca,ss):
+        # Retrieve parameters for each residue from table defined above
+        if r[0] in dnares3:
+            return ca in self.dnaBbDihDictC.keys() and self.dnaBbDihDictC[ca] or None
+        elif r[0] in rnares3:
+            return ca in self.rnaBbDihDictC.keys() and self.rnaBbDihDictC[ca] or None
+        else:
+            sys.exit("This script supports only DNA or RNA.")
+
+    def getCharge(self,atype,aname):
+        return self.charges.get(atype,self.bbcharges.get(aname,0))
+        
+    def messages(self):
+        '''Prints any force-field specific logging messages.'''
+        import logging
+        logging.warning('################################################################################')
+        logging.warning('This is a beta of Martini-nucleotide and should NOT be used for production runs.')
+        logging.warning('################################################################################')
+        pass
+
+
+#########################
+## 7 # ELASTIC NETWORK ##  -> @ELN <-
+#########################
+import math,multiprocessing
+
+## ELASTIC NETWORK ##
+
+# Only the decay function is defined here, the network 
+# itself is set up through the Topology class
+
+# The function to determine the decay scaling factor for the elastic network 
+# force constant, based on the distance and the parameters provided.
+# This function is very versatile and can be fitted to most commonly used 
+# profiles, including a straight line (rate=0)
+def decayFunction(distance,shift,rate,power):
+    return math.exp(-rate*math.pow(distance-shift,power))
+
+def rubberBands(atomList,lowerBound,upperBound,decayFactor,decayPower,forceConstant,minimumForce,bondType=6,cache=None):
+    if len(atomList) <= 3:
+        return rubberBandTable([],[],[],bondType)
+    ids, coords = zip(*atomList)
+    # Only pairs from neighbouring cells are checked. The search uses a cutoff
+    # slightly larger than the upper bound (in A), such that rubberBandList
+    # decides on the pairs near the cutoff exactly as before.
+    I, J, D2 = neighborPairs(coords,10*upperBound+0.001,cache)
+    # The original pairwise loop stopped with three atoms left in the list,
+    # so pairs starting from one of the last three atoms are never included.
+    keep = I < len(ids)-3
+    return rubberBandList(ids,I[keep],J[keep],D2[keep],lowerBound,upperBound,
+                          decayFactor,decayPower,forceConstant,minimumForce,bondType)
+
+# Turn candidate pairs (indices into the list of ids, squared distance in A^2)
+# into rubber bands, applying the upper bound and the force constant decay.
+def rubberBandList(ids,I,J,D2,lowerBound,upperBound,decayFactor,decayPower,forceConstant,minimumForce,bondType=6):
+    pairs, dist, scale = [], [], []
+    u2  = upperBound**2
+    for i,j,d2 in zip(I.tolist(),J.tolist(),D2.tolist()):
+        # Mind the nm/A conversion -- This has to be standardized! Global use of nm?
+        d2 = d2/100
+        if d2 < u2:
+            dij  = math.sqrt(d2)
+            fscl = decayFunction(dij,lowerBound,decayFactor,decayPower)
+            if fscl*forceConstant > minimumForce:
+                pairs.append((ids[i],ids[j]))
+                dist.append(dij)
+                scale.append(fscl)
+    return rubberBandTable(pairs,dist,scale,bondType)
+
+# The rubber bands are stored as a table (see BondedTable), with the 
+# distance and the force constant scaling as numeric columns.
+def rubberBandTable(pairs,dist,scale,bondType):
+    return BondedTable(Bond,pairs,bondType,
+                       [numberColumn(dist),numberColumn(scale,"RUBBER_FC*%f")],
+                       category="Rubber band")
+
+# Rubber bands for several variants of the elastic network at once. The atom
+# list holds (id, bead name, coordinates) for all beads used by any variant.
+# The neighbour search is done once at the largest upper bound, after which
+# each variant takes the pairs between its own beads. The result for each
+# variant equals that of rubberBands on the beads of that variant.
+def rubberBandVariants(atomList,variants,lowerBound,decayFactor,decayPower,minimumForce,bondType=6,cache=None):
+    if not atomList:
+        return [rubberBandTable([],[],[],bondType) for v in variants]
+    ids, names, coords = zip(*atomList)
+    upperBound = max([v['ElasticUpperBound'] for v in variants])
+    I, J, D2   = neighborPairs(coords,10*upperBound+0.001,cache)
+    return rubberBandSelect(ids,names,I,J,D2,variants,lowerBound,decayFactor,decayPower,minimumForce,bondType)
+
+# Rubber bands for each variant from candidate pairs between the beads
+# with the given ids and names (squared distances in A^2).
+def rubberBandSelect(ids,names,I,J,D2,variants,lowerBound,decayFactor,decayPower,minimumForce,bondType=6):
+    names      = numpy.array(names)
+    out        = []
+    for v in variants:
+        sel  = numpy.in1d(names,v['ElasticBeads'])
+        # Position of each bead in the list of this variant, to skip
+        # the pairs starting from its last three beads (see rubberBands).
+        pos  = numpy.cumsum(sel)-1
+        keep = sel[I] & sel[J] & (pos[I] < sel.sum()-3)
+        out.append(rubberBandList(ids,I[keep],J[keep],D2[keep],lowerBound,v['ElasticUpperBound'],
+                                  decayFactor,decayPower,v['ElasticMaximumForce'],minimumForce,bondType))
+    return out
+
+# Running sums of the distances between candidate pairs of beads over the 
+# frames of a trajectory, to average the elastic network. The candidate 
+# pairs are those within the cutoff (in A) in the first frame. Only the
+# sums per pair are kept, so the memory does not grow with the frames.
+class PairAverage:
+    def __init__(self,names,coords,cutoff,cache=None):
+        self.names    = names
+        self.I,self.J = neighborPairs(coords,cutoff,cache)[:2]
+        self.frames   = 0
+        self.sum      = numpy.zeros(len(self.I))
+        self.sum2     = numpy.zeros(len(self.I))
+        self.add(names,coords)
+
+    def add(self,names,coords):
+        if names != self.names:
+            raise ValueError("Beads differ between frames")
+        x  = numpy.array(coords,dtype=float).reshape((-1,3))
+        d  = x[self.I]-x[self.J]
+        d2 = d[:,0]**2+d[:,1]**2+d[:,2]**2
+        self.sum    += numpy.sqrt(d2)
+        self.sum2   += d2
+        self.frames += 1
+
+    # Mean distances and their standard deviations (A)
+    def mean(self):
+        return self.sum/self.frames
+
+    def deviation(self):
+        return numpy.sqrt(numpy.maximum(self.sum2/self.frames-self.mean()**2,0))
+
+    # Rubber bands from the mean distances, for the beads with the given ids.
+    # Pairs with a standard deviation over maximumDeviation (nm) are skipped.
+    def rubberBands(self,ids,variants,lowerBound,decayFactor,decayPower,minimumForce,maximumDeviation=0,bondType=6):
+        if len(ids) != len(self.names):
+            raise ValueError("Beads differ from those averaged")
+        keep = numpy.ones(len(self.I),dtype=bool)
+        if maximumDeviation:
+            keep = self.deviation() <= 10*maximumDeviation
+        return rubberBandSelect(ids,self.names,self.I[keep],self.J[keep],self.mean()[keep]**2,variants,
+                                lowerBound,decayFactor,decayPower,minimumForce,bondType)
+
+# Limit the number of rubber bands per bead, keeping the shortest ones,
+# which are also the strongest. With mode 'max' a band is kept if it is 
+# among the shortest of both its beads, so no bead has more bands than 
+# given. With mode 'min' it is kept if it is among the shortest of either
+# bead, so every bead keeps the bands to its nearest neighbours, at the 
+# cost of some beads having more.
+def rubberBandCap(table,maxBonds,mode="max"):
+    n = len(table)
+    if not maxBonds or not n:
+        return table
+    dist  = table.parameters[0][1]
+    bead  = table.atoms.T.reshape(-1)
+    bond  = numpy.concatenate((numpy.arange(n),numpy.arange(n)))
+    # Rank of each band among the bands of the same bead, on distance
+    order = numpy.lexsort((bond,dist[bond],bead))
+    sbead = bead[order]
+    rank  = numpy.empty(2*n,dtype=int)
+    rank[order] = numpy.arange(2*n)-numpy.searchsorted(sbead,sbead,side="left")
+    near  = (rank < maxBonds).reshape((2,n))
+    if mode == "min":
+        return table.select(near.any(axis=0))
+    return table.select(near.all(axis=0))
+
+# Split off the rubber bands longer than the given length (nm), which 
+# limit the domain decomposition in mdrun. These are returned as a table 
+# of their own, which is written in a separate block (see Topology).
+def rubberBandSplit(table,length):
+    far  = table.parameters[0][1] > length
+    long = table.select(far)
+    long.category = "Long rubber band"
+    return table.select(~far), long
+
+# Number of rubber bands for each of the given beads, and the number of
+# beads having each number of bands
+def rubberBandCounts(table,beads):
+    beads  = numpy.array(beads,dtype=int)
+    if not len(beads):
+        return beads, numpy.zeros(1,dtype=int)
+    counts = numpy.bincount(table.atoms.reshape(-1),minlength=beads.max()+1)[beads]
+    return counts, numpy.bincount(counts)
+
+# Neighbour search in one slab of the system (see interRubberBands)
+def slabPairs(job):
+    coords, cutoff = job
+    return neighborPairs(coords,cutoff)
+
+# Rubber bands between beads of different molecules, for an elastic network
+# over the whole system. The atom list holds (index in the system, molecule,
+# bead name, coordinates) for all beads used by any variant. The system is
+# divided in slabs along x, which are searched by a pool of processes. Each 
+# slab is searched together with the beads within the cutoff beyond it, and 
+# a pair is taken from the slab holding its leftmost bead, so every pair is 
+# found once. The result for each variant is sorted on the indices.
+def interRubberBands(atomList,variants,lowerBound,decayFactor,decayPower,minimumForce,bondType=6,processes=1):
+    if not atomList:
+        return [rubberBandTable([],[],[],bondType) for v in variants]
+    ids, mols, names, coords = zip(*atomList)
+    upperBound = max([v['ElasticUpperBound'] for v in variants])
+    cutoff     = 10*upperBound+0.001
+    x          = numpy.array(coords,dtype=float).reshape((-1,3))
+    # Slab boundaries, each slab at least a cutoff wide
+    nslab      = max(1,min(processes,int((x[:,0].max()-x[:,0].min())/cutoff)))
+    edges      = numpy.linspace(x[:,0].min(),x[:,0].max(),nslab+1)
+    slab       = numpy.clip(numpy.searchsorted(edges,x[:,0],side="right")-1,0,nslab-1)
+    members    = [numpy.nonzero((slab == k) | ((slab == k+1) & (x[:,0] < edges[k+1]+cutoff)))[0] for k in range(nslab)]
+    jobs       = [(x[m],cutoff) for m in members]
+    if nslab > 1:
+        pool   = multiprocessing.Pool(nslab)
+        try:
+            found = pool.map(slabPairs,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        found  = [slabPairs(job) for job in jobs]
+    mols       = numpy.array(mols)
+    I, J, D2   = [], [], []
+    for k,(m,(i,j,d2)) in enumerate(zip(members,found)):
+        i, j = m[i], m[j]
+        keep = (numpy.minimum(slab[i],slab[j]) == k) & (mols[i] != mols[j])
+        I.append(i[keep])
+        J.append(j[keep])
+        D2.append(d2[keep])
+    I, J, D2   = numpy.concatenate(I), numpy.concatenate(J), numpy.concatenate(D2)
+    srt        = numpy.lexsort((J,I))
+    I, J, D2   = I[srt], J[srt], D2[srt]
+    names      = numpy.array(names)
+    out        = []
+    for v in variants:
+        sel  = numpy.in1d(names,v['ElasticBeads'])
+        keep = sel[I] & sel[J]
+        out.append(rubberBandList(ids,I[keep],J[keep],D2[keep],lowerBound,v['ElasticUpperBound'],
+                                  decayFactor,decayPower,v['ElasticMaximumForce'],minimumForce,bondType))
+    return out
+
+# Atom list for interRubberBands from the beads of a coarse grained structure 
+# (-eicf), numbered as in the structure, with a molecule for every chain.
+# Beads of nucleic residues are used if listed in beads, of other residues
+# (proteins) only the backbone beads, as in the elastic networks of elnedyn.
+def structureAtomList(atoms,beads):
+    atomList = []
+    mol      = -1
+    for k,atom in enumerate(atoms):
+        if not k or atom[3] != atoms[k-1][3]:
+            mol += 1
+        if residueTypes.get(atom[1]) == "Nucleic" and atom[0] in beads or atom[0] == "BB":
+            atomList.append((k+1,mol,atom[0],atom[4:7]))
+    return atomList
+
+# The [ intermolecular_interactions ] of a table of rubber bands, for the
+# end of a topology, switched on with RUBBER_BANDS as within a moleculetype
+def writeInterRubberBands(stream,table,force):
+    stream.write("\n\n[ intermolecular_interactions ]\n[ bonds ]\n#ifdef RUBBER_BANDS\n")
+    stream.write("#ifndef RUBBER_FC\n#define RUBBER_FC %f\n#endif\n"%force)
+    for chunk in table.chunks():
+        stream.write("\n".join(chunk)+"\n")
+    stream.write("#endif\n")
+
+
+
+#######################
+## 8 # STRUCTURE I/O ##  -> @IO <-
+#######################
+import logging,math,random,sys,gzip,os,hashlib,zlib,bisect
+import numpy
+
+#----+---------+
+## A | PDB I/O |
+#----+---------+
+
+d2r = 3.14159265358979323846264338327950288/180
+
+# Reformatting of lines in structure file                                     
+pdbAtomLine = "ATOM  %5d %4s%4s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f%6.2f\n"        
+pdbBoxLine  = "CRYST1%9.3f%9.3f%9.3f%7.2f%7.2f%7.2f P 1           1\n"        
+
+
+def pdbBoxString(box):
+    # Box vectors
+    u, v, w  = box[0:3], box[3:6], box[6:9]
+
+    # Box vector lengths
+    nu,nv,nw = [math.sqrt(norm2(i)) for i in (u,v,w)]
+
+    # Box vector angles
+    alpha = nv*nw == 0 and 90 or math.acos(cos_angle(v,w))/d2r
+    beta  = nu*nw == 0 and 90 or math.acos(cos_angle(u,w))/d2r
+    gamma = nu*nv == 0 and 90 or math.acos(cos_angle(u,v))/d2r
+
+    return pdbBoxLine % (10*norm(u),10*norm(v),10*norm(w),alpha,beta,gamma)
+
+
+def pdbAtom(a):
+    ##01234567890123456789012345678901234567890123456789012345678901234567890123456789
+    ##ATOM   2155 HH11 ARG C 203     116.140  48.800   6.280  1.00  0.00
+    if a.startswith("TER"):
+        return 0
+    # NOTE: The 27th field of an ATOM line in the PDB definition can contain an
+    #       insertion code. We shift that 20 bits and add it to the residue number
+    #       to ensure that residue numbers will be unique.
+    ## ===> atom name,       res name,        res id,                        chain,
+    return (a[12:16].strip(),a[17:20].strip(),int(a[22:26])+(ord(a[26])<<20),a[21],
+    ##            x,              y,              z       
+            float(a[30:38]),float(a[38:46]),float(a[46:54]))
+
+
+# Bulk version of pdbAtom for the ATOM/HETATM records of a frame. The fixed
+# width columns of all lines are cut from a single character array and
+# converted at once. Returns the atom names, residue names, residue ids
+# (with the insertion code shifted 20 bits, as in pdbAtom), chain ids
+# and coordinates as arrays.
+def pdbArrays(lines):
+    n   = len(lines)
+    buf = "".join([i[:54].ljust(54) for i in lines])
+    if not isinstance(buf,bytes):
+        buf = buf.encode("latin-1")
+    a   = numpy.frombuffer(buf,dtype="S1").reshape((n,54))
+    def column(i,j):
+        return numpy.ascontiguousarray(a[:,i:j]).view("S%d"%(j-i)).ravel()
+    names  = numpy.char.strip(column(12,16)).astype(str)
+    resn   = numpy.char.strip(column(17,20)).astype(str)
+    resid  = column(22,26).astype(int) + (a[:,26].view(numpy.uint8).astype(int)<<20)
+    chain  = a[:,21].astype(str)
+    xyz    = numpy.column_stack([column(30,38).astype(float),column(38,46).astype(float),column(46,54).astype(float)])
+    return names, resn, resid, chain, xyz
+
+
+# Atom tuples, as given by pdbAtom, for a list of ATOM/HETATM records
+def pdbAtoms(lines):
+    if not lines:
+        return []
+    names, resn, resid, chain, xyz = pdbArrays(lines)
+    x, y, z = xyz.T
+    return list(zip(names.tolist(),resn.tolist(),resid.tolist(),chain.tolist(),x.tolist(),y.tolist(),z.tolist()))
+
+
+def pdbOut(atom,i=1):
+    insc = atom[2]>>20
+    resi = atom[2]-(insc<<20)
+    pdbline = "ATOM  %5i  %-3s %3s%2s%4i%1s   %8.3f%8.3f%8.3f%6.2f%6.2f           %1s  \n"
+    return pdbline%((i,atom[0][:3],atom[1],atom[3],resi,chr(insc)) + atom[4:] + (1,40,atom[0][0])) 
+
+
+def isPdbAtom(a):    
+    return a.startswith("ATOM") or (options["-hetatm"] and a.startswith("HETATM")) or a.startswith("TER")
+
+
+def pdbBoxRead(a):
+    fa, fb, fc, aa, ab, ac = [float(i) for i in a.split()[1:7]]
+    ca, cb, cg, sg         = math.cos(d2r*aa), math.cos(d2r*ab), math.cos(d2r*ac) , math.sin(d2r*ac)
+    wx, wy                 = 0.1*fc*cb, 0.1*fc*(ca-cb*cg)/sg
+    wz                     = math.sqrt(0.01*fc*fc - wx*wx - wy*wy)
+    return [0.1*fa, 0, 0, 0.1*fb*cg, 0.1*fb*sg, 0, wx, wy, wz]
+
+
+# Function for splitting a PDB file in chains, based
+# on chain identifiers and TER statements
+def pdbChains(pdbAtomList):
+    chain = []
+    for atom in pdbAtomList:
+        if not atom: # Was a "TER" statement
+            if chain:
+                yield chain
+            else:
+                logging.info("Skipping empty chain definition")
+            chain = [] 
+            continue
+        if not chain or chain[-1][3] == atom[3]:
+            chain.append(atom)
+        else:
+            yield chain
+            chain = [atom]
+    if chain:
+        yield chain
+
+
+# Simple PDB iterator
+# The atom records of a frame are collected and converted in one go.
+def pdbFrameIterator(streamIterator):  
+    title, atoms, box = [], [], []
+    for i in streamIterator:
+        if i.startswith("ENDMDL"):
+            yield "".join(title), pdbAtoms(atoms), box
+            title, atoms, box = [], [], []            
+        elif i.startswith("TITLE"):
+            title.append(i)
+        elif i.startswith("CRYST1"):
+            box = pdbBoxRead(i)
+        elif i.startswith("ATOM") or i.startswith("HETATM"):
+            atoms.append(i)
+    if atoms:
+        yield "".join(title), pdbAtoms(atoms), box
+
+
+# PDB iterator giving only the coordinates of each frame as an array
+def pdbCoordinateIterator(streamIterator):
+    title, atoms, box = [], [], []
+    for i in streamIterator:
+        if i.startswith("ENDMDL"):
+            if atoms:
+                yield "".join(title), pdbArrays(atoms)[4], box
+            title, atoms, box = [], [], []            
+        elif i.startswith("TITLE"):
+            title.append(i)
+        elif i.startswith("CRYST1"):
+            box = pdbBoxRead(i)
+        elif i.startswith("ATOM") or i.startswith("HETATM"):
+            atoms.append(i)
+    if atoms:
+        yield "".join(title), pdbArrays(atoms)[4], box
+
+
+#----+---------+
+## B | GRO I/O |
+#----+---------+
+
+groline = "%5d%-5s%5s%5d%8.3f%8.3f%8.3f\n"                                    
+
+def groBoxRead(a):    
+    b = [float(i) for i in a.split()] + 6*[0]             # Padding for rectangular boxes
+    return b[0],b[3],b[4],b[5],b[1],b[6],b[7],b[8],b[2]   # Return full definition xx,xy,xz,yx,yy,yz,zx,zy,zz
+
+def groAtom(a):
+    # In PDB files, there might by an insertion code. To handle this, we internally add
+    # constant to all resids. To be consistent, we have to do the same for gro files.
+    # 32 equal ord(' '), eg an empty insertion code
+    constant = 32<<20
+    #012345678901234567890123456789012345678901234567890
+    #    1PRN      N    1   4.168  11.132   5.291
+    ## ===> atom name,        res name,          res id,    chain,
+    return (a[10:15].strip(), a[5:10].strip(),   int(a[:5])+constant, " ", 
+    ##               x,                 y,                 z       
+            10*float(a[20:28]),10*float(a[28:36]),10*float(a[36:44]))
+
+# Simple GRO iterator
+def groFrameIterator(streamIterator):
+    while True:
+        try:
+            title = streamIterator.next()
+        except StopIteration:
+            break
+        natoms = streamIterator.next().strip()
+        if not natoms:
+            break
+        natoms = int(natoms)
+        atoms  = [groAtom(streamIterator.next())  for i in range(natoms)] 
+        box    = groBoxRead(streamIterator.next())
+        yield title, atoms, box
+
+
+# GRO iterator giving only the coordinates of each frame as an array
+def groCoordinateIterator(streamIterator):
+    for title,atoms,box in groFrameIterator(streamIterator):
+        yield title, numpy.array([i[4:7] for i in atoms],dtype=float), box
+
+
+#----+-------------+
+## C | GENERAL I/O |
+#----+-------------+
+
+# Map an atomistic trajectory (PDB or GRO, possibly gzipped) to a coarse
+# grained one, frame by frame, using a mapping operator (see mapOperator).
+# The frames are written as models to a PDB stream.
+def mapTrajectory(operator,inStream,outStream):
+    stream = streamTag(inStream)
+    if stream.next() == "GRO":
+        frameIterator = groCoordinateIterator
+    else:
+        frameIterator = pdbCoordinateIterator
+    natoms = len(operator["atom"]) and operator["atom"].max()+1
+    # The bead records only differ in the coordinates between frames
+    head   = []
+    for i,(name,resn,resi,chain) in enumerate(zip(operator["name"].tolist(),operator["resn"].tolist(),
+                                                   operator["resi"].tolist(),operator["chain"].tolist())):
+        insc  = resi>>20
+        resi -= insc<<20
+        head.append((pdbAtomLine%(i+1,name,resn,chain,resi,chr(insc),0,0,0,1,0))[:30])
+    tail   = "%6.2f%6.2f\n"%(1,0)
+    model  = 0
+    for title,xyz,box in frameIterator(stream):
+        if len(xyz) < natoms:
+            logging.error("Trajectory frame %d has %d atoms, but the mapping requires %d."%(model+1,len(xyz),natoms))
+            sys.exit(1)
+        model += 1
+        outStream.write("MODEL %8d\n"%model)
+        if box:
+            outStream.write(pdbBoxString(box))
+        outStream.write("".join([h+"%8.3f%8.3f%8.3f"%tuple(x)+tail for h,x in zip(head,mapFrame(operator,xyz).tolist())]))
+        outStream.write("ENDMDL\n")
+    return model
+
+# It is not entirely clear where this fits in best.
+# Called from main. 
+def getChargeType(resname,resid,choices):
+    '''Get user input for the charge of residues, based on list with choises.'''
+    print ('Which %s type do you want for residue %s:'%(resname,resid+1))
+    for i,choice in choices.iteritems():
+        print ('%s. %s'%(i,choice))
+    choice = None
+    while choice not in choices.keys():
+        choice = input('Type a number:')
+    return choices[choice]
+
+# *NOTE*: This should probably be a CheckableStream class that
+# reads in lines until either of a set of specified conditions
+# is met, then setting the type and from thereon functioning as
+# a normal stream.
+def streamTag(stream):
+    # Tag the stream with the type of structure file
+    # If necessary, open the stream, taking care of 
+    # opening using gzip for gzipped files
+
+    # First check whether we have have an open stream or a file
+    # If it's a file, check whether it's zipped and open it
+    if type(stream) == str:
+        if stream.endswith("gz"):
+            logging.info('Read input structure from zipped file.')
+            s = gzip.open(stream)
+        else:
+            logging.info('Read input structure from file.')
+            s = open(stream)
+    else:
+        logging.info('Read input structure from command-line')
+        s = stream
+
+    # Read a few lines, but save them
+    x = [s.readline(), s.readline()]
+    if x[-1].strip().isdigit():
+        # Must be a GRO file
+        logging.info("Input structure is a GRO file. Chains will be labeled consecutively.")
+        yield "GRO"
+    else:
+        # Must be a PDB file then
+        # Could wind further to see if we encounter an "ATOM" record
+        logging.info("Input structure is a PDB file.")
+        yield "PDB"
+    
+    # Hand over the lines that were stored
+    for i in x:
+        yield i
+
+    # Now give the rest of the lines from the stream
+    for i in s:
+        yield i
+
+
+# Open a file for writing, gzip compressed if requested, in which 
+# case '.gz' is added to the file name.
+def openOutput(filename,compress=False):
+    if compress:
+        return gzip.open(filename+".gz","wb")
+    return open(filename,"w")
+
+
+# PDB ATOM records for a list of atoms or beads (name,resn,resi,chain,x,y,z,b),
+# numbered from atid, formatted at once. The residue numbers hold the 
+# insertion code from bit 20 on. The names get the prefix, if given.
+def pdbAtomLines(atoms,atid=1,prefix=""):
+    if not atoms:
+        return ""
+    name,resn,resi,chain,x,y,z,b = zip(*[i[:8] for i in atoms])
+    insc   = [i>>20 for i in resi]
+    resi   = [i-(j<<20) for i,j in zip(resi,insc)]
+    values = zip(range(atid,atid+len(atoms)),[prefix+i for i in name],[i[:3] for i in resn],chain,
+                 resi,[chr(i) for i in insc],x,y,z,len(atoms)*[1],b)
+    return (len(atoms)*pdbAtomLine)%tuple([j for i in values for j in i])
+
+
+# Writer for multimodel PDB files (-x), gzip compressed if the name ends
+# with .gz. The byte offsets of the models and chains in the uncompressed
+# file are kept and written to an index file (name + '.idx') on closing,
+# as tab separated lines 'MODEL model offset' and 'CHAIN model id offset'.
+# When compressed, every model is written as a separate gzip member, which
+# can be decompressed by itself, listed as 'MEMBER compressed offset'
+# (see PDBIndex).
+class PDBWriter:
+    def __init__(self,filename):
+        self.filename = filename
+        self.gzipped  = filename.endswith(".gz")
+        self.raw      = open(filename,self.gzipped and "wb" or "w",1<<20)
+        self.stream   = self.raw
+        self.offset   = 0
+        self.model    = 0
+        self.index    = []
+
+    def write(self,text):
+        self.stream.write(text)
+        self.offset += len(text)
+
+    def startModel(self,model,title,box):
+        self.model = model
+        if self.gzipped:
+            if self.stream is not self.raw:
+                self.stream.close()
+            self.index.append(("MEMBER",self.raw.tell(),self.offset))
+            self.stream = gzip.GzipFile(fileobj=self.raw,mode="wb")
+        self.index.append(("MODEL",model,self.offset))
+        self.write("MODEL %8d\n"%model+title+pdbBoxString(box))
+
+    def startChain(self,name):
+        self.index.append(("CHAIN",self.model,name,self.offset))
+
+    # Write a list of atoms or beads (see pdbAtomLines), returning the next atom number
+    def atoms(self,atoms,atid=1,prefix=""):
+        self.write(pdbAtomLines(atoms,atid,prefix))
+        return atid+len(atoms)
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+        index = open(self.filename+".idx","w")
+        index.write("".join(["\t".join([str(j) for j in i])+"\n" for i in self.index+[("SIZE",self.offset)]]))
+        index.close()
+
+
+# Index of the models and chains in a PDB file, possibly gzipped, for
+# reading single models or chains without going through the whole file.
+# The offsets are positions in the uncompressed file. For gzipped files,
+# the starts of the gzip members are kept as checkpoints, from which 
+# the file can be decompressed; files written by PDBWriter have a member
+# for every model. The index is kept in a file next to the structure 
+# (name + '.idx', as written by PDBWriter) and rebuilt if that is older.
+class PDBIndex:
+    def __init__(self,filename):
+        self.filename = filename
+        self.gzipped  = filename.endswith(".gz")
+        self.models   = []   # (model, offset)
+        self.chains   = []   # (model, chain, offset)
+        self.members  = []   # (compressed offset, offset)
+        self.size     = 0
+        if not self.load():
+            self.scan()
+            self.save()
+
+    def load(self):
+        name = self.filename+".idx"
+        try:
+            if os.path.getmtime(name) < os.path.getmtime(self.filename):
+                return False
+            for line in open(name):
+                item = line.rstrip("\n").split("\t")
+                if item[0] == "MODEL":
+                    self.models.append((int(item[1]),int(item[2])))
+                elif item[0] == "CHAIN":
+                    self.chains.append((int(item[1]),item[2],int(item[3])))
+                elif item[0] == "MEMBER":
+                    self.members.append((int(item[1]),int(item[2])))
+                elif item[0] == "SIZE":
+                    self.size = int(item[1])
+        except (IOError,OSError,ValueError,IndexError):
+            self.models, self.chains, self.members = [], [], []
+            return False
+        if not self.members:
+            self.members = [(0,0)]
+        return True
+
+    def save(self):
+        items = ([("MODEL",)+i for i in self.models]+[("CHAIN",)+i for i in self.chains]+
+                 [("MEMBER",)+i for i in self.members]+[("SIZE",self.size)])
+        try:
+            out = open(self.filename+".idx","w")
+            out.write("".join(["\t".join([str(j) for j in i])+"\n" for i in items]))
+            out.close()
+        except (IOError,OSError):
+            logging.info("Could not write the index of %s."%self.filename)
+
+    # The uncompressed data from a given checkpoint on, in chunks, going 
+    # on through the next gzip members. The starts of these are added
+    # to the list of members if given.
+    def data(self,checkpoint=(0,0),members=None):
+        raw = open(self.filename,"rb")
+        raw.seek(checkpoint[0])
+        if not self.gzipped:
+            for chunk in iter(lambda: raw.read(1<<20),""):
+                yield chunk
+            return
+        start, offset = checkpoint
+        pending = ""
+        while True:
+            data = pending or raw.read(1<<20)
+            # Trailing zeros are sometimes added to gzipped files
+            if not data.strip("\0"):
+                break
+            if members is not None:
+                members.append((start,offset))
+            inflate = zlib.decompressobj(16+zlib.MAX_WBITS)
+            pending = ""
+            while data:
+                chunk = inflate.decompress(data)
+                offset += len(chunk)
+                yield chunk
+                if inflate.unused_data:
+                    # The next member starts in this piece of data
+                    pending = inflate.unused_data
+                    start  += len(data)-len(pending)
+                    break
+                start += len(data)
+                data   = raw.read(1<<20)
+            if not pending:
+                chunk = inflate.flush()
+                offset += len(chunk)
+                yield chunk
+                break
+
+    # Split chunks of data in lines, with their offsets
+    def split(self,chunks,position=0):
+        rest = ""
+        for chunk in chunks:
+            lines = (rest+chunk).split("\n")
+            rest  = lines.pop()
+            for line in lines:
+                yield position, line+"\n"
+                position += len(line)+1
+        if rest:
+            yield position, rest
+
+    # The last checkpoint at or before an offset
+    def checkpoint(self,offset):
+        if not self.gzipped:
+            return (offset,offset)
+        return self.members[max(0,bisect.bisect_right([i[1] for i in self.members],offset)-1)]
+
+    # The lines from an offset on, with their offsets
+    def lines(self,offset=0):
+        checkpoint = self.checkpoint(offset)
+        for position,line in self.split(self.data(checkpoint),checkpoint[1]):
+            if position >= offset:
+                yield position, line
+
+    def scan(self):
+        self.members = []
+        model, chain = 1, None
+        for position,line in self.split(self.data(members=self.members)):
+            if line.startswith("MODEL"):
+                model = len(self.models)+1
+                self.models.append((model,position))
+                chain = None
+            elif line.startswith("ATOM") or line.startswith("HETATM"):
+                if line[21:22] != chain:
+                    chain = line[21:22]
+                    self.chains.append((model,chain,position))
+            elif line.startswith("TER"):
+                chain = None
+            self.size = position+len(line)
+        if not self.members:
+            self.members = [(0,0)]
+        logging.info("Indexed %d models and %d chains in %s."%(len(self.models),len(self.chains),self.filename))
+
+    # The range (start, end) of a model; the first model includes the lines 
+    # before it. A file without models is taken as a single model.
+    def modelRange(self,model):
+        starts = [i[1] for i in self.models] or [0]
+        if not 0 < model <= len(starts):
+            raise IndexError("Model %d not in %s (%d models)"%(model,self.filename,len(starts)))
+        return (model > 1 and starts[model-1] or 0, model < len(starts) and starts[model] or None)
+
+    def chainRange(self,chain,model=1):
+        start, end = self.modelRange(model)
+        offsets = [i[2] for i in self.chains if i[0] == model]
+        for m,c,offset in self.chains:
+            if m == model and c == chain:
+                later = [i for i in offsets if i > offset]
+                return offset, later and later[0] or end
+        raise KeyError("Chain '%s' not in model %d of %s"%(chain,model,self.filename))
+
+    # The lines of a range of the file
+    def read(self,start,end=None):
+        for position,line in self.lines(start):
+            if end is not None and position >= end:
+                break
+            yield line
+
+    # The lines of a number of models, in the order given. The file is 
+    # only read again from a checkpoint if that is ahead of the position.
+    def readModels(self,models):
+        stream, position = None, None
+        for start,end in [self.modelRange(i) for i in models]:
+            if stream is None or not position <= start or position < self.checkpoint(start)[1]:
+                stream = self.lines(start)
+                position, line = next(stream,(None,None))
+            while position is not None and position < start:
+                position, line = next(stream,(None,None))
+            while position is not None and (end is None or position < end):
+                yield line
+                position, line = next(stream,(None,None))
+
+    def model(self,model):
+        return self.read(*self.modelRange(model))
+
+    def chain(self,chain,model=1):
+        return self.read(*self.chainRange(chain,model))
+
+
+# A file-like stream over the lines from an iterator, as taken by streamTag
+class LineStream:
+    def __init__(self,lines):
+        self.lines = iter(lines)
+
+    def __iter__(self):
+        return self.lines
+
+    def readline(self):
+        return next(self.lines,"")
+
+
+# Pass on the lines of a stream, keeping a running SHA1 digest of the
+# lines read so far. The digest taken when a frame is complete identifies
+# that frame, together with all frames before it (see Cache).
+class StreamDigest:
+    def __init__(self,stream):
+        self.stream = stream
+        self.sha1   = hashlib.sha1()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.stream.next()
+        self.sha1.update(line)
+        return line
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+
+# Content addressed cache for intermediate results (-cache). Each entry is
+# an uncompressed NPZ file, named after the SHA1 digest of everything the
+# result depends on, so entries never need to be invalidated. An entry is
+# returned as a dictionary of its arrays, read in full, and the file is 
+# closed again. If the total size exceeds the limit (bytes, 0 is no limit),
+# the entries used least recently are removed.
+class Cache:
+    def __init__(self,directory,maxSize=0):
+        self.directory = directory
+        self.maxSize   = maxSize
+        self.hits      = 0
+        self.misses    = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self,*parts):
+        sha1 = hashlib.sha1()
+        for part in parts:
+            if isinstance(part,numpy.ndarray):
+                sha1.update("%s%s"%(part.dtype.str,part.shape))
+                sha1.update(numpy.ascontiguousarray(part).tostring())
+            else:
+                sha1.update(repr(part))
+            sha1.update("\0")
+        return sha1.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.directory,key+".npz")
+
+    def get(self,key):
+        path = self.path(key)
+        try:
+            with numpy.load(path) as npz:
+                entry = dict([(name,npz[name]) for name in npz.files])
+            os.utime(path,None)
+        except Exception:
+            # Missing, or damaged by an interrupted run
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self,key,**arrays):
+        # Write to a temporary file first, such that other runs
+        # sharing the cache never see a partial entry
+        path = self.path(key)
+        temp = "%s.%d.tmp"%(path,os.getpid())
+        out  = open(temp,"wb")
+        numpy.savez(out,**arrays)
+        out.close()
+        os.rename(temp,path)
+        self.evict()
+
+    def evict(self):
+        if not self.maxSize:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory,name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime,stat.st_size,name))
+        total = sum([i[1] for i in entries])
+        for mtime,size,name in sorted(entries):
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(os.path.join(self.directory,name))
+            except OSError:
+                pass
+            total -= size
+
+
+#----+-----------------+
+## D | STRUCTURE STUFF |
+#----+-----------------+
+
+
+# This list allows to retrieve atoms based on the name or the index
+# If standard, dictionary type indexing is used, only exact matches are
+# returned. Alternatively, partial matching can be achieved by setting
+# a second 'True' argument. 
+# Lookups by name go through a dictionary, which is built when first 
+# needed and dropped whenever the list of atoms is changed.
+def _resetNames(method):
+    def reset(self,*args,**kwargs):
+        self._names = None
+        return method(self,*args,**kwargs)
+    return reset
+
+class Residue(list):
+    _names = None
+
+    def __getitem__(self,tag): 
+        if type(tag) == int:
+            # Call the parent class __getitem__
+            return list.__getitem__(self,tag)
+        if type(tag) == str:
+            if self._names is None:
+                # The first atom with a name is the one returned
+                self._names = {}
+                for i in reversed(self):
+                    self._names[i[0]] = i
+            return self._names.get(tag)
+        if tag[1]:
+            return [i for i in self if tag[0] in i[0]] # Return partial matches
+        else:
+            return [i for i in self if i[0] == tag[0]] # Return exact matches only
+
+    # Changes to the list of atoms
+    __setitem__  = _resetNames(list.__setitem__)
+    __delitem__  = _resetNames(list.__delitem__)
+    __setslice__ = _resetNames(list.__setslice__)
+    __delslice__ = _resetNames(list.__delslice__)
+    __iadd__     = _resetNames(list.__iadd__)
+    __imul__     = _resetNames(list.__imul__)
+    append       = _resetNames(list.append)
+    extend       = _resetNames(list.extend)
+    insert       = _resetNames(list.insert)
+    pop          = _resetNames(list.pop)
+    remove       = _resetNames(list.remove)
+    reverse      = _resetNames(list.reverse)
+    sort         = _resetNames(list.sort)
+
+
+def residues(atomList):
+    residue = [atomList[0]]
+    for atom in atomList[1:]:
+        if (atom[1] == residue[-1][1] and # Residue name check
+            atom[2] == residue[-1][2] and # Residue id check
+            atom[3] == residue[-1][3]):   # Chain id check
+            residue.append(atom)
+        else:
+            yield Residue(residue)
+            residue = [atom]
+    yield Residue(residue)
+
+
+def residueDistance2(r1,r2):
+    return min([distance2(i,j) for i in r1 for j in r2])
+
+
+# Increased the cut-off from 2.5 to 3.0 for DNA. Should check that no problems arise for proteins.
+def breaks(residuelist,selection=("N","CA","C","P","C2'","C3'","O3'","C4'","C5'","O5'"),cutoff=3.0):
+    # Extract backbone atoms coordinates
+    bb = [[atom[4:7] for atom in residue if atom[0] in selection] for residue in residuelist]
+    # Needed to remove waters residues from mixed residues.
+    bb = [res for res in bb if res != []]
+    if len(bb) < 2:
+        return []
+
+    # We cannot rely on some standard order for the backbone atoms.
+    # Therefore breaks are inferred from the minimal distance between
+    # backbone atoms from adjacent residues. This is done for all pairs 
+    # of adjacent residues at once, expanding each pair over the pairs 
+    # of backbone atoms, as residueDistance2 does for a single pair.
+    count = numpy.array([len(res) for res in bb])
+    xyz   = numpy.array([x for res in bb for x in res],dtype=float)
+    start = numpy.cumsum(count)-count
+    npair = count[:-1]*count[1:]
+    first = numpy.cumsum(npair)-npair
+    k     = numpy.repeat(numpy.arange(len(bb)-1),npair)
+    local = numpy.arange(npair.sum())-first[k]
+    d     = xyz[start[k]+local//count[k+1]]-xyz[start[k+1]+local%count[k+1]]
+    d2    = numpy.minimum.reduceat(d[:,0]**2+d[:,1]**2+d[:,2]**2,first)
+    return (numpy.nonzero(d2 > cutoff)[0]+1).tolist()
+
+
+# Pairs of atoms with a squared distance below the cutoff, 
+# found with the cell list of neighborPairs.
+def contacts(atoms,cutoff=5):
+    crd = [atom[4:7] for atom in atoms]
+    # The cell list only gives pairs closer than the cutoff, so the cutoff
+    # is widened slightly to keep the exact comparison below.
+    I, J, D2 = neighborPairs(crd,math.sqrt(cutoff)*1.000001)
+    keep = D2 < cutoff
+    return zip(I[keep].tolist(),J[keep].tolist())
+
+def add_dummy(beads,dist=0.11,n=2):
+    # Generate a random vector in a sphere of -1 to +1, to add to the bead position
+    v    = [random.random()*2.-1,random.random()*2.-1,random.random()*2.-1]
+    # Calculated the length of the vector and divide by the final distance of the dummy bead
+    norm_v = norm(v)/dist
+    # Resize the vector
+    vn   = [i/norm_v for i in v]
+    # m sets the direction of the added vector, currently only works when adding one or two beads.
+    m = 1
+    for j in range(n):
+        newName = 'SCD' 
+        newBead = (newName,tuple([i+(m*j) for i,j in zip(beads[-1][1],vn)]), beads[-1][2])
+        beads.append(newBead)
+        m *= -2
+    return beads
+
+# Disjoint sets of indices (union-find), used for merging chains.
+# The smallest index of each set is kept as its root, so that the sets
+# come out in the order of their first member.
+class DisjointSets:
+    def __init__(self,n):
+        self.parent = range(n)
+
+    def find(self,i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Point everything on the way directly to the root
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    # Join the sets of i and j; returns True if they were separate
+    def union(self,i,j):
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return False
+        self.parent[max(i,j)] = min(i,j)
+        return True
+
+    # The sets, each sorted, in the order of their smallest member
+    def sets(self):
+        sets = {}
+        for i in range(len(self.parent)):
+            sets.setdefault(self.find(i),[]).append(i)
+        return [sets[i] for i in sorted(sets)]
+
+
+def check_merge(chains, m_list=[], l_list=[], ss_cutoff=0):
+    chainIndex = range(len(chains))
+
+    if 'all' in m_list:
+        logging.info("All chains will be merged in a single moleculetype.")
+        return chainIndex, [chainIndex]
+
+    chainID = [chain.id for chain in chains]
+
+    # Mark the combinations of chains that need to be merged
+    merges = []
+    if m_list:
+        # Build a dictionary of chain IDs versus index
+        # To give higher priority to top chains the lists are reversed 
+        # before building the dictionary
+        chainIndex.reverse()
+        chainID.reverse()
+        dct = dict(zip(chainID,chainIndex))
+        chainIndex.reverse()
+        # Convert chains in the merge_list to numeric, if necessary
+        # NOTE The internal numbering is zero-based, while the 
+        # command line chain indexing is one-based. We have to add
+        # one to the number in the dictionary to bring it on par with
+        # the numbering from the command line, but then from the 
+        # result we need to subtract one again to make indexing 
+        # zero-based
+        merges = [[(i.isdigit() and int(i) or dct[i]+1)-1 for i in j] for j in m_list]
+
+    # Join the chains to be merged. A chain given in several merges
+    # joins these in a single moleculetype.
+    joined = DisjointSets(len(chains))
+    for i in merges:
+        for j in i[1:]:
+            joined.union(i[0],j)
+
+    # Check for connections based on links. Only the chains with the 
+    # identifier given for an atom can hold it, so these are looked up
+    # through an index on the identifier, rather than testing all chains.
+    if l_list:
+        byID = {}
+        for i,chain in enumerate(chains):
+            byID.setdefault(chain.id,[]).append(i)
+        for a,b in l_list:
+            holdA = [i for i in byID.get(a[3],[]) if a in chains[i]]
+            holdB = [i for i in byID.get(b[3],[]) if b in chains[i]]
+            for i in holdA:
+                for j in holdB:
+                    if i != j and joined.union(i,j):
+                        logging.info("Merging chains %d and %d to allow link %s"%(min(i,j)+1,max(i,j)+1,str((a,b))))
+
+    # Check for cystine bridges based on distance, searching the 
+    # neighbours of all sulphur (SG) atoms at once.
+    if ss_cutoff:
+        sulphur = [(i,cys["SG"]) for i,chain in enumerate(chains) for cys in chain["CYS"] if cys["SG"]]
+        if len(sulphur) > 1:
+            owner  = [i[0] for i in sulphur]
+            coords = [i[1][4:7] for i in sulphur]
+            # The cell list only gives pairs closer than the cutoff, so the cutoff
+            # is widened slightly to keep the pairs lying exactly at the distance.
+            I, J, D2 = neighborPairs(coords,math.sqrt(ss_cutoff)*1.000001)
+            for k,l in zip(I.tolist(),J.tolist()):
+                i, j = min(owner[k],owner[l]), max(owner[k],owner[l])
+                d2 = distance2(coords[k],coords[l])
+                if i != j and d2 <= ss_cutoff and joined.union(i,j):
+                    logging.info("Found SS contact linking chains %d and %d (%f nm)"%(i+1,j+1,math.sqrt(d2)/10))
+
+    merges = [i for i in joined.sets() if len(i) > 1]
+    order  = [j for i in merges for j in i]
+
+    if merges:
+        logging.warning("Merging chains.")
+        logging.warning("This may change the order of atoms and will change the number of topology files.")
+        logging.info("Merges: " + ", ".join([str([j+1 for j in i]) for i in merges]))
+
+    if len(merges) == 1 and len(merges[0]) > 1 and set(merges[0]) == set(chainIndex):
+        logging.info("All chains will be merged in a single moleculetype")
+
+    # Determine the order for writing; merged chains go first
+    merged = set(order)
+    merges.extend([[j] for j in chainIndex if not j in merged])
+    order.extend([j for j in chainIndex if not j in merged])
+
+    return order, merges
+
+
+## !! NOTE !! ##
+## XXX The chain class needs to be simplified by extracting things to separate functions/classes
+class Chain:
+    # Attributes defining a chain
+    # When copying a chain, or slicing, the attributes in this list have to
+    # be handled accordingly.
+    _attributes = ("residues","sequence","seq","ss","ssclass","sstypes")
+
+    def __init__(self,options,residuelist=[],name=None,multiscale=False):
+        self.residues   = residuelist
+        self._atoms     = [atom[:3] for residue in residuelist for atom in residue]
+        self.sequence   = [residue[0][1] for residue in residuelist]
+        # *NOTE*: Check for unknown residues and remove them if requested
+        #         before proceeding.
+        self.seq        = "".join([AA321.get(i,"X") for i in self.sequence])
+        self.ss         = ""
+        self.ssclass    = ""
+        self.sstypes    = ""
+        self.mapping    = []
+        self.multiscale = multiscale
+        self.options    = options
+
+        # Unknown residues
+        self.unknowns   = "X" in self.seq
+
+        # Determine the type of chain
+        self._type      = ""
+        self.type()
+
+        # Determine number of atoms
+        self.natoms     = len(self._atoms) 
+
+        # BREAKS: List of indices of residues where a new fragment starts
+        # Only when polymeric (protein, DNA, RNA, ...)
+        # For now, let's remove it for the Nucleic acids...
+        self.breaks     = self.type() in ("Protein","Mixed") and breaks(self.residues) or []
+
+        # LINKS:  List of pairs of pairs of indices of linked residues/atoms
+        # This list is used for cysteine bridges and peptide bonds involving side chains
+        # The list has items like ((#resi1, #atid1), (#resi2, #atid2))
+        # When merging chains, the residue number needs ot be update, but the atom id
+        # remains unchanged.
+        # For the coarse grained system, it needs to be checked which beads the respective
+        # atoms fall in, and bonded terms need to be added there.
+        self.links      = []                   
+
+        # Chain identifier; try to read from residue definition if no name is given
+        self.id         = name or residuelist and residuelist[0][0][3] or ""
+
+        # Container for coarse grained beads
+        self._cg        = None
+
+        # Indexes on the atoms and on the beads (see index)
+        self._atomIndex = None
+        self._beadIndex = None
+
+        # Origin of the chain, as (digest of the input, index of the chain),
+        # identifying the coarse grained beads in the cache (see Cache)
+        self.source     = None
+        self._shifts    = 0
+
+    def __len__(self):
+        # Return the number of residues
+        # DNA/RNA contain non-CAP d/r to indicate type. We remove those first.
+        return len(''.join(i for i in self.seq if i.isupper()))
+
+    def __add__(self,other):
+        newchain = Chain(name=self.id+"+"+other.id)
+        # Combine the chain items that can be simply added
+        for attr in self._attributes:
+            setattr(newchain, attr, getattr(self,attr) + getattr(other,attr))
+        # Set chain items, shifting the residue numbers
+        shift  = len(self)
+        newchain.breaks     = self.breaks + [shift] + [i+shift for i in other.breaks]
+        newchain.links      = self.links + [((i[0]+shift,i[1]),(j[0]+shift,j[1])) for i,j in other.links]
+        newchain.natoms     = len(newchain.atoms())
+        newchain.multiscale = self.multiscale or other.multiscale
+        # Return the merged chain
+        return newchain
+
+    def __eq__(self,other):
+        return (self.seq        == other.seq    and 
+                self.ss         == other.ss     and
+                self.breaks     == other.breaks and
+                self.links      == other.links  and
+                self.multiscale == other.multiscale)
+
+    # Extract a residue by number or the list of residues of a given type
+    # This facilitates selecting residues for links, like chain["CYS"]
+    def __getitem__(self,other):
+        if type(other) == str:
+            if not other in self.sequence:
+                return []
+            return [i for i in self.residues if i[0][1] == other]
+        elif type(other) == tuple:
+            # This functionality is set up for links
+            # between coarse grained beads. So these are
+            # checked first,
+            beads, position, residue = self.beadIndex()
+            if other in position:
+                return beads[position[other]]
+            atoms, position, residue = self.atomIndex()
+            if other[:3] in position:
+                return atoms[position[other[:3]]]
+            return []
+        return self.sequence[other]
+
+    # Extract a piece of a chain as a new chain
+    def __getslice__(self,i,j):
+        newchain = Chain(self.options,name=self.id)        
+        # Extract the slices from all lists
+        for attr in self._attributes:           
+            setattr(newchain, attr, getattr(self,attr)[i:j])
+        # Breaks that fall within the start and end of this chain need to be passed on.
+        # Residue numbering is increased by 20 bits!!
+        # XXX I don't know if this works.
+        ch_sta,ch_end = newchain.residues[0][0][2],newchain.residues[-1][0][2]
+        newchain.breaks     = [crack for crack in self.breaks if ch_sta < (crack<<20) < ch_end]
+        newchain.links     = [link for link in self.links if ch_sta < (link<<20) < ch_end]
+        newchain.multiscale = self.multiscale
+        newchain.natoms     = len(newchain.atoms())
+        newchain.type()
+        # Return the chain slice
+        return newchain
+
+    def _contains(self,index,atom):
+        atnm,resn,resi,chn = atom
+        
+        # If the chain does not match, bail out
+        if chn != self.id:
+            return False
+
+        # Check if the whole tuple is in
+        if atnm and resn and resi:
+            return (atnm,resn,resi) in self.atomIndex()[1]
+
+        # Fetch atoms with matching residue id
+        atomlist, position, residue = index
+        match = (not resi) and atomlist or residue.get(resi,[])
+        if not match:
+            return False
+
+        # Select atoms with matching residue name
+        match = (not resn) and match or [j for j in match if j[1] == resn]
+        if not match:
+            return False
+
+        # Check whether the atom is given and listed
+        if not atnm or [j for j in match if j[0] == atnm]:
+            return True
+
+        # It just is not in the list!
+        return False
+
+    def __contains__(self,other):
+        return self._contains(self.atomIndex(),other) or self._contains(self.beadIndex(),other)
+
+    def __hash__(self):
+        return id(self)
+
+    def atoms(self):
+        if not self._atoms:
+            self._atoms = [atom[:3] for residue in self.residues for atom in residue]
+            self._atomIndex = None
+        return self._atoms
+
+    # Index a list of atoms or beads, giving the list, the position of the
+    # first item for each identifier (the first n fields) and the items 
+    # per residue number. The indexes are built when first needed; the
+    # one on the beads is dropped when the beads are regenerated.
+    def index(self,items,n):
+        position, residue = {}, {}
+        for k,item in enumerate(items):
+            position.setdefault(item[:n],k)
+            residue.setdefault(item[2],[]).append(item)
+        return items, position, residue
+
+    def atomIndex(self):
+        atoms = self.atoms()
+        if self._atomIndex is None:
+            self._atomIndex = self.index(atoms,3)
+        return self._atomIndex
+
+    def beadIndex(self):
+        beads = self.cg()
+        if self._beadIndex is None:
+            self._beadIndex = self.index(beads,4)
+        return self._beadIndex
+
+    # Digest of the attributes compared in __eq__, which determine the 
+    # topology, so that identical chains have the same digest. With 
+    # coordinates, the atoms are included as well, which determine the
+    # elastic network and links found by distance.
+    def digest(self,coordinates=False):
+        sha1 = hashlib.sha1(repr((self.seq,self.ss,self.breaks,self.links,self.multiscale)))
+        if coordinates:
+            for residue in self.residues:
+                sha1.update(repr([atom[:7] for atom in residue]))
+        return sha1.hexdigest()
+
+    # Split a chain based on residue types; each subchain can have only one type
+    def split(self):
+        chains = []
+        chainStart = 0
+        for i in range(len(self.sequence)-1):
+            if residueTypes.get(self.sequence[i],"Unknown") != residueTypes.get(self.sequence[i+1],"Unknown"):
+                # Use the __getslice__ method to take a part of the chain.
+                chains.append(self[chainStart:i+1])
+                chainStart = i+1
+        if chains:
+            logging.debug('Splitting chain %s in %s chains'%(self.id,len(chains)+1))
+        return chains + [self[chainStart:]]
+
+    def getname(self,basename=None):
+        name = []
+        if basename:                      name.append(basename)
+        if self.type() and not basename:  name.append(self.type())
+        if type(self.id) == int:
+            name.append(chr(64+self.id))
+        elif self.id.strip():               
+            name.append(str(self.id))
+        return "_".join(name)
+
+    def set_ss(self,ss,source="self"):
+        if len(ss) == 1:
+            self.ss = len(self)*ss
+        else:
+            self.ss = ss
+        # Infer the Martini backbone secondary structure types
+        self.ssclass, self.sstypes = ssClassification(self.ss,source)
+
+    def dss(self,method=None,executable=None):
+        # The method should take a list of atoms and return a 
+        # string of secondary structure classifications       
+        if self.type() == "Protein":
+            if method:
+                atomlist = [atom for residue in self.residues for atom in residue]
+                self.set_ss(ssDetermination[method](self,atomlist,executable),source=method)
+            else:
+                self.set_ss(len(self)*"C")
+        else:
+            self.set_ss(len(self.sequence)*"-")
+        return self.ss
+
+    def type(self,other=None):
+        if other:
+            self._type = other
+        elif not self._type and len(self):
+            # Determine the type of chain
+            self._type     = set([residueTypes.get(i,"Unknown") for i in set(self.sequence)])
+            self._type     = len(self._type) > 1 and "Mixed" or list(self._type)[0]
+        return self._type
+
+
+    # XXX The following (at least the greater part of it) should be made a separate function, put under "MAPPING"
+    def cg(self,force=False,com=False,dna=False):
+        # Generate the coarse grained structure
+        # Set the b-factor field to something that reflects the secondary structure
+        
+        # If the coarse grained structure is set already, just return, 
+        # unless regeneration is forced.
+        if self._cg and not force:
+            return self._cg
+        self._cg = []
+        self._beadIndex = None
+        atid     = 1
+        bb       = [1]
+        fail     = False
+        previous = ''
+        coords   = []
+        weights  = []
+        groups   = []
+        shifts   = self._shifts
+        # For DNA we need to get the O3' to the following residue when calculating COM
+        # The force and com options ensure that this part does not affect itp generation or anything else
+        if com:
+            for residue,rss,resname in zip(self.residues,self.sstypes,self.sequence):
+                # Just an initialization, this should complain if it isn't updated in the loop
+                store = 0
+                for ind, i in enumerate(residue):
+                    if i[0] == "O3'":
+                        if previous != '':
+                            residue[ind] = previous
+                            previous = i
+                        else:
+                            store = ind
+                            previous = i
+                # We couldn't remove the O3' from the 5' end residue during the loop so we do it now
+                if store > 0:
+                    del residue[store]
+            # The residues are changed, which affects later calls
+            self._shifts += 1
+
+        # The beads may be in the cache from an earlier run on the same input
+        cache = self.options.get('Cache')
+        key   = None
+        if cache and self.source:
+            key   = cache.key("cg",self.source,self.sequence,com,shifts,mapDigest)
+            entry = cache.get(key)
+            if entry is not None:
+                return self.cgCached(entry)
+
+        index    = []
+        for n,(residue,rss,resname) in enumerate(zip(self.residues,self.sstypes,self.sequence)):
+            # Check if residues names has changed, for example because user has set residues interactively.
+            residue = [(atom[0],resname)+atom[2:] for atom in residue]
+            if residue[0][1] in ("SOL","HOH","TIP"):
+                continue
+            if not residue[0][1] in CoarseGrained.mapping.keys():
+                logging.warning("Skipped unknown residue %s\n"%residue[0][1])
+                continue
+            # Get the mapping for this residue
+            # mapIndices returns the atoms mapped to each bead
+            # This will fail if there are (too many) atoms missing, which is
+            # only problematic if a mapped structure is written; the topology
+            # is inferred from the sequence. So this is the best place to raise 
+            # an error
+            ids = mapIndices(residue)
+            if not all(ids):
+                logging.error("Too many atoms missing from residue %s %d(ch:%s):",residue[0][1],residue[0][2]>>20,residue[0][3])
+                logging.error(repr([ i[0] for i in residue ]))
+                fail = True
+                continue
+
+            for name,i in zip(CoarseGrained.names[residue[0][1]],ids):
+                # Add the bead with secondary structure id to the list; the coordinates follow below
+                self._cg.append((name,residue[0][1][:3],residue[0][2],residue[0][3],ss2num[rss]))
+                # Add the ids to the list, after converting them to indices to the list of atoms
+                self.mapping.append([atid+k for k in i])
+                # Add the ids to the list of groups, as indices to the flat list of atoms
+                groups.append([len(coords)+k for k in i])
+                index.append(n)
+
+            # Collect the atom coordinates and weights for the whole chain
+            coords.extend([atom[4:7] for atom in residue])
+            weights.extend([CoarseGrained.mass.get(atom[0][0],0) for atom in residue])
+
+            # Increment the atom id; This pertains to the atoms that are included in the output.
+            atid += len(residue)
+
+            # Keep track of the numbers for CONECTing
+            bb.append(bb[-1]+len(ids))
+
+        if fail:
+            logging.error("Unable to generate coarse grained structure due to missing atoms.")
+            sys.exit(1)
+
+        # Bead positions for the whole chain in one go
+        xyz      = mapCoordinates(numpy.array(coords,dtype=float).reshape((-1,3)),numpy.array(weights),groups)
+        self._cg = [i[:4]+tuple(x)+i[4:] for i,x in zip(self._cg,xyz.tolist())]
+
+        if key:
+            mapping = self.mapping[len(self.mapping)-len(self._cg):]
+            cache.put(key,
+                      name    = numpy.array([i[0] for i in self._cg],dtype=str),
+                      resn    = numpy.array([i[1] for i in self._cg],dtype=str),
+                      resi    = numpy.array([i[2] for i in self._cg],dtype=int),
+                      chain   = numpy.array([i[3] for i in self._cg],dtype=str),
+                      xyz     = xyz,
+                      residue = numpy.array(index,dtype=int),
+                      atoms   = numpy.array([k for i in mapping for k in i],dtype=int),
+                      count   = numpy.array([len(i) for i in mapping],dtype=int))
+
+        return self._cg
+
+    # Coarse grained beads from a cache entry written by cg. The secondary
+    # structure is taken from the chain, since it may differ between runs.
+    def cgCached(self,entry):
+        count    = entry["count"].tolist()
+        atoms    = entry["atoms"].tolist()
+        start    = numpy.cumsum([0]+count).tolist()
+        self.mapping.extend([atoms[i:j] for i,j in zip(start[:-1],start[1:])])
+        self._cg = [(name,resn,resi,chain,x,y,z,ss2num[self.sstypes[n]]) 
+                    for name,resn,resi,chain,(x,y,z),n in zip(entry["name"].tolist(),entry["resn"].tolist(),
+                        entry["resi"].tolist(),entry["chain"].tolist(),entry["xyz"].tolist(),entry["residue"].tolist())]
+        return self._cg
+
+    def conect(self):
+        # Return pairs of numbers that should be CONECTed
+        # First extract the backbone IDs
+        cg = self.cg()
+        bb = [i+1 for i,j in zip(range(len(cg)),cg) if j[0] == "BB"]
+        bb = zip(bb,bb[1:]+[len(bb)])
+        # Set the backbone CONECTs (check whether the distance is consistent with binding)        
+        conect = [(i,j) for i,j in bb[:-1] if distance2(cg[i-1][4:7],cg[j-1][4:7]) < 14]
+        # Now add CONECTs for sidechains
+        for i,j in bb:
+            nsc = j-i-1
+##################
+## 7 # TOPOLOGY ##  -> @TOP <-
+##################
+import logging,math,copy
+
+# This is a generic class for Topology Bonded Type definitions
+class Bonded:
+    # The init method is generic to the bonded types,
+    # but may call the set method if atoms are given
+    # as (ID, ResidueName, SecondaryStructure) tuples
+    # The set method is specific to the different types.
+    def __init__(self,other=None,options=None,**kwargs):
+        self.atoms = []
+        self.type = -1
+        self.parameters = []
+        self.comments = []
+        self.category = None 
+
+        if options and type(options) == dict:
+            self.options = options
+        if other:
+            # If other is given, then copy the attributes
+            # if it is of the same class or set the 
+            # attributes according to the key names if
+            # it is a dictionary
+            if other.__class__ == self.__class__:
+                for attr in dir(other):
+                    if not attr[0] == "_":
+                        setattr(self,attr,getattr(other,attr))
+            elif type(other) == dict:
+                for attr in other.keys():
+                    setattr(self,attr,other[attr])
+            elif type(other) in (list,tuple):
+                self.atoms = other
+
+        # For every item in the kwargs keys, set the attribute
+        # with the same name. This can be used to specify the 
+        # attributes directly or to override attributes 
+        # copied from the 'other' argument.
+        for key in kwargs:
+            setattr(self,key,kwargs[key])
+        
+        # If atoms are given as tuples of
+        # (ID, ResidueName[, SecondaryStructure])
+        # then determine the corresponding parameters 
+        # from the lists above
+        if self.atoms and type(self.atoms[0]) == tuple:
+            self.set(self.atoms,**kwargs)          
+
+    def __nonzero__(self):
+        return bool(self.atoms) and bool(self.parameters) 
+
+    def __str__(self):
+        if not self.atoms or not self.parameters:
+            return ""
+        s = ["%5d" % i for i in self.atoms]
+        # For exclusions, no type is defined, which equals -1
+        if self.type != -1: s.append(" %5d " % self.type)
+        # Print integers and floats in proper format and neglect None terms
+        s.extend([formatString(i) for i in self.parameters if i != None])
+        if self.comments:
+            s.append(';')
+            if type(self.comments) == str:
+                s.append(self.comments)
+            else:
+                s.extend([str(i) for i in self.comments])
+        return " ".join(s)
+
+    def __iadd__(self,num):
+        self.atoms = tuple([i+int(num) for i in self.atoms])
+        return self
+
+    def __add__(self,num):
+        out  = self.__class__(self)
+        out += num
+        return out
+
+    def __eq__(self,other):
+        if type(other) in (list,tuple):
+            return self.atoms == other
+        else:
+            return self.atoms == other.atoms and self.type == other.type and self.parameters == other.parameters
+
+    # This function needs to be overridden for descendents
+    def set(self,atoms,**kwargs):
+        pass
+
+
+# The set method of this class will look up parameters for backbone beads
+# Side chain bonds ought to be set directly, using the constructor
+# providing atom numbers, bond type, and parameters
+# Constraints are bonds with kb = None, which can be extracted 
+# using the category
+class Bond(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)     
+        self.atoms      = ids
+        self.type       = 1
+        self.positionCa = ca
+        self.comments   = "%s(%s)-%s(%s)" % (r[0],ss[0],r[1],ss[1])
+        # The category can be used to keep bonds sorted
+        self.category   = kwargs.get("category")
+       
+        if not self.parameters:
+            self.parameters = self.options['ForceField'].bbGetBond(r,ca,ss)
+        # If there are more than two parameters given, user HAS TO define the bond type as the first one.
+        # This is to allow use of any gromacs bond type.
+        if self.parameters and len(self.parameters) > 2:
+            self.type, self.parameters = self.parameters[0], self.parameters[1:]
+        # Backbone bonds also can be constraints. We could change the type further on, but this is more general.
+        # Even better would be to add a new type: BB-Constraint
+        if self.parameters and self.parameters[1] == None:
+            self.category = 'Constraint'
+
+    # Overriding __str__ method to suppress printing of bonds with Fc of 0
+    def __str__(self):
+        if len(self.parameters) > 1 and self.parameters[1] == 0:
+            return ""
+        return Bonded.__str__(self)
+
+
+# Similar to the preceding class
+class Angle(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)
+        self.atoms      = ids
+        self.type       = 2
+        self.positionCa = ca
+        self.comments   = "%s(%s)-%s(%s)-%s(%s)" % (r[0],ss[0],r[1],ss[1],r[2],ss[2])
+        self.category   = kwargs.get("category")
+        
+        self.parameters = self.options['ForceField'].bbGetAngle(r,ca,ss)
+        # If there are more than two parameters given, user HAS TO define the angle type as the first one.
+        # This is to allow use of any gromacs angle type.
+        if self.parameters and len(self.parameters) > 2:
+            self.type, self.parameters = self.parameters[0], self.parameters[1:]
+
+# Similar to the preceding class
+class Vsite(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)
+        self.atoms      = ids
+        self.type       = 1
+        self.positionCa = ca
+        self.comments   = "%s"% (r[0])
+        self.category   = kwargs.get("category")
+        self.parameters = kwargs.get("parameters") 
+        if not self.parameters:
+            self.parameters = self.options['ForceField'].bbGetVsite(r,ca,ss)
+            # This assumes type one virtual sites, COM of two beads
+            if self.parameters and len(self.parameters)>1:
+                self.atoms += self.parameters[:-1]
+                self.parameters = self.parameters[-1:]
+
+# Similar to the preceding class
+class Exclusion(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)
+        self.atoms      = ids
+        self.positionCa = ca
+        self.comments   = "%s"% (r[0])
+        self.category   = kwargs.get("category")
+        self.parameters = kwargs.get("parameters") 
+        if not self.parameters:
+            self.parameters = self.options['ForceField'].bbGetExclusion(r,ca,ss)
+
+# Similar to the preceding class
+class Pair(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)
+        self.atoms      = ids
+        self.positionCa = ca
+        self.comments   = "%s(%s)-%s(%s)"% (r[0],ss[0],r[1],ss[1])
+        self.category   = kwargs.get("category")
+        self.type       = kwargs.get("type") or 1 
+        if not self.parameters:
+            self.parameters = self.options['ForceField'].bbGetPair(r,ca,ss)
+
+# Similar to the preceding class
+class Dihedral(Bonded):
+    def set(self,atoms,**kwargs):
+        ids,r,ss,ca     = zip(*atoms)
+        self.atoms      = ids
+        self.type       = 1
+        self.positionCa = ca
+        self.comments   = "%s(%s)-%s(%s)-%s(%s)-%s(%s)" % (r[0],ss[0],r[1],ss[1],r[2],ss[2],r[3],ss[3])
+        self.category   = kwargs.get("category")
+        if not self.parameters:
+            self.parameters = self.options['ForceField'].bbGetDihedral(r,ca,ss)
+        # If there are more than two parameters given, user HAS TO define the diheral type as the first one.
+        # This is to allow use of any gromacs dihedral type.
+        if self.parameters and len(self.parameters)>2:
+            self.type,self.parameters = self.parameters[0],self.parameters[1:]
+
+        # XXX Move this to force field files to accommodate polbb and dna dihedrals in a uniform way
+        # if ''.join(i for i in ss) == 'FFFF':
+        #    # Collagen
+        #    self.parameters = self.options['ForceField'].bbDihedDictD['F']
+        #elif ''.join(i for i in ss) == 'EEEE' and self.options['ExtendedDihedrals']:
+        #    # Use dihedrals
+        #    self.parameters = self.options['ForceField'].bbDihedDictD['E']
+        #elif set(ss).issubset("H123"):
+        #    # Helix
+        #    self.parameters = self.options['ForceField'].bbDihedDictD['H']
+        #else:
+        #    self.parameters = None
+
+
+# Columnar storage for a block of bonded terms of one class and category,
+# such as the rubber bands of a molecule, which may run into the millions.
+# Rather than one object per term, the atom numbers and function types are
+# kept in arrays and each parameter in a column: either an array of numbers
+# with a format (None to format as Bonded does), or codes into a table of
+# strings. The comments are codes into a table of strings as well.
+# The lines written for the topology are the same as for separate objects;
+# terms that would give an empty line (e.g. bonds with Fc of 0) are
+# flagged in 'hidden'.
+class BondedTable:
+    def __init__(self,kind=Bonded,atoms=[],type=-1,parameters=[],comments=None,category=None,hidden=None):
+        self.kind       = kind
+        self.atoms      = numpy.array(atoms,dtype=int).reshape((len(atoms),len(atoms) and -1 or 2))
+        self.type       = numpy.zeros(len(atoms),dtype=int)+type
+        self.parameters = parameters
+        self.comments   = comments
+        self.category   = category
+        self.hidden     = hidden
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __str__(self):
+        return "\n".join(self.lines())
+
+    def __iadd__(self,num):
+        self.atoms = self.atoms+int(num)
+        return self
+
+    def __add__(self,num):
+        out  = BondedTable(self.kind,self.atoms,self.type,self.parameters,self.comments,self.category,self.hidden)
+        out += num
+        return out
+
+    # The lines for the terms from start to stop (default: all)
+    def lines(self,start=0,stop=None):
+        part = slice(start,stop)
+        if not len(self.atoms[part]):
+            return []
+        # Format string and columns for the lines, following Bonded.__str__
+        fmt     = ["%5d"]*self.atoms.shape[1]
+        columns = list(self.atoms[part].T.tolist())
+        # For exclusions, no type is defined, which equals -1
+        if (self.type != -1).any():
+            fmt.append(" %5d ")
+            columns.append(self.type[part].tolist())
+        for column in self.parameters:
+            fmt.append("%s")
+            columns.append(formatColumn(column,part))
+        if self.comments:
+            fmt.extend([";","%s"])
+            columns.append(formatColumn(self.comments,part))
+        fmt  = " ".join(fmt)
+        out  = [fmt%i for i in zip(*columns)]
+        if self.hidden is not None:
+            out = [not h and i or "" for i,h in zip(out,self.hidden[part].tolist())]
+        return out
+
+    # The lines in blocks of a given size, to write large tables piecewise
+    def chunks(self,size=10000):
+        for i in range(0,len(self),size):
+            yield self.lines(i,i+size)
+
+    # A table with the terms selected by a boolean array
+    def select(self,keep):
+        columns  = [(i[0],i[1][keep],i[2]) for i in self.parameters]
+        comments = self.comments and (self.comments[0],self.comments[1][keep],self.comments[2])
+        hidden   = None
+        if self.hidden is not None:
+            hidden = self.hidden[keep]
+        return BondedTable(self.kind,self.atoms[keep],self.type[keep],columns,comments,self.category,hidden)
+
+# Column of numbers for a BondedTable, with an optional format
+def numberColumn(values,format=None):
+    return ("number",numpy.array(values),format)
+
+# Column of strings for a BondedTable, stored as codes into a table 
+# of the unique strings
+def stringColumn(values):
+    table = {}
+    codes = [table.setdefault(i,len(table)) for i in values]
+    strings = len(table)*[None]
+    for i,j in table.items():
+        strings[j] = i
+    return ("string",numpy.array(codes,dtype=int),strings)
+
+def formatColumn(column,part=slice(None)):
+    values = column[1][part]
+    if column[0] == "string":
+        return [column[2][i] for i in values.tolist()]
+    if column[2]:
+        return [column[2]%i for i in values.tolist()]
+    if values.dtype.kind == "f" and not ((0 < abs(values)) & (abs(values) < 1e-5)).any():
+        return ["%8.5f"%i for i in values.tolist()]
+    return [formatString(i) for i in values.tolist()]
+
+# Convert a list of bonded terms of the same class and category to a
+# BondedTable. All terms need to have the same number of atoms and 
+# parameters, and either all or none need a function type.
+def bondedTable(items):
+    items = list(items)
+    if not items:
+        return BondedTable()
+    kind       = items[0].__class__
+    category   = items[0].category
+    atoms      = [tuple(i.atoms) for i in items]
+    types      = [i.type for i in items]
+    parameters = [[j for j in i.parameters if j != None] for i in items]
+    if (len(set([i.__class__ for i in items])) > 1 or len(set([i.category for i in items])) > 1 or
+        len(set([len(i) for i in atoms])) > 1 or len(set([len(i) for i in parameters])) > 1 or
+        len(set([i == -1 for i in types])) > 1):
+        raise ValueError("Bonded terms can not be stored in a single table")
+    columns = []
+    for column in zip(*parameters):
+        if set([type(i) for i in column]) in (set([float]),set([int])):
+            columns.append(numberColumn(column))
+        else:
+            columns.append(stringColumn([formatString(i) for i in column]))
+    comments = [i.comments for i in items]
+    if any(comments) and not all(comments):
+        raise ValueError("Bonded terms can not be stored in a single table")
+    if any(comments):
+        comments = stringColumn([type(i) == str and i or " ".join([str(j) for j in i]) for i in comments])
+    else:
+        comments = None
+    hidden = numpy.array([str(i) == "" for i in items])
+    if not hidden.any():
+        hidden = None
+    return BondedTable(kind,atoms,types,columns,comments,category,hidden)
+
+# Lines for a list of bonded terms, which may contain tables of terms
+def bondedLines(items):
+    out = []
+    for i in items:
+        if isinstance(i,BondedTable):
+            out.extend(i.lines())
+        else:
+            out.append(str(i))
+    return out
+
+# Atom numbers of the bonded terms in a list, which may contain tables,
+# as an array for each number of atoms per term. Hidden terms are left out.
+def bondedAtoms(items):
+    out = {}
+    for i in items:
+        if isinstance(i,BondedTable):
+            atoms = i.atoms
+            if i.hidden is not None:
+                atoms = atoms[~i.hidden]
+        else:
+            atoms = numpy.array([i.atoms],dtype=int)
+        if len(atoms):
+            out.setdefault(atoms.shape[1],[]).append(atoms)
+    return [numpy.concatenate(i) for i in out.values()]
+
+# Longest distance (nm) between two atoms of the same bonded term, with
+# the atoms of that term, given the coordinates (A) of the atoms in the
+# topology. This sets the minimum for mdrun -rdd. Terms that are not 
+# written (without parameters) are left out.
+def bondedRange(items,coords):
+    x = numpy.array(coords,dtype=float).reshape((-1,3))/10
+    longest, atoms = 0, ()
+    for a in bondedAtoms([i for i in items if isinstance(i,BondedTable) or i]):
+        for p in range(a.shape[1]):
+            for q in range(p+1,a.shape[1]):
+                d = x[a[:,p]-1]-x[a[:,q]-1]
+                d = numpy.sqrt(d[:,0]**2+d[:,1]**2+d[:,2]**2)
+                k = d.argmax()
+                if d[k] > longest:
+                    longest, atoms = d[k], tuple(a[k].tolist())
+    return longest, atoms
+
+# Longest distance (nm) between atoms coupled through at most 'order'
+# constraints, which sets the minimum for P-LINCS (mdrun -rcon). With
+# the default lincs-order of 4, five constraints are coupled.
+def constraintRange(items,coords,order=5):
+    x = numpy.array(coords,dtype=float).reshape((-1,3))/10
+    neighbours = {}
+    for a in bondedAtoms(items):
+        for i,j in a[:,:2].tolist():
+            neighbours.setdefault(i,set()).add(j)
+            neighbours.setdefault(j,set()).add(i)
+    longest = 0
+    for start in neighbours:
+        seen     = set([start])
+        frontier = [start]
+        for step in range(order):
+            frontier = [k for i in frontier for k in neighbours[i] if not k in seen]
+            seen.update(frontier)
+        d = x[numpy.array(list(seen))-1]-x[start-1]
+        longest = max(longest,numpy.sqrt(d[:,0]**2+d[:,1]**2+d[:,2]**2).max())
+    return longest
+
+# Atom numbers of the written terms in a list of bonded terms with n atoms
+# each, which may contain tables, as a single array in the order of the list
+def termAtoms(items,n):
+    atoms = bondedAtoms([i for i in items if isinstance(i,BondedTable) or i])
+    if not atoms:
+        return numpy.zeros((0,n),dtype=int)
+    return numpy.concatenate(atoms)
+
+# Index groups with one term each, named after the label and the atom 
+# numbers. All groups are formatted at once, from a single format string.
+def ndxGroups(label,atoms):
+    if not len(atoms):
+        return ""
+    n   = atoms.shape[1]
+    fmt = "[%s-%s]\n %s\n"%(label,"-".join(n*["%d"])," ".join(n*["%d"]))
+    return (len(atoms)*fmt)%tuple(numpy.hstack((atoms,atoms)).ravel().tolist())
+
+
+# This list allows to retrieve Bonded class items based on the category
+# If standard, dictionary type indexing is used, only exact matches are
+# returned. Alternatively, partial matching can be achieved by setting
+# a second 'True' argument. 
+# The items are kept in buckets per category, in order of insertion, with
+# their positions in the list. The buckets are built on the first lookup
+# and kept up to date when items are appended; any other change to the 
+# list discards them.
+class CategorizedList(list):
+    def __init__(self,*args):
+        list.__init__(self,*args)
+        self._index = None
+
+    def _buckets(self):
+        if getattr(self,"_index",None) is None:
+            self._index = {}
+            for pos,i in enumerate(self):
+                self._bucket(i).append((pos,i))
+        return self._index
+
+    def _bucket(self,item):
+        return self._index.setdefault(getattr(item,"category",None),[])
+
+    def _invalidate(self):
+        self._index = None
+
+    def __getitem__(self,tag): 
+        if type(tag) == str:
+            return [i for pos,i in self._buckets().get(tag,[])]
+
+        if type(tag) != tuple:
+            # Call the parent class __getitem__
+            return list.__getitem__(self,tag)
+
+        if not tag[1]:
+            return [i for pos,i in self._buckets().get(tag[0],[])]
+
+        buckets = [j for i,j in self._buckets().items() if i is not None and tag[0] in i]
+        if len(buckets) == 1:
+            return [i for pos,i in buckets[0]]
+        return [i for pos,i in sorted([k for j in buckets for k in j],key=lambda x: x[0])]
+
+    def append(self,item):
+        if getattr(self,"_index",None) is not None:
+            self._bucket(item).append((len(self),item))
+        list.append(self,item)
+
+    def extend(self,items):
+        if getattr(self,"_index",None) is not None:
+            items = list(items)
+            for pos,i in enumerate(items):
+                self._bucket(i).append((len(self)+pos,i))
+        list.extend(self,items)
+
+    def __iadd__(self,items):
+        self.extend(items)
+        return self
+
+    def __setitem__(self,*args):
+        self._invalidate()
+        return list.__setitem__(self,*args)
+
+    def __delitem__(self,*args):
+        self._invalidate()
+        return list.__delitem__(self,*args)
+
+    def __setslice__(self,*args):
+        self._invalidate()
+        return list.__setslice__(self,*args)
+
+    def __delslice__(self,*args):
+        self._invalidate()
+        return list.__delslice__(self,*args)
+
+    def insert(self,*args):
+        self._invalidate()
+        return list.insert(self,*args)
+
+    def pop(self,*args):
+        self._invalidate()
+        return list.pop(self,*args)
+
+    def remove(self,*args):
+        self._invalidate()
+        return list.remove(self,*args)
+
+    def reverse(self):
+        self._invalidate()
+        return list.reverse(self)
+
+    def sort(self,*args,**kwargs):
+        self._invalidate()
+        return list.sort(self,*args,**kwargs)
+
+
+# A bonded term or table of terms with the atom numbers shifted. For single
+# terms this takes a shallow copy, rather than copying all attributes 
+# through the constructor, as Bonded.__add__ does.
+def shifted(term,shift):
+    if isinstance(term,BondedTable):
+        return term+shift
+    out = copy.copy(term)
+    out.atoms = tuple([i+shift for i in term.atoms])
+    return out
+
+
+class Topology:
+    def __init__(self,other=None,options=None,name=""):
+        self.name        = ''
+        self.nrexcl      = 1
+        self.atoms       = CategorizedList()
+        self.pairs       = CategorizedList()
+        self.vsites      = CategorizedList() 
+        self.exclusions  = CategorizedList() 
+        self.bonds       = CategorizedList()
+        self.angles      = CategorizedList()
+        self.dihedrals   = CategorizedList()
+        self.impropers   = CategorizedList()
+        self.constraints = CategorizedList()
+        self.posres      = CategorizedList()
+        self.sequence    = []
+        self.secstruc    = ""
+        # Okay, this is sort of funny; we will add a 
+        #   #define mapping virtual_sitesn
+        # to the topology file, followed by a header
+        #   [ mapping ]
+        self.mapping     = []
+        # For multiscaling we have to keep track of the number of 
+        # real atoms that correspond to the beads in the topology
+        self.natoms      = 0        
+        self.multiscale  = options['multi']
+
+        if options:
+            self.options = options
+        else:
+            self.options = {}
+
+        if not other:
+            # Returning an empty instance
+            return
+        elif isinstance(other,Topology):
+            for attrib in ["atoms","vsites","bonds","angles","dihedrals","impropers","constraints","posres"]:
+                setattr(self,attrib,getattr(other,attrib,[]))
+        elif isinstance(other,Chain):
+            if other.type() == "Protein" and other.options['ForceField'].name in ['polbb']:
+                self.fromAminoAcidSequencePolBB(other)
+            elif other.type() == "Protein":
+                self.fromAminoAcidSequence(other)
+            elif other.type() == "Nucleic":
+                self.fromNucleicAcidSequence(other)
+            else:
+                # This chain should not be polymeric, but a collection of molecules
+                # For each unique residue type fetch the proper moleculetype 
+                self.fromMoleculeList(other)
+        if name:
+            self.name = name
+
+    def __iadd__(self,other):
+        if not isinstance(other,Topology):
+            other = Topology(other)
+        shift     = len(self.atoms)
+        last      = self.atoms[-1]
+        # Update atom, residue and charge group numbers in a single pass.
+        # The atoms are cut to the shortest length, as was done by zipping 
+        # the columns, which drops the comment of atoms with a specified mass
+        # (9 long tuples) when mixed with others. Let's add some band aid to
+        # fix it...
+        # This of course doesn't work if there was a secondary structure to keep
+        # but think it affects at this stage only the output comment.
+        n         = other.atoms and min([len(i) for i in other.atoms])
+        atoms     = [(i[0]+shift,i[1],i[2]+last[2],i[3],i[4],i[5]+last[5])+i[6:n] for i in other.atoms]
+        atoms     = [i[-1] == 0 and i+('c',) or i for i in atoms]
+        self.atoms.extend(atoms)
+        # Shift the bonded terms. Tables are shifted as a whole, while single 
+        # terms get a shallow copy with the atom numbers shifted.
+        for attrib in ["bonds","vsites","angles","dihedrals","impropers","constraints","posres"]:
+            getattr(self,attrib).extend([shifted(source,shift) for source in getattr(other,attrib)])
+        return self
+
+    def __add__(self,other):
+        out = Topology(self)
+        if not isinstance(other,Topology):
+            other = Topology(other)
+        out += other
+        return out
+
+    # Store the bonded terms as tables (see BondedTable), taking together
+    # consecutive terms of the same class and category. Terms that do not
+    # fit a table, e.g. because of differing numbers of parameters, are kept.
+    def compact(self):
+        for attrib in ["pairs","vsites","exclusions","bonds","angles","dihedrals"]:
+            groups = []
+            for i in getattr(self,attrib):
+                if (isinstance(i,BondedTable) or not groups or isinstance(groups[-1][-1],BondedTable) or
+                    groups[-1][-1].__class__ != i.__class__ or groups[-1][-1].category != i.category):
+                    groups.append([i])
+                else:
+                    groups[-1].append(i)
+            items = []
+            for group in groups:
+                try:
+                    items.append(isinstance(group[0],BondedTable) and group[0] or bondedTable(group))
+                except ValueError:
+                    items.extend(group)
+            setattr(self,attrib,CategorizedList(items))
+
+    def __str__(self):
+        return "".join(self.chunks())
+
+    # Write the topology to a stream (e.g. a file or gzip file) piece by piece
+    def write(self,stream):
+        for chunk in self.chunks():
+            stream.write(chunk)
+
+    # The text of the topology in pieces, one for every block of lines
+    def chunks(self):
+        sep = ""
+        for block in self.sections():
+            if block:
+                yield sep+"\n".join(block)
+                sep = "\n"
+
+    # The lines of the topology, in blocks. The rubber bands, which can be
+    # many, are given in blocks from their tables (see BondedTable.chunks).
+    def sections(self):
+        if self.multiscale:
+             out  = [ '; MARTINI (%s) Multiscale virtual sites topology section for "%s"' %(self.options['ForceField'].name,self.name) ]
+        else:
+             string  = '; MARTINI (%s) Coarse Grained topology file for "%s"' %(self.options['ForceField'].name, self.name)
+             string += '\n; Created by py version %s \n; Using the following options:  ' %(self.options['Version'])
+             string += ' '.join(self.options['Arguments'])
+             string += '\n; #####################################################################################################'
+             string += '\n; This topology is based on development beta of Martini DNA and should NOT be used for production runs.'
+             string += '\n; #####################################################################################################'
+             out  = [ string ]
+        if self.sequence:
+            out += [
+                '; Sequence:',
+                '; ' + ''.join([ AA321.get(AA) for AA in self.sequence ]),
+                '; Secondary Structure:',
+                '; ' + self.secstruc,
+                ]
+        
+        # Do not print a molecule name when multiscaling
+        # In that case, the topology created here needs to be appended
+        # at the end of an atomistic moleculetype
+        if not self.multiscale:
+            out += [ '\n[ moleculetype ]',
+                     '; Name         Exclusions',  
+                     '%-15s %3d' % (self.name,self.nrexcl)]
+
+        out.append('\n[ atoms ]')
+
+        # For virtual sites and dummy beads we have to be able to specify the mass.
+        # Thus we need two different format strings:
+        fs8 = '%5d %5s %5d %5s %5s %5d %7.4f ; %s'  
+        fs9 = '%5d %5s %5d %5s %5s %5d %7.4f %7.4f ; %s'  
+        out.extend([len(i)==9 and fs9%i or fs8%i for i in self.atoms])
+        #for i in self.atoms:
+        #    print i
+
+        # Print the pairs.
+        pairs = bondedLines(self.pairs)
+        if pairs:
+            out.append('\n[ pairs ]')
+            out.extend(pairs)
+
+        # Print out the vsites only if they excist. Right now it can only be type 1 virual sites.
+        # TODO: This needs to be generalized for all virtual site types.
+        vsitesBB = bondedLines(self.vsites["BB"])
+        vsitesSC = bondedLines(self.vsites["SC"])
+        if vsitesBB or vsitesSC:
+            out.append('\n[ virtual_sites3 ]')
+        if vsitesBB:
+            out.append("; Backbone virtual sites.")
+            out.extend(vsitesBB)
+        if vsitesSC:
+            out.append("; Backbone virtual sites.")
+            out.extend(vsitesSC)
+
+        # Bonds in order: backbone, backbone-sidechain, sidechain, short elastic, long elastic        
+        out.append("\n[ bonds ]")       
+        # Backbone-backbone
+        bonds = bondedLines(self.bonds["BB"])
+        if bonds:
+            out.append("; Backbone bonds")
+            out.extend(bonds)
+        # Rubber Bands
+        rubber = self.bonds["Rubber",True]
+        if sum([len(i) if isinstance(i,BondedTable) else 1 for i in rubber]):
+            # Add a CPP style directive to allow control over the elastic network
+            out.append("#ifdef RUBBER_BANDS")
+            out.append("#ifndef RUBBER_FC\n#define RUBBER_FC %f\n#endif"%self.options['ElasticMaximumForce'])
+            yield out
+            out = []
+            for i in rubber:
+                if isinstance(i,BondedTable):
+                    for chunk in i.chunks():
+                        yield chunk
+                else:
+                    yield [str(i)]
+            out.append("#endif")
+        # Long rubber bands, which can be left out with -DSHORT_RUBBER_BANDS
+        rubber = self.bonds["Long rubber band"]
+        if sum([len(i) for i in rubber]):
+            out.append("#ifdef RUBBER_BANDS\n#ifndef SHORT_RUBBER_BANDS")
+            out.append("#ifndef RUBBER_FC\n#define RUBBER_FC %f\n#endif"%self.options['ElasticMaximumForce'])
+            yield out
+            out = []
+            for i in rubber:
+                for chunk in i.chunks():
+                    yield chunk
+            out.append("#endif\n#endif")
+        # Backbone-Sidechain/Sidechain-Sidechain
+        bonds = bondedLines(self.bonds["SC"])
+        if bonds:
+            out.append("; Sidechain bonds")
+            out.extend(bonds)
+        # Short elastic/Long elastic
+        bonds = bondedLines(self.bonds["Elastic short"])
+        if bonds:
+            out.append("; Short elastic bonds for extended regions")
+            out.extend(bonds)
+        bonds = bondedLines(self.bonds["Elastic long"])
+        if bonds:
+            out.append("; Long elastic bonds for extended regions")
+            out.extend(bonds)
+        # Cystine bridges
+        bonds = bondedLines(self.bonds["Cystine"])
+        if bonds:
+            out.append("; Cystine bridges")
+            out.extend(bonds)
+        # Other links
+        bonds = bondedLines(self.bonds["Link"])
+        if bonds:
+            out.append("; Links/Cystine bridges")
+            out.extend(bonds)
+
+        # Constraints
+        out.append("\n[ constraints ]")
+        out.extend(bondedLines(self.bonds["Constraint"]))
+
+        # Print out the exclusions only if they excist.
+        exclusions = bondedLines(self.exclusions)
+        if exclusions:
+            out.append('\n[ exclusions ]')
+            out.extend(exclusions)
+
+        if self.multiscale:
+            out += ['\n;\n; Coarse grained to atomistic mapping\n;',
+                    '#define mapping virtual_sitesn',
+                    '[ mapping ]']
+            for i,j in self.mapping:
+                out.append( ("%5d     2 "%i)+" ".join(["%5d"%k for k in j]) )
+            
+            logging.info('Created virtual sites section for multiscaled topology')
+            yield out
+            return
+
+        # Angles
+        out.append("\n[ angles ]")
+        out.append("; Backbone angles")
+        out.extend(bondedLines(self.angles["BBB"]))
+        out.append("; Backbone-sidechain angles")
+        out.extend(bondedLines(self.angles["BBS"]))
+        out.append("; Sidechain angles")
+        out.extend(bondedLines(self.angles["SC"]))
+
+        # Dihedrals
+        out.append("\n[ dihedrals ]")
+        out.append("; Backbone dihedrals")
+        out.extend(bondedLines([i for i in self.dihedrals["BBBB"] if i.parameters]))
+        out.append("; Sidechain dihedrals")
+        out.extend(bondedLines([i for i in self.dihedrals["BSC"] if i.parameters]))
+        out.append("; Sidechain improper dihedrals")
+        out.extend(bondedLines([i for i in self.dihedrals["SC"] if i.parameters]))
+
+        # Postition Restraints
+        if self.posres:
+            out.append("\n#ifdef POSRES")
+            out.append("#ifndef POSRES_FC\n#define POSRES_FC %.2f\n#endif"%self.options['PosResForce'])
+            out.append(" [ position_restraints ]")
+            out.extend(['  %5d    1    POSRES_FC    POSRES_FC    POSRES_FC'%i for i in self.posres])
+            out.append("#endif")
+
+        logging.info('Created coarsegrained topology')
+        yield out
+
+
+    # The atom numbers of the bonded terms used for parameterization, shifted
+    # by start, as a list of (kind, group label, array of atom numbers)
+    def bondedIndex(self,start=0):
+        out = []
+        for kind,n,terms,categories in (
+                ("bonds",    2,self.bonds,    (("BB","BB-bond"),("SC","SC-bond"),("Constraint","Const-bond"))),
+                ("angles",   3,self.angles,   (("BBB","BBB-angle"),("BBS","BBS-angle"),("SC","SC-angle"))),
+                ("dihedrals",4,self.dihedrals,(("BBBB","BB-dihedral"),("BSC","BSC-dihedral"),("SC","SC-dihedral")))):
+            for category,label in categories:
+                out.append((kind,label,termAtoms(terms[category],n)+start))
+        return out
+
+    def ndx(self,start,groups=None):
+        # We print out an index file with similar bonds grouped together 
+        # We print out an index group for each bond, angle and dihedral
+        # The groups are made directly from the arrays of atom numbers
+        out = {"bonds": [], "angles": [], "dihedrals": []}
+        for kind,label,atoms in groups or self.bondedIndex(start):
+            out[kind].append(ndxGroups(label,atoms))
+        logging.info('Created index files for bonded parameters.')
+        return ''.join(out["bonds"]), ''.join(out["angles"]), ''.join(out["dihedrals"])
+
+  
+    # The sequence function can be used to generate the topology for 
+    # a sequence :) either given as sequence or as chain
+    def fromAminoAcidSequence(self,sequence,secstruc=None,links=None,breaks=None,
+                              mapping=None,rubber=False,multi=False):
+        # Shift for the atom numbers of the atomistic part in a chain 
+        # that is being multiscaled
+        shift = 0
+        # First check if we get a sequence or a Chain instance
+        if isinstance(sequence, Chain):
+            chain         = sequence
+            links         = chain.links
+            breaks        = chain.breaks
+            # If the mapping is not specified, the actual mapping is taken,
+            # used to construct the coarse grained system from the atomistic one.
+            # The function argument "mapping" could be used to use a default 
+            # mapping scheme in stead, like the mapping for the GROMOS96 force field.
+            mapping = mapping           or chain.mapping
+            multi   = self.options['multi']  or chain.multiscale
+            self.secstruc = chain.sstypes or len(chain)*"C"
+            self.sequence = chain.sequence
+            # If anything hints towards multiscaling, do multiscaling
+            self.multiscale = self.multiscale or chain.multiscale or multi
+            if self.multiscale:
+                shift        = self.natoms
+                self.natoms += len(chain.atoms())
+        elif not secstruc:
+            # If no secondary structure is provided, set all to coil
+            chain         = None
+            self.secstruc = len(self.sequence)*"C"
+        else:
+            # If a secondary structure is provided, use that. chain is none.
+            chain         = None
+            self.secstruc = secstruc
+
+        logging.debug(self.secstruc)
+        logging.debug(self.sequence)
+
+        # Fetch the sidechains
+        # Pad with empty lists for atoms, bonds, angles 
+        # and dihedrals, and take the first four lists out
+        # This will avoid errors for residues for which 
+        # these are not defined.
+
+        sc = [(self.options['ForceField'].sidechains[res]+5*[[]])[:5] for res in self.sequence]
+
+        # ID of the first atom/residue
+        # The atom number and residue number follow from the last 
+        # atom c.q. residue id in the list processed in the topology
+        # thus far. In the case of multiscaling, the real atoms need 
+        # also be accounted for.
+        startAtom = self.natoms + 1 
+        startResi = self.atoms and self.atoms[-1][2]+1 or 1
+
+        # Backbone bead atom IDs
+        bbid = [startAtom]
+        for i in zip(*sc)[0]:
+            bbid.append(bbid[-1]+len(i)+1)
+
+        # Calpha positions, to get Elnedyn BBB-angles and BB-bond lengths
+        # positionCa = [residue[1][4:] for residue in chain.residues]
+        # The old method (line above) assumed no hydrogens: Ca would always be
+        # the second atom of the residue. Now we look at the name.
+        positionCa = []
+        for residue in chain.residues:
+            for atom in residue:
+                if atom[0] == "CA":
+                    positionCa.append(atom[4:])
+
+        # Residue numbers for this moleculetype topology
+        resid = range(startResi,startResi+len(self.sequence))     
+        
+        # This contains the information for deriving backbone bead types,
+        # bb bond types, bbb/bbs angle types, and bbbb dihedral types and
+        # Elnedyn BB-bondlength BBB-angles
+        seqss = zip(bbid,self.sequence,self.secstruc,positionCa)
+
+        # Fetch the proper backbone beads          
+        bb = [self.options['ForceField'].bbGetBead(res,typ) for num,res,typ,Ca in seqss]
+
+        # If termini need to be charged, change the bead types
+        if not self.options['NeutralTermini']:
+            bb[0]  ="Qd"
+            bb[-1] = "Qa"
+
+        # If breaks need to be charged, change the bead types 
+        if self.options['ChargesAtBreaks']:
+            for i in breaks:
+                bb[i]   = "Qd"
+                bb[i-1] = "Qa"
+
+        # For backbone parameters, iterate over fragments, inferred from breaks
+        for i,j in zip([0]+breaks,breaks+[-1]):
+            # Extract the fragment
+            frg = j==-1 and seqss[i:] or seqss[i:j]
+
+            # Iterate over backbone bonds
+            self.bonds.extend([Bond(pair,category="BB",options=self.options,) for pair in zip(frg,frg[1:])])
+
+            # Iterate over backbone angles
+            # Don't skip the first and last residue in the fragment
+            self.angles.extend([Angle(triple,options=self.options,category="BBB") for triple in zip(frg,frg[1:],frg[2:])])
+
+            # Get backbone quadruples
+            quadruples = zip(frg,frg[1:],frg[2:],frg[3:])
+
+            # No i-1,i,i+1,i+2 interactions defined for Elnedyn
+            if self.options['ForceField'].UseBBBBDihedrals:
+                # Process dihedrals
+                for q in quadruples:
+                    id,rn,ss,ca = zip(*q)
+                    # Maybe do local elastic networks
+                    if ss == ("E","E","E","E") and not self.options['ExtendedDihedrals']:
+                        # This one may already be listed as the 2-4 bond of a previous one
+                        if not (id[0],id[2]) in self.bonds:
+                            self.bonds.append(Bond(options=self.options,atoms=(id[0],id[2]),parameters=self.options['ForceField'].ebonds['short'],type=1,
+                                                   comments="%s(%s)-%s(%s) 1-3"%(rn[0],id[0],rn[2],id[2]),
+                                                   category="Elastic short"))
+                        self.bonds.append(Bond(options=self.options,atoms=(id[1],id[3]),parameters=self.options['ForceField'].ebonds['short'],type=1,
+                                               comments="%s(%s)-%s(%s) 2-4"%(rn[1],id[1],rn[3],id[3]),
+                                               category="Elastic short"))
+                        self.bonds.append(Bond(options=self.options,atoms=(id[0],id[3]),parameters=self.options['ForceField'].ebonds['long'],type=1,
+                                               comments="%s(%s)-%s(%s) 1-4"%(rn[0],id[0],rn[3],id[3]),
+                                               category="Elastic long"))
+                    else:
+                        # Since dihedrals can return None, we first collect them separately and then
+                        # add the non-None ones to the list
+                        dihed = Dihedral(q,options=self.options,category="BBBB")
+                        if dihed:
+                            self.dihedrals.append(dihed)
+
+            # Elnedyn does not use backbone-backbone-sidechain-angles
+            if self.options['ForceField'].UseBBSAngles:
+                # Backbone-Backbone-Sidechain angles
+                # If the first residue has a sidechain, we take SBB, otherwise we skip it
+                # For other sidechains, we 'just' take BBS
+                if len(frg) > 1 and frg[1][0]-frg[0][0] > 1:
+                    self.angles.append(Angle(options=self.options,atoms=(frg[0][0]+1,frg[0][0],frg[1][0]),parameters=self.options['ForceField'].bbsangle,type=2,
+                                            comments="%s(%s)-%s(%s) SBB"%(frg[0][1],frg[0][2],frg[1][1],frg[1][2]),
+                                            category="BBS"))
+    
+                # Start from first residue: connects sidechain of second residue
+                for (ai,ni,si,ci),(aj,nj,sj,cj),s in zip(frg[0:],frg[1:],sc[1:]):
+                    if s[0]:
+                        self.angles.append(Angle(options=self.options,atoms=(ai,aj,aj+1),parameters=self.options['ForceField'].bbsangle,type=2,
+                                                comments="%s(%s)-%s(%s) SBB"%(ni,si,nj,sj),
+                                                category="BBS"))
+           
+        # Now do the atom list, and take the sidechains along
+        #
+        # AtomID AtomType ResidueID ResidueName AtomName ChargeGroup Charge ; Comments
+        # 
+        atid  = startAtom
+        for resi,resname,bbb,sidechn,ss in zip(resid,self.sequence,bb,sc,self.secstruc):
+            scatoms, bon_par, ang_par, dih_par, vsite_par = sidechn
+
+            # Side chain bonded terms
+            # Collect bond, angle and dihedral connectivity
+            bon_con,ang_con,dih_con,vsite_con = (self.options['ForceField'].connectivity[resname]+4*[[]])[:4]
+
+            # Side Chain Bonds/Constraints
+            for atids,par in zip(bon_con,bon_par):
+                if par[1] == None:
+                    self.bonds.append(Bond(options=self.options,atoms=atids,parameters=[par[0]],type=1,
+                                           comments=resname,category="Constraint"))
+                else:
+                    self.bonds.append(Bond(options=self.options,atoms=atids,parameters=par,type=1,
+                                           comments=resname,category="SC"))
+                # Shift the atom numbers
+                self.bonds[-1] += atid
+
+            # Side Chain Angles
+            for atids,par in zip(ang_con,ang_par):
+                self.angles.append(Angle(options=self.options,atoms=atids,parameters=par,type=2,
+                                         comments=resname,category="SC"))
+                # Shift the atom numbers
+                self.angles[-1] += atid
+
+            # Side Chain Dihedrals
+            for atids,par in zip(dih_con,dih_par):
+                self.dihedrals.append(Dihedral(options=self.options,atoms=atids,parameters=par,type=2,
+                                               comments=resname,category="SC"))
+                # Shift the atom numbers
+                self.dihedrals[-1] += atid
+
+            # Side Chain V-Sites
+            for atids,par in zip(vsite_con,vsite_par):
+                self.vsites.append(Vsite(options=self.options,atoms=atids,parameters=par,type=1,
+                                               comments=resname,category="SC"))
+                # Shift the atom numbers
+                self.vsites[-1] += atid
+            
+            # Side Chain exclusions
+            # The new polarizable forcefield give problems with the charges in the sidechain, if the backbone is also charged.
+            # To avoid that, we add explicit exclusions
+            if bbb in self.options['ForceField'].charges.keys() and resname in self.options['ForceField'].mass_charge.keys():
+                for i in [i for i, d in enumerate(scatoms) if d=='D']:
+                    self.exclusions.append(Exclusion(options=self.options,atoms=(atid,i+atid+1),comments='%s(%s)'%(resname,resi),parameters=(None,)))
+
+            # All residue atoms
+            counter = 0  # Counts over beads
+            for atype,aname in zip([bbb]+list(scatoms),CoarseGrained.residue_bead_names):
+                if self.multiscale:
+                    atype,aname = "v"+atype,"v"+aname
+                # If mass or charge diverse, we adopt it here. 
+                # We don't want to do this for BB beads because of charged termini.
+                if resname in self.options['ForceField'].mass_charge.keys() and counter != 0:
+                    M,Q = self.options['ForceField'].mass_charge[resname]
+                    aname = Q[counter-1]>0 and 'SCP' or Q[counter-1]<0 and 'SCN' or aname
+                    self.atoms.append((atid,atype,resi,resname,aname,atid,Q[counter-1],M[counter-1],ss))
+                else:
+                    self.atoms.append((atid,atype,resi,resname,aname,atid,self.options['ForceField'].charges.get(atype,0),ss))
+                # Doing this here save going over all the atoms onesmore.
+                # Generate position restraints for all atoms or Backbone beads only.
+                if 'all' in self.options['PosRes']:
+                    self.posres.append((atid)) 
+                elif aname in self.options['PosRes']:
+                    self.posres.append((atid))
+                if mapping:
+                    self.mapping.append((atid,[i+shift for i in mapping[counter]]))
+                atid    += 1
+                counter += 1
+
+        # The rubber bands are best applied outside of the chain class, as that gives
+        # more control when chains need to be merged. The possibility to do it on the 
+        # chain level is retained to allow building a complete chain topology in 
+        # a straightforward manner after importing this script as module.
+        if rubber and chain:
+            rubberList = rubberBands(
+                [(i[0],j[4:7]) for i,j in zip(self.atoms,chain.cg()) if i[4] in ElasticBeads],
+                ElasticLowerBound,ElasticUpperBound,
+                ElasticDecayFactor,ElasticDecayPower,
+                ElasticMaximumForce,ElasticMinimumForce)
+            self.bonds.append(rubberList)
+        
+        # Note the equivalent of atomistic atoms that have been processed 
+        if chain and self.multiscale:
+            self.natoms += len(chain.atoms())
+
+    def fromNucleicAcidSequence(self,sequence,secstruc=None,links=None,breaks=None,
+                              mapping=None,rubber=False,multi=False):
+
+        # Shift for the atom numbers of the atomistic part in a chain 
+        # that is being multiscaled
+        shift = 0
+        # Elastic network for DNA
+        #self.options['ElasticBeads'] = ['BB1', 'BB2', 'BB3', 'SC1', 'SC2', 'SC3', 'SC4']
+        #self.options['ElasticBeads'] = ['BB3', 'SC1', 'SC2', 'SC3', 'SC4']
+        #self.options['ElasticBeads'] = ['BB1', 'BB2', 'BB3']
+        #self.options['ElasticBeads'] = ['BB1', 'BB2']
+        # First check if we get a sequence or a Chain instance
+        if isinstance(sequence, Chain):
+            chain         = sequence
+            links         = chain.links
+            breaks        = chain.breaks
+            # If the mapping is not specified, the actual mapping is taken,
+            # used to construct the coarse grained system from the atomistic one.
+            # The function argument "mapping" could be used to use a default 
+            # mapping scheme in stead, like the mapping for the GROMOS96 force field.
+            mapping = mapping           or chain.mapping
+            multi   = self.options['multi']  or chain.multiscale
+            self.secstruc = chain.sstypes or len(chain)*"C"
+            self.sequence = chain.sequence
+            # If anything hints towards multiscaling, do multiscaling
+            self.multiscale = self.multiscale or chain.multiscale or multi
+            if self.multiscale:
+                shift        = self.natoms
+                self.natoms += len(chain.atoms())
+        elif not secstruc:
+            # If no secondary structure is provided, set all to coil
+            chain         = None
+            self.secstruc = len(self.sequence)*"C"
+        else:
+            # If a secondary structure is provided, use that. chain is none.
+            chain         = None
+            self.secstruc = secstruc
+
+        logging.debug(self.secstruc)
+        logging.debug(self.sequence)
+
+        # Fetch the base information 
+        # Pad with empty lists for atoms, bonds, angles 
+        # and dihedrals, and take the first five lists out
+        # This will avoid errors for residues for which 
+        # these are not defined.
+
+        sc = [(self.options['ForceField'].bases[res]+8*[[]])[:8] for res in self.sequence]
+
+        # ID of the first atom/residue
+        # The atom number and residue number follow from the last 
+        # atom c.q. residue id in the list processed in the topology
+        # thus far. In the case of multiscaling, the real atoms need 
+        # also be accounted for.
+        startAtom = self.natoms + 1 
+        startResi = self.atoms and self.atoms[-1][2]+1 or 1
+
+        # Backbone bead atom IDs
+        bbid = [[startAtom,startAtom+1,startAtom+2]]
+        for i in zip(*sc)[0]:
+            bbid1 = bbid[-1][0]+len(i)+3
+            bbid.append([bbid1,bbid1+1,bbid1+2])
+            #bbid.append(bbid[-1]+len(i)+1)
+
+        # Residue numbers for this moleculetype topology
+        resid = range(startResi,startResi+len(self.sequence))     
+
+        # This contains the information for deriving backbone bead types,
+        # bb bond types, bbb/bbs angle types, and bbbb dihedral types.
+        seqss = zip(bbid,self.sequence,self.secstruc)
+
+        # Fetch the proper backbone beads          
+        # Since there are three beads we need to split these to the list
+        bb = [self.options['ForceField'].bbGetBead(res,typ) for num,res,typ in seqss]
+        bbMulti = [i for j in bb for i in j]
+
+        # This is going to be usefull for the type of the last backbone bead.
+        # If termini need to be charged, change the bead types
+        #if not self.options['NeutralTermini']:
+        #    bb[0]  ="Qd"
+        #    bb[-1] = "Qa"
+
+        # If breaks need to be charged, change the bead types 
+        #if self.options['ChargesAtBreaks']:
+        #    for i in breaks:
+        #        bb[i]   = "Qd"
+        #        bb[i-1] = "Qa"
+
+        # For backbone parameters, iterate over fragments, inferred from breaks
+        for i,j in zip([0]+breaks,breaks+[-1]):
+            # Extract the fragment
+            frg = j==-1 and seqss[i:] or seqss[i:j]
+            # Expand the 3 bb beads per residue into one long list
+            # Resulting list contains three tuples per residue 
+            # We use the useless ca parameter to get the correct backbone bond from bbGetBond 
+            # The i is used to define ca because it conveniently here gives the right sequence 0,1,2,0,1,...
+            frg = [(j[0][i],j[1],j[2],i) for j in frg for i in range(len(j[0]))]
+
+            # Iterate over backbone bonds, two loops are needed because there are multipe cross bonds in the BB.
+            # Since bonded interactions can return None, we first collect them separately and then
+            # add the non-None ones to the list
+            # This part assumes you have a linear backbone (checks only combinations that make sense for such) 
+            for ind,k in enumerate(frg):
+                    
+                # Exclusions iterate over the second atom.
+                # and then checked for each pair.
+                for l in frg[ind:ind+3]:
+                    excl = Exclusion((k,l),category="BB",options=self.options,)
+                    if excl:
+                        self.exclusions.append(excl) 
+
+                # Pairs iterate over the second atom.
+                # and then checked for each pair.
+                for l in frg[ind:ind+3]:
+                    pair = Pair((k,l),category="BB",options=self.options,)
+                    if pair:
+                        self.pairs.append(pair) 
+
+                # Bonds iterate over the second atom.
+                for l in frg[ind:ind+3]:
+                    bond = Bond((k,l),category="BB",options=self.options,)
+                    if bond:
+                        self.bonds.append(bond)
+                        
+                    # The angles need a third loop.
+                    for m in frg[ind:ind+3]:
+                        angle = Angle((k,l,m,),options=self.options,category="BBB")
+                        if angle:
+                            self.angles.append(angle)
+                            
+                        # The dihedrals need a fourth loop.
+                        for n in frg[ind+1:ind+4]:
+                            dihed = Dihedral((k,l,m,n,),options=self.options,category="BBBB")
+                            if dihed:
+                                if len(dihed.parameters) > 3:
+                                    dihed2 = Dihedral((k,l,m,n,),options=self.options, parameters=dihed.parameters[3:],category="BBBB")
+                                    dihed.parameters = dihed.parameters[:3]
+                                    self.dihedrals.append(dihed)
+                                    self.dihedrals.append(dihed2)
+                                else:
+                                    self.dihedrals.append(dihed)
+
+        # Now do the atom list, and take the sidechains along
+        #
+        atid  = startAtom
+        # We need to do some trickery to get all 3 bb beads in to these lists
+        # This adds each element to a list three times, feel free to shorten up
+        residMulti = [i for i in resid for j in range(3)]
+        sequenceMulti = [i for i in self.sequence for j in range(3)]
+        scMulti = [i for i in sc for j in range(3)]
+        secstrucMulti = [i for i in self.secstruc for j in range(3)]
+        count = 0
+        for resi,resname,bbb,sidechn,ss in zip(residMulti,sequenceMulti,bbMulti,scMulti,secstrucMulti):
+            # We only want one side chain per three backbone beads so this skips the others
+            if (count % 3) == 0:    
+                # Note added impropers in contrast to aa
+                scatoms, bon_par, ang_par, dih_par, imp_par, vsite_par, excl_par, pair_par = sidechn
+
+                # Side chain bonded terms
+                # Collect bond, angle and dihedral connectivity
+                # Impropers needed to be added here for DNA
+                bon_con,ang_con,dih_con,imp_con,vsite_con,excl_con, pair_con = (self.options['ForceField'].base_connectivity[resname]+7*[[]])[:7]
+                # Ill try to fix the exclusions by using separate connectivity record for DNA
+                #bon_con,ang_con,dih_con,imp_con,vsite_con = (self.options['ForceField'].connectivity[resname]+5*[[]])[:5]
+
+                # Side Chain Bonds/Constraints
+                for atids,par in zip(bon_con,bon_par):
+                    if par[2] == None:
+                        self.bonds.append(Bond(options=self.options,atoms=atids,parameters=[par[1]],type=par[0],
+                                               comments=resname,category="Constraint"))
+                    else:
+                        self.bonds.append(Bond(options=self.options,atoms=atids,parameters=par[1:],type=par[0],
+                                               comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.bonds[-1] += atid
+
+                # Side Chain Angles
+                for atids,par in zip(ang_con,ang_par):
+                    self.angles.append(Angle(options=self.options,atoms=atids,parameters=par[1:],type=par[0],
+                                             comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.angles[-1] += atid
+
+                # Side Chain Dihedrals
+                for atids,par in zip(dih_con,dih_par):
+                    self.dihedrals.append(Dihedral(options=self.options,atoms=atids,parameters=par[1:],type=par[0],
+                                                   comments=resname,category="BSC"))
+                    # Shift the atom numbers
+                    self.dihedrals[-1] += atid
+
+                # Side Chain Impropers
+                for atids,par in zip(imp_con,imp_par):
+                    self.dihedrals.append(Dihedral(options=self.options,atoms=atids,parameters=par[1:],type=par[0],
+                                                   comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.dihedrals[-1] += atid
+
+                # Side Chain V-Sites
+                for atids,par in zip(vsite_con,vsite_par):
+                    self.vsites.append(Vsite(options=self.options,atoms=atids,parameters=par,type=1,
+                                                   comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.vsites[-1] += atid
+
+                # XXX Should not be hard coded here!
+                # Currently DNA needs exclusions for the base
+                # The loop runs over the first backbone bead so 3 needs to be added to the indices
+                # for i in range(len(scatoms)):
+                #    for j in range(i+1, len(scatoms)):
+                #        self.exclusions.append(Exclusion(options=self.options,atoms=(i+atid+3,j+atid+3),comments='%s(%s)'%(resname,resi),parameters=(None,)))
+                # The above one is ugly hack if only one connectivity record can be used
+                # The one below is equally ugly but works for now
+                for atids,par in zip(excl_con,excl_par):
+                    self.exclusions.append(Exclusion(options=self.options,atoms=atids,parameters=' '))
+                    # Shift the atom numbers
+                    self.exclusions[-1] += atid
+
+                # Pairs
+                for atids,par in zip(pair_con,pair_par):
+                    self.pairs.append(Pair(options=self.options,atoms=atids,parameters=' '))
+                    # Shift the atom numbers
+                    self.pairs[-1] += atid
+                
+                # All residue atoms
+                counter = 0  # Counts over beads
+                # Need to tweak this to get all the backbone beads to the list with the side chain
+                bbbset = [bbMulti[count], bbMulti[count+1], bbMulti[count+2]]
+                for atype,aname in zip(bbbset+list(scatoms),CoarseGrained.residue_bead_names_dna):
+                    if self.multiscale:
+                        atype,aname = "v"+atype,"v"+aname
+                    #self.atoms.append((atid,atype,resi,resname,aname,atid,self.options['ForceField'].getCharge(atype,aname),ss))
+                    if atid in [vSite.atoms[0] for vSite in self.vsites]:
+                        #print 'in vsites', atid
+                        charge = self.options['ForceField'].getCharge(atype,aname)
+                        mass = 0
+                        self.atoms.append((atid,atype,resi,resname,aname,atid,charge,mass,ss))
+                        #print self.atoms[-1]
+                    else:
+                        charge = self.options['ForceField'].getCharge(atype,aname)
+                        if aname == 'BB1':
+                            mass = 72
+                        # For virtual sites
+                        #elif 'SC' in aname and (resname == 'DA' or resname == 'DG'):
+                        #    mass = 60
+                        else: 
+                            mass = 45
+                        self.atoms.append((atid,atype,resi,resname,aname,atid,charge,mass,ss))
+                    # Doing this here saves going over all the atoms onesmore.
+                    # Generate position restraints for all atoms or Backbone beads only.
+                    if 'all' in self.options['PosRes']:
+                        self.posres.append((atid)) 
+                    elif aname in self.options['PosRes']:
+                        self.posres.append((atid))
+                    if mapping:
+                        self.mapping.append((atid,[i+shift for i in mapping[counter]]))
+                    atid    += 1
+                    counter += 1
+            count += 1
+
+        # One more thing, we need to remove dihedrals (2) and an angle (1)  that reach beyond the 3' end
+        # This is stupid to do now but the total number of atoms seems not to be available before
+        # This iterate the list in reverse order so that removals don't affect later checks
+        for i in range(len(self.dihedrals)-1,-1,-1):
+            if (max(self.dihedrals[i].atoms) > self.atoms[-1][0]):
+                del self.dihedrals[i]
+        for i in range(len(self.angles)-1,-1,-1):
+            if (max(self.angles[i].atoms) > self.atoms[-1][0]):
+                del self.angles[i]
+
+        # The first residue of DNA (The 5' end) has a backbone that is only two beads. This is ugly
+        # but we'll save our headache of changing the whole internal logic. 
+        for i in range(len(self.bonds)-1,-1,-1):
+            if 1 in self.bonds[i].atoms:
+                del self.bonds[i]
+            else: 
+                self.bonds[i].atoms = tuple([j-1 for j in self.bonds[i].atoms])
+        for i in range(len(self.angles)-1,-1,-1):
+            if 1 in self.angles[i].atoms:
+                del self.angles[i]
+            else: 
+                self.angles[i].atoms = tuple([j-1 for j in self.angles[i].atoms])
+        for i in range(len(self.dihedrals)-1,-1,-1):
+            if 1 in self.dihedrals[i].atoms:
+                del self.dihedrals[i]
+            else: 
+                self.dihedrals[i].atoms = tuple([j-1 for j in self.dihedrals[i].atoms])
+        for i in range(len(self.vsites)-1,-1,-1):
+            if 1 in self.vsites[i].atoms:
+                del self.vsites[i]
+            else: 
+                self.vsites[i].atoms = tuple([j-1 for j in self.vsites[i].atoms])
+        for i in range(len(self.exclusions)-1,-1,-1):
+            if 1 in self.exclusions[i].atoms:
+                del self.exclusions[i]
+            else: 
+                self.exclusions[i].atoms = tuple([j-1 for j in self.exclusions[i].atoms])
+        for i in range(len(self.pairs)-1,-1,-1):
+            if 1 in self.pairs[i].atoms:
+                del self.pairs[i]
+            else: 
+                self.pairs[i].atoms = tuple([j-1 for j in self.pairs[i].atoms])
+
+        # Remove the first bead and shift the numbers of all others by one.
+        del self.atoms[0]
+        for i in range(len(self.atoms)):
+            self.atoms[i] = tuple([self.atoms[i][0]-1] + [j for j in self.atoms[i][1:]])
+
+        # Remove the last posres, faster than removing first and shifting all.
+        if len(self.posres) > 0:
+            del self.posres[-1]
+
+        # The rubber bands are best applied outside of the chain class, as that gives
+        # more control when chains need to be merged. The possibility to do it on the 
+        # chain level is retained to allow building a complete chain topology in 
+        # a straightforward manner after importing this script as module.
+        if rubber and chain:
+            rubberList = rubberBands(
+                [(i[0],j[4:7]) for i,j in zip(self.atoms,chain.cg()) if i[4] in ElasticBeads],
+                ElasticLowerBound,ElasticUpperBound,
+                ElasticDecayFactor,ElasticDecayPower,
+                ElasticMaximumForce,ElasticMinimumForce)
+            #self.bonds.extend([Bond(i,options=self.options,type=6,category="Rubber band") for i in rubberList])
+
+
+    def fromAminoAcidSequencePolBB(self,sequence,secstruc=None,links=None,breaks=None,
+                              mapping=None,rubber=False,multi=False):
+
+        # Shift for the atom numbers of the atomistic part in a chain 
+        # that is being multiscaled
+        shift = 0
+        # First check if we get a sequence or a Chain instance
+        if isinstance(sequence, Chain):
+            chain         = sequence
+            links         = chain.links
+            breaks        = chain.breaks
+            # If the mapping is not specified, the actual mapping is taken,
+            # used to construct the coarse grained system from the atomistic one.
+            # The function argument "mapping" could be used to use a default 
+            # mapping scheme in stead, like the mapping for the GROMOS96 force field.
+            mapping = mapping           or chain.mapping
+            multi   = self.options['multi']  or chain.multiscale
+            self.secstruc = chain.sstypes or len(chain)*"C"
+            self.sequence = chain.sequence
+            # If anything hints towards multiscaling, do multiscaling
+            self.multiscale = self.multiscale or chain.multiscale or multi
+            if self.multiscale:
+                shift        = self.natoms
+                self.natoms += len(chain.atoms())
+        elif not secstruc:
+            # If no secondary structure is provided, set all to coil
+            chain         = None
+            self.secstruc = len(self.sequence)*"C"
+        else:
+            # If a secondary structure is provided, use that. chain is none.
+            chain         = None
+            self.secstruc = secstruc
+
+        logging.debug(self.secstruc)
+        logging.debug(self.sequence)
+
+        # Fetch the base information 
+        # Pad with empty lists for atoms, bonds, angles 
+        # and dihedrals, and take the first five lists out
+        # This will avoid errors for residues for which 
+        # these are not defined.
+
+        sc = [(self.options['ForceField'].sidechains[res]+6*[[]])[:6] for res in self.sequence]
+
+        # ID of the first atom/residue
+        # The atom number and residue number follow from the last 
+        # atom c.q. residue id in the list processed in the topology
+        # thus far. In the case of multiscaling, the real atoms need 
+        # also be accounted for.
+        startAtom = self.natoms + 1 
+        startResi = self.atoms and self.atoms[-1][2]+1 or 1
+
+        # Backbone bead atom IDs
+        # XXX Number of backbone beads hardcoded
+        bbid = [[startAtom+i for i in range(4)]]
+        for i in zip(*sc)[0]:
+            bbid1 = bbid[-1][0]+len(i)+4
+            bbid.append([bbid1+i for i in range(4)])
+            #bbid.append(bbid[-1]+len(i)+1)
+
+        # Residue numbers for this moleculetype topology
+        resid = range(startResi,startResi+len(self.sequence))     
+
+        # This contains the information for deriving backbone bead types,
+        # bb bond types, bbb/bbs angle types, and bbbb dihedral types.
+        seqss = zip(bbid,self.sequence,self.secstruc)
+        # The last residue only has a Calpha in the BB and no dipole.
+        seqss[-1] = (seqss[-1][0][:1],)+seqss[-1][1:]
+
+        # Fetch the proper backbone beads          
+        # Since there are  N beads we need to split these to the list
+        bb = [self.options['ForceField'].bbGetBead(res,typ) for num,res,typ in seqss]
+        # bbGetBead always returns all the BB-beads. For the last residue to get out
+        # only the last we preprocess it together with seqss (which does have the right length).
+        bbMulti = [beadname for residue,beads in zip(seqss,bb) for atomid,beadname in zip(residue[0],beads)]
+
+        # This is going to be usefull for the type of the last backbone bead.
+        # If termini need to be charged, change the bead types
+        #if not self.options['NeutralTermini']:
+        #    bb[0]  ="Qd"
+        #    bb[-1] = "Qa"
+
+        # If breaks need to be charged, change the bead types 
+        #if self.options['ChargesAtBreaks']:
+        #    for i in breaks:
+        #        bb[i]   = "Qd"
+        #        bb[i-1] = "Qa"
+
+        # For backbone parameters, iterate over fragments, inferred from breaks
+        for i,j in zip([0]+breaks,breaks+[-1]):
+            # Extract the fragment
+            frg = j==-1 and seqss[i:] or seqss[i:j]
+            # Expand the N bb beads per residue into one long list
+            # Resulting list contains three tuples per residue 
+            # We use the useless ca parameter to get the correct backbone bond from bbGetBond 
+            frg = [(j[0][i],j[1],j[2],j[0][i]-1) for j in frg for i in range(len(j[0]))]
+
+            # Iterate over backbone bonds, two loops are needed because there are multipe cross bonds in the BB.
+            # Since bonded interactions can return None, we first collect them separately and then
+            # add the non-None ones to the list
+            # Number of backbone beads hardcoded to 4
+            for ind,k in enumerate(frg):
+                # Virtual site and exclusions we check per bead
+                vsite = Vsite((k,),category="BB",options=self.options,)
+                if vsite:
+                     self.vsites.append(vsite)
+                excl = Exclusion((k,),category="BB",options=self.options,)
+                if excl and max(excl.parameters) <= len(bbMulti):
+                    self.exclusions.append(excl)
+                
+                # Bonds and pairs interate over the second atom.
+                for l in frg[ind:ind+9]:
+                    bond = Bond((k,l),category="BB",options=self.options,)
+                    if bond:
+                        self.bonds.append(bond)
+                    pair = Pair((k,l),category="BB",options=self.options,type=2,)
+                    if pair:
+                        self.pairs.append(pair)
+
+                    # The angles need a third loop.
+                    for m in frg[ind:ind+9]:
+                        angle = Angle((k,l,m,),options=self.options,category="BBB")
+                        if angle:
+                            self.angles.append(angle)
+
+                        # The dihedrals need a fourth loop.
+                        for n in frg[ind:ind+9]:
+                            dihed = Dihedral((k,l,m,n,),options=self.options,category="BBBB")
+                            if dihed:
+                                self.dihedrals.append(dihed)
+
+        # Now do the atom list, and take the sidechains along
+        #
+        atid  = startAtom
+        # We need to do some trickery to get all N bb beads in to these lists
+        # This adds each element to a list three times, feel free to shorten up
+        residMulti = [res for i,res in enumerate(resid) for j in range(len(bb[i]))]
+        sequenceMulti = [resname for i,resname in enumerate(self.sequence) for j in range(len(bb[i]))]
+        # Would it be easier to only give a sidechain for the beads that connect to one (ie the first)?
+        scMulti = [sidechain for i,sidechain in enumerate(sc) for j in range(len(bb[i]))]
+        secstrucMulti = [secstruc for i,secstruc in enumerate(self.secstruc) for j in range(len(bb[i]))]
+        count = 0
+        for resi,resname,bbb,sidechn,ss in zip(residMulti,sequenceMulti,bbMulti,scMulti,secstrucMulti):
+            # We only want one side chain per three backbone beads so this skips the others
+            if (count % len(bb[0])) == 0:    
+                # Note added impropers in contrast to aa
+                scatoms, bon_par, ang_par, dih_par, imp_par, vsite_par = sidechn
+
+                # Side chain bonded terms
+                # Collect bond, angle and dihedral connectivity
+                bon_con,ang_con,dih_con,imp_con,vsite_con = (self.options['ForceField'].connectivity[resname]+5*[[]])[:5]
+
+                # Side Chain Bonds/Constraints
+                for atids,par in zip(bon_con,bon_par):
+                    if par[1] == None:
+                        self.bonds.append(Bond(options=self.options,atoms=atids,parameters=[par[0]],type=1,
+                                               comments=resname,category="Constraint"))
+                    else:
+                        self.bonds.append(Bond(options=self.options,atoms=atids,parameters=par,type=1,
+                                               comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.bonds[-1] += atid
+
+                # Side Chain Angles
+                for atids,par in zip(ang_con,ang_par):
+                    self.angles.append(Angle(options=self.options,atoms=atids,parameters=par,type=2,
+                                             comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.angles[-1] += atid
+
+                # Side Chain Dihedrals
+                for atids,par in zip(dih_con,dih_par):
+                    self.dihedrals.append(Dihedral(options=self.options,atoms=atids,parameters=par,type=2,
+                                                   comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.dihedrals[-1] += atid
+
+                # Side Chain Impropers
+                for atids,par in zip(imp_con,imp_par):
+                    self.dihedrals.append(Dihedral(options=self.options,atoms=atids,parameters=par,type=2,
+                                                   comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.dihedrals[-1] += atid
+
+                # Side Chain V-Sites
+                for atids,par in zip(vsite_con,vsite_par):
+                    self.vsites.append(Vsite(options=self.options,atoms=atids,parameters=par,type=1,
+                                                   comments=resname,category="SC"))
+                    # Shift the atom numbers
+                    self.vsites[-1] += atid
+            
+                # Side Chain exclusions
+                # The new polarizable forcefield give problems with the charges in the sidechain, if the backbone is also charged.
+                # To avoid that, we add explicit exclusions
+                if bbb in self.options['ForceField'].charges.keys() and resname in self.options['ForceField'].mass_charge.keys():
+                    for i in [i for i, d in enumerate(scatoms) if d=='D']:
+                        self.exclusions.append(Exclusion(options=self.options,atoms=(atid,i+atid+1),comments='%s(%s)'%(resname,resi),parameters=(None,)))
+
+                # All residue atoms
+                counter = 0  # Counts over beads
+                # Count it the current backbone bead. bbb is the current backbone residue
+                bbbset = [bbMulti[count+i] for i in range(len(seqss[resi-1][0]))]
+                aNames = CoarseGrained.residue_bead_names_polBB[1:4]+CoarseGrained.residue_bead_names_polBB[:1]+CoarseGrained.residue_bead_names_polBB[4:]
+                for atype,aname in zip(bbbset+list(scatoms),aNames):
+                    if self.multiscale:
+                        atype,aname = "v"+atype,"v"+aname
+                    # If mass or charge diverse, we adopt it here. 
+                    # We don't want to do this for BB beads because of charged termini.
+                    if resname in self.options['ForceField'].mass_charge.keys() and counter != 0:
+                        logging.error('Polarizable backbones and sidechains are not yet compatible.')
+                        sys.exit()
+                        M,Q = self.options['ForceField'].mass_charge[resname]
+                        aname = Q[counter-1]>0 and 'SCP' or Q[counter-1]<0 and 'SCN' or aname
+                        self.atoms.append((atid,atype,resi,resname,aname,atid,Q[counter-1],M[counter-1],ss))
+                    elif atid in [vSite.atoms[0] for vSite in self.vsites]:
+                        charge = self.options['ForceField'].getCharge(atype,aname)
+                        mass = 0
+                        self.atoms.append((atid,atype,resi,resname,aname,atid,charge,mass,ss))
+                    else:
+                        charge = self.options['ForceField'].getCharge(atype,aname)
+                        self.atoms.append((atid,atype,resi,resname,aname,atid,charge,ss))
+                    # Doing this here save going over all the atoms onesmore.
+                    # Generate position restraints for all atoms or Backbone beads only.
+                    if 'all' in self.options['PosRes']:
+                        self.posres.append((atid)) 
+                    elif aname in self.options['PosRes']:
+                        self.posres.append((atid))
+                    if mapping:
+                        self.mapping.append((atid,[i+shift for i in mapping[counter]]))
+                    atid    += 1
+                    counter += 1
+            count += 1
+
+#        # One more thing, we need to remove dihedrals (2) and an angle (1)  that reach beyond the 3' end
+#        # This is stupid to do now but the total number of atoms seems not to be available before
+#        # This iterate the list in reverse order so that removals don't affect later checks
+#        for i in range(len(self.dihedrals)-1,-1,-1):
+#            if (max(self.dihedrals[i].atoms) > self.atoms[-1][0]):
+#                del self.dihedrals[i]
+#        for i in range(len(self.angles)-1,-1,-1):
+#            if (max(self.angles[i].atoms) > self.atoms[-1][0]):
+#                del self.angles[i]
+
+
+    def fromMoleculeList(self,other):
+        pass
+
+#############
+## 8 # MAIN #  -> @MAIN <-
+#############
+import sys,logging,random,math,os,re,hashlib
+
+# Only the elastic bonds between the chains of a coarse grained structure (-eicf)
+def structureMain(options):
+    inStream = streamTag(options['-eicf'].value)
+    if inStream.next() != "PDB":
+        logging.error("The structure for -eicf should be a PDB file. Giving up...")
+        sys.exit(1)
+    title, atoms, box = pdbFrameIterator(inStream).next()
+    variants = [dict(options,**v) for v in options['Variants'] or [{}]]
+    beads    = set([b for v in variants for b in v['ElasticBeads']])
+    atomList = structureAtomList(atoms,beads)
+    logging.info("Elastic network between %d chains, using %d of %d beads."%(
+        len(set([i[1] for i in atomList])),len(atomList),len(atoms)))
+    # The protein backbone beads are used for every variant
+    interLists = interRubberBands(atomList,[dict(v,ElasticBeads=v['ElasticBeads']+["BB"]) for v in variants],
+        options['ElasticLowerBound'],options['ElasticDecayFactor'],options['ElasticDecayPower'],
+        options['ElasticMinimumForce'],options['ForceField'].EBondType,options['ElasticProcesses'])
+    logging.info("Elastic network between chains: %s bonds."%", ".join([str(len(i)) for i in interLists]))
+    for variant,interList in zip(options['Variants'] or [{}],interLists):
+        if variant and not os.path.isdir(variant['Directory']):
+            os.makedirs(variant['Directory'])
+        out = options["-o"] and open(os.path.join(variant.get('Directory',''),options['-o'].value),'w') or sys.stdout
+        out.write("; Elastic bonds between the chains of %s"%options['-eicf'].value)
+        writeInterRubberBands(out,interList,dict(options,**variant)['ElasticMaximumForce'])
+        if out is not sys.stdout:
+            out.close()
+
+
+def main(options):
+    if options['-eicf'].value:
+        return structureMain(options)
+
+    # Check whether to read from a gro/pdb file or from stdin
+    # We use an iterator to wrap around the stream to allow
+    # inferring the file type, without consuming lines already
+    if options['Models']:
+        # Only the selected models are read, found through the index of the file
+        index  = PDBIndex(options["-f"].value)
+        if not index.models and len(options['Models']) > 1:
+            logging.error("No MODEL records in %s, so only model 1 can be read. Giving up..."%options["-f"].value)
+            sys.exit()
+        absent = [i for i in options['Models'] if not 0 < i <= max(1,len(index.models))]
+        if absent:
+            logging.error("Models %s not in %s (%d models). Giving up..."%(
+                ",".join([str(i) for i in absent]),options["-f"].value,max(1,len(index.models))))
+            sys.exit()
+        logging.info("Reading models %s from %s."%(options['-mdl'].value,options["-f"].value))
+        inStream = streamTag(LineStream(index.readModels(options['Models'])))
+    else:
+        inStream = streamTag(options["-f"] and options["-f"].value or sys.stdin)
+    
+
+    # The streamTag iterator first yields the file type, which 
+    # is used to specify the function for reading frames
+    fileType = inStream.next()
+    if fileType == "GRO":
+        frameIterator = groFrameIterator
+    else:
+        frameIterator = pdbFrameIterator
+
+    # With a cache, the frames are identified by a digest of the input
+    # and the topologies also by a digest of this script.
+    cache = options['Cache']
+    if cache:
+        inStream = StreamDigest(inStream)
+        scriptDigest = hashlib.sha1(open(sys.argv[0],"rb").read()).hexdigest()
+    
+
+    ## ITERATE OVER FRAMES IN STRUCTURE FILE ##
+
+    # Now iterate over the frames in the stream
+    # This should become a StructureFile class with a nice .next method
+    model     = 1
+    cgOutPDB  = None
+    ssTotal   = []
+    cysteines = []
+    # Running averages of elastic network distances, per molecule
+    enAverage = []
+    for title,atoms,box in frameIterator(inStream):
+    
+        if fileType == "PDB":
+            # The PDB file can have chains, in which case we list and process them specifically
+            # TER statements are also interpreted as chain separators
+            # A chain may have breaks in which case the breaking residues are flagged
+            chains = [ Chain(options,[i for i in residues(chain)]) for chain in pdbChains(atoms) ]        
+        else:
+            # The GRO file does not define chains. Here breaks in the backbone are
+            # interpreted as chain separators. 
+            residuelist = [residue for residue in residues(atoms)]
+            # The breaks are indices to residues
+            broken = breaks(residuelist)
+            # Reorder, such that each chain is specified with (i,j,k)
+            # where i and j are the start and end of the chain, and 
+            # k is a chain identifier
+            chains = zip([0]+broken,broken+[len(residuelist)],range(len(broken)+1))
+            chains = [ Chain(options,residuelist[i:j],name=chr(65+k)) for i,j,k in chains ]
+    
+        for chain in chains:
+            chain.multiscale = "all" in options['multi'] or chain.id in options['multi']
+    
+        # Check the chain identifiers
+        if model == 1 and len(chains) != len(set([i.id for i in chains])):
+            # Ending down here means that non-consecutive blocks of atoms in the 
+            # PDB file have the same chain ID. The warning pertains to PDB files only, 
+            # since chains from GRO files get a unique chain identifier assigned.
+            logging.warning("Several chains have identical chain identifiers in the PDB file.")
+    
+        # Check if chains are of mixed type. If so, split them.
+        # Note that in some cases HETATM residues are part of a 
+        # chain. This will get problematic. But we cannot cover
+        # all, probably.
+        if not options['MixedChains']:
+            demixedChains = []
+            for chain in chains:
+                demixedChains.extend(chain.split())
+            chains = demixedChains
+
+        if cache:
+            digest = inStream.hexdigest()
+            for k,chain in enumerate(chains):
+                chain.source = (digest,k)
+    
+        n = 1
+        logging.info("Found %d chains:"%len(chains))
+        for chain in chains:
+            logging.info("  %2d:   %s (%s), %d atoms in %d residues."%(n,chain.id,chain._type,chain.natoms,len(chain)))
+            n += 1
+    
+        # Check all chains
+        keep = []
+        for chain in chains:
+            if chain.type() == "Water":
+                logging.info("Removing %d water molecules (chain %s)."%(len(chain),chain.id))
+            elif chain.type() in ("Protein","Nucleic"):
+                keep.append(chain)
+            # This is currently not active:
+            elif options['RetainHETATM']:
+                keep.append(chain)
+            else:
+                logging.info("Removing HETATM chain %s consisting of %d residues."%(chain.id,len(chain)))
+        chains = keep
+
+        # Here we interactively check the charge state of resides
+        # Can be easily expanded to residues other than HIS
+        for chain in chains:
+            for i,resname in enumerate(chain.sequence):
+                 if resname == 'HIS' and options['chHIS']:
+                     choices = {0:'HIH',1:'HIS'}
+                     choice = getChargeType(resname,i,choices)
+                     chain.sequence[i] = choice
+
+    
+
+        # Check which chains need merging
+        if model == 1:
+            order, merge = check_merge(chains, options['mergeList'], options['linkList'], options['CystineCheckBonds'] and options['CystineMaxDist2'])
+    
+
+        # Get the total length of the sequence
+        seqlength = sum([len(chain) for chain in chains])
+        logging.info('Total size of the system: %s residues.'%seqlength)
+    
+
+        ## SECONDARY STRUCTURE
+        ss = '' 
+        if options['Collagen']:
+            for chain in chains:
+                chain.set_ss("F")
+                ss += chain.ss
+        elif options["-ss"]:
+            # XXX We need error-catching here, 
+            # in case the file doesn't excist, or the string contains bogus.
+            # If the string given for the sequence consists strictly of upper case letters
+            # and does not appear to be a file, assume it is the secondary structure
+            ss = options["-ss"].value.replace('~','L').replace(' ','L')
+            if ss.isalnum() and ss.isupper() and not os.path.exists(options["-ss"].value):
+                ss = options["-ss"].value
+                logging.info('Secondary structure read from command-line:\n'+ss)
+            else:
+                # There ought to be a file with the name specified
+                ssfile = [ i.strip() for i in open(options["-ss"].value) ]
+        
+                # Try to read the file as a Gromacs Secondary Structure Dump
+                # Those have an integer as first line
+                if ssfile[0].isdigit():
+                    logging.info('Will read secondary structure from file (assuming Gromacs ssdump).')
+                    ss = "".join([ i for i in ssfile[1:] ])
+                else:
+                    # Get the secondary structure type from DSSP output
+                    logging.info('Will read secondary structure from file (assuming DSSP output).')
+                    pss = re.compile(r"^([ 0-9]{4}[0-9]){2}")
+                    ss  = "".join([i[16] for i in open(options["-ss"].value) if re.match(pss,i)])        
+            
+            # Now set the secondary structure for each of the chains
+            sstmp = ss
+            for chain in chains:
+                ln = min(len(sstmp),len(chain)) 
+                chain.set_ss(sstmp[:ln])
+                sstmp = ss[:ln]                         
+        else:
+            if options["-dssp"]:
+                method, executable = "dssp", options["-dssp"].value
+            #elif options["-pymol"]:
+            #    method, executable = "pymol", options["-pymol"].value
+            else:
+                logging.warning("No secondary structure or determination method speficied. Protein chains will be set to 'COIL'.")
+                method, executable = None, None
+        
+            for chain in chains:
+                ss += chain.dss(method, executable)
+        
+            # Used to be: if method in ("dssp","pymol"): but pymol is not supported
+            if method in ["dssp"]:
+                logging.debug('%s determined secondary structure:\n'%method.upper()+ss)
+        
+        # Collect the secondary structure classifications for different frames
+        ssTotal.append(ss)    
+    
+        # Write the coarse grained structure if requested
+        if options["-x"].value:
+            logging.info("Writing coarse grained structure.")
+            if cgOutPDB == None:
+                cgOutPDB = PDBWriter(options["-x"].value)
+            cgOutPDB.startModel(model,title,box)
+            atid = 1
+            write_start = 0
+            for i in order:
+                ci = chains[i]
+                cgOutPDB.startChain(ci.id)
+                if ci.multiscale:
+                    atid = cgOutPDB.atoms([atom[:7]+(0,) for r in ci.residues for atom in r],atid)
+                coarseGrained = ci.cg(com=True)
+                if coarseGrained:
+                    # For DNA we need to remove the first bead on the 5' end and shift the atids. 
+                    if ci.type() == 'Nucleic':
+                        write_start = 1
+                    else:
+                        write_start = 0
+                    atid = cgOutPDB.atoms(coarseGrained[write_start:],atid,ci.multiscale and "v" or "")
+                    cgOutPDB.write("TER\n")          
+                else:
+                    logging.warning("No mapping for coarse graining chain %s (%s); chain is skipped."%(ci.id,ci.type()))
+            cgOutPDB.write("ENDMDL\n")
+    
+        # Gather cysteine sulphur coordinates
+        cyslist = [cys["SG"] for chain in chains for cys in chain["CYS"]]
+        cysteines.append([cys for cys in cyslist if cys])
+
+        # Add the distances of the candidate elastic bonds to the running averages.
+        # As for the topology, the missing first bead of nucleic chains is skipped.
+        if options['ElasticNetwork'] and options['ElasticAverage']:
+            variants = options['Variants'] or [options]
+            beads    = set([b for v in variants for b in v['ElasticBeads']])
+            cutoff   = 10*(max([v['ElasticUpperBound'] for v in variants])+options['ElasticSkin'])+0.001
+            for k,j in enumerate(merge):
+                cg     = [b for i in j for b in chains[i].cg()[chains[i].type() == 'Nucleic' and 1 or 0:]]
+                names  = [b[0] for b in cg if b[0] in beads]
+                coords = [b[4:7] for b in cg if b[0] in beads]
+                if model == 1:
+                    enAverage.append(PairAverage(names,coords,cutoff,cache))
+                else:
+                    enAverage[k].add(names,coords)
+    
+        model += 1
+
+    if cgOutPDB:
+        cgOutPDB.close()
+    
+    
+    # Write the index file if requested.
+    # Mainly of interest for multiscaling.
+    # Could be improved by adding separte groups for BB, SC, etc.
+    if options["-n"].value:
+        logging.info("Writing index file.")
+        # Lists for All-atom, Virtual sites and Coarse Grain.
+        NAA,NVZ,NCG = [],[],[]
+        atid = 1
+        for i in order:
+            ci = chains[i]
+            coarseGrained = ci.cg()
+            if ci.multiscale:
+                NAA.extend([" %5d"%(a+atid) for a in range(ci.natoms)]) 
+                atid += ci.natoms
+            if coarseGrained:
+                # For DNA there is not first bead on 5' end and thus one bead less.
+                if ci.type() == 'Nucleic':
+                    if ci.multiscale:
+                        NVZ.extend([" %5d"%(a+atid) for a in range(len(coarseGrained)-1)])
+                    else:
+                        NCG.extend([" %5d"%(a+atid) for a in range(len(coarseGrained)-1)])
+                    atid += len(coarseGrained)-1               
+                else:
+                    if ci.multiscale:
+                        NVZ.extend([" %5d"%(a+atid) for a in range(len(coarseGrained))])
+                    else:
+                        NCG.extend([" %5d"%(a+atid) for a in range(len(coarseGrained))])
+                    atid += len(coarseGrained)               
+        outNDX   = open(options["-n"].value,"w")
+        outNDX.write("\n[ AA ]\n"+"\n".join([" ".join(NAA[i:i+15]) for i in range(0,len(NAA),15)]))
+        outNDX.write("\n[ VZ ]\n"+"\n".join([" ".join(NVZ[i:i+15]) for i in range(0,len(NVZ),15)]))
+        outNDX.write("\n[ CG ]\n"+"\n".join([" ".join(NCG[i:i+15]) for i in range(0,len(NCG),15)]))
+        outNDX.close()
+
+    
+    # Write the index file for mapping AA trajectory if requested
+    if options["-nmap"].value or options["-mapop"].value or options["-ft"].value:
+        # Get all AA atoms as lists of atoms in residues
+        # First we skip hetatoms and unknowns then iterate over beads
+        groups = list(mapGroups(atoms,chains))
+
+    if options["-nmap"].value:
+        logging.info("Writing trajectory index file.")
+        outNDX = open(options["-nmap"].value,"w")
+        for number,resnr,residue,name,ids,names in groups:
+            outNDX.write('[ Bead %i of residue %i ]\n'%(number,resnr))
+            outNDX.write("".join(['%s '%i for i in ids])+'\n')
+        outNDX.close()
+        # Write the list of bead numbers for mapping AA trajectories
+        if options["-seq"].value:
+            logging.info("Writing bead number list.")
+            outSEQ = open(options["-seq"].value,"w")
+            outSEQ.write("".join(['%i\n'%i for i in range(len(groups))]))
+            outSEQ.close()
+
+    # Write the mapping operator and map an AA trajectory if requested
+    if options["-mapop"].value or options["-ft"].value:
+        operator = mapOperator(groups)
+        if options["-mapop"].value:
+            logging.info("Writing mapping operator.")
+            writeMapOperator(options["-mapop"].value,operator)
+        if options["-ft"].value:
+            if not options["-xt"].value:
+                logging.error("No output file (-xt) given for the mapped trajectory.")
+                sys.exit(1)
+            logging.info("Mapping atomistic trajectory %s."%options["-ft"].value)
+            outXT = open(options["-xt"].value,"w")
+            nframes = mapTrajectory(operator,options["-ft"].value,outXT)
+            outXT.close()
+            logging.info("Mapped %d frames to %s."%(nframes,options["-xt"].value))
+
+    
+    # Evertything below here we only need, if we need to write a Topology
+    if options['-o']:
+
+        # Collect the secondary structure stuff and decide what to do with it
+        # First rearrange by the residue
+        ssTotal = zip(*ssTotal)
+        ssAver  = []
+        for i in ssTotal:
+            si = list(set(i))
+            if len(si) == 1:
+                # Only one type -- consensus
+                ssAver.append(si[0])
+            else:
+                # Transitions between secondary structure types
+                i = list(i)
+                si = [(1.0*i.count(j)/len(i),j) for j in si]
+                si.sort()
+                if si[-1][0] > options["-ssc"].value:
+                    ssAver.append(si[-1][1])
+                else:
+                    ssAver.append(" ")
+        
+        ssAver = "".join(ssAver)
+        logging.info('(Average) Secondary structure has been determined (see head of .itp-file).')
+        
+
+        # Divide the secondary structure according to the division in chains
+        # This will set the secondary structure types to be used for the 
+        # topology.
+        for chain in chains:
+            chain.set_ss(ssAver[:len(chain)])
+            ssAver = ssAver[len(chain):]
+
+        
+        # Now the chains are complete, each consisting of a residuelist, 
+        # and a secondary structure designation if the chain is of type 'Protein'.
+        # There may be mixed chains, there may be HETATM things. 
+        # Water has been discarded. Maybe this has to be changed at some point.
+        # The order in the coarse grained files matches the order in the set of chains.
+        #
+        # If there are no merges to be done, i.e. no global Elnedyn network, no 
+        # disulphide bridges, no links, no distance restraints and no explicit merges,
+        # then we can write out the topology, which will match the coarse grained file.
+        #
+        # If there are merges to be done, the order of things may be changed, in which
+        # case the coarse grained structure will not match with the topology...
+        
+        ## CYSTINE BRIDGES ##
+        # Extract the cysteine coordinates (for all frames) and the cysteine identifiers
+        if options['CystineCheckBonds']:
+            logging.info("Checking for cystine bridges, based on sulphur (SG) atoms lying closer than %.4f nm"%math.sqrt(options['CystineMaxDist2']/100))
+        
+            cyscoord  = zip(*[[j[4:7] for j in i] for i in cysteines])
+            cysteines = [i[:4] for i in cysteines[0]]
+        
+            bl, kb    = options['ForceField'].special[(("SC1","CYS"),("SC1","CYS"))]
+        
+            # Check the distances and add the cysteines to the link list if the 
+            # SG atoms have a distance smaller than the cutoff. The close pairs
+            # are found per frame with a cell list, keeping the minimum distance
+            # over all frames. But we could also take the maximum, or the mean.
+            closest = {}
+            cutoff  = math.sqrt(options['CystineMaxDist2'])*1.000001
+            for frame in zip(*cyscoord):
+                I, J, D2 = neighborPairs(frame,cutoff)
+                for i,j in zip(I.tolist(),J.tolist()):
+                    d2 = distance2(frame[i],frame[j])
+                    closest[(i,j)] = min(d2,closest.get((i,j),d2))
+            for i,j in sorted(closest):
+                d2 = closest[(i,j)]
+                if d2 <= options['CystineMaxDist2']:
+                    a, b = cysteines[i], cysteines[j]
+                    options['linkListCG'].append((("SC1","CYS",a[2],a[3]),("SC1","CYS",b[2]-(32<<20),b[3]),bl,kb))
+                    a,b = (a[0],a[1],a[2]-(32<<20),a[3]),(b[0],b[1],b[2]-(32<<20),b[3])
+                    logging.info("Detected SS bridge between %s and %s (%f nm)"%(a,b,math.sqrt(d2)/10))
+        
+        
+        ## REAL ITP STUFF ##
+        # Check whether we have identical chains, in which case we 
+        # only write the ITP for one...
+        # This means making a distinction between chains and 
+        # moleculetypes.
+        
+        molecules = [tuple([chains[i] for i in j]) for j in merge]
+        
+        # At this point we should have a list or dictionary of chains
+        # Each chain should be given a unique name, based on the value
+        # of options["-o"] combined with the chain identifier and possibly
+        # a number if there are chains with identical identifiers.
+        # For each chain we then write an ITP file using the name for 
+        # moleculetype and name + ".itp" for the topology include file.
+        # In addition we write a master topology file, using the value of
+        # options["-o"], with an added extension ".top" if not given.
+        
+        # Each topology type gets its own directory, if several are written
+        for variant in options['Variants']:
+            if not os.path.isdir(variant['Directory']):
+                os.makedirs(variant['Directory'])
+
+        # Longest bonded interactions over all moleculetypes, for each topology type
+        rangeBonded = [0 for v in options['Variants'] or [{}]]
+        rangeLong   = [0 for v in options['Variants'] or [{}]]
+        rangeConstr = 0
+
+        # XXX *NOTE*: This should probably be gathered in a 'Universe' class
+        itp = 0
+        moleculeTypes = {}
+        cumulative_atoms = 0
+        bmapFiles  = None
+        bmapArrays = {}
+        # Identical molecules get the moleculetype of the first one, found 
+        # through the digests of their chains, unless all are to be separate
+        typeNames = {}
+        for mi in range(len(molecules)):
+            mol = molecules[mi]
+            key = tuple([chain.digest() for chain in mol])
+            if key in typeNames and not options['SeparateTop']:
+                moleculeTypes[mol] = typeNames[key]
+
+            # The topology may be in the cache from an earlier run. As the 
+            # header lists the options, these all go in the key.
+            stored = itpKey = None
+            if (not mol in moleculeTypes or options['SeparateTop']) and cache and not options["-bmap"].value:
+                name   = "+".join([chain.getname(options['-name'].value) for chain in mol])
+                itpKey = cache.key("itp",name,[m.digest(True) for m in mol],options['ElasticAverage'] and [m.source for m in mol] or None,
+                                   options['linkListCG'],options['Arguments'],options['Variants'],options['Version'],mapDigest,scriptDigest)
+                stored = cache.get(itpKey)
+
+            # Check if the moleculetype is already listed
+            # If not, generate the topology from the chain definition
+            if stored is not None:
+                moleculeTypes[mol] = typeNames[key] = name
+                logging.info("Topology for %s taken from the cache."%name)
+                for variant,text in zip(options['Variants'] or [{}],stored["itp"].tolist()):
+                    if options["-o"]:
+                        destination = openOutput(os.path.join(variant.get('Directory',''),name+".itp"),options['CompressITP'])
+                    else:
+                        destination = sys.stdout
+                    destination.write(text)
+                    if destination is not sys.stdout:
+                        destination.close()
+                rangeBonded = numpy.maximum(rangeBonded,stored["bonded"]).tolist()
+                rangeLong   = numpy.maximum(rangeLong,stored["long"]).tolist()
+                rangeConstr = max(rangeConstr,stored["constr"].tolist())
+                natoms      = stored["natoms"].tolist()
+                itp += 1
+            elif not mol in moleculeTypes or options['SeparateTop']:
+                # Name of the moleculetype
+                # NOTE: The naming should be changed; now it becomes Protein_X+Protein_Y+...
+                name = "+".join([chain.getname(options['-name'].value) for chain in mol])
+                moleculeTypes[mol] = name
+                typeNames.setdefault(key,name)
+    
+                # Write the molecule type topology
+                top = Topology(mol[0],options=options,name=name)
+                # This merges topologies, properties how adding happens in Topology method __iadd__
+                # The bonded terms of each chain are put in tables first, so that these
+                # are shifted as a whole when merging.
+                top.compact()
+                for m in mol[1:]:
+                    part = Topology(m,options=options)
+                    part.compact()
+                    top += part
+    
+                # Keep the bonded terms in tables, rather than as separate objects
+                top.compact()
+
+                # Have to add the connections, like the connecting network.
+                # The beads of the chains are those mapped before (e.g. for -x).
+                beads = [m.cg() for m in mol]
+                mcg   = [j[:4] for cg in beads for j in cg]
+
+                # Bead numbers in the molecule, looked up through the bead index
+                # of each chain, taking the first chain with a matching bead
+                offsets = numpy.cumsum([0]+[len(cg) for cg in beads]).tolist()
+                def beadNumber(bead):
+                    for m,offset in zip(mol,offsets):
+                        k = m.beadIndex()[1].get(bead)
+                        if k is not None:
+                            return offset+k+1
+                    return False
+        
+                # Run through the link list and add connections (links = cys bridges or hand specified links)
+                for atomA,atomB,bondlength,forceconst in options['linkListCG']:
+                    if bondlength == -1 and forceconst == -1:
+                        bondlength, forceconst = options['ForceField'].special[(atomA[:2],atomB[:2])]
+                    # Check whether this link applies to this group
+                    atomA = beadNumber(atomA)
+                    atomB = beadNumber(atomB)
+                    if atomA and atomB:
+                        cat = (mcg[atomA][1] == "CYS" and mcg[atomB][1] == "CYS") and "Cystine" or "Link"
+                        top.bonds.append(Bond((atomA,atomB),options=options,type=1,parameters=(bondlength,forceconst),category=cat))
+        
+                # Elastic Network
+                # The elastic network is added after the topology is constructed, since that
+                # is where the correct atom list with numbering and the full set of 
+                # coordinates for the merged chains are available. 
+                # For Nucleic have to watch out for the missing first bead again,
+                # which is not part of the topology, for every chain in the molecule.
+                encoords = [j[4:7] for m,cg in zip(mol,beads) for j in cg[m.type() == 'Nucleic' and 1 or 0:]]
+
+                # If several topology types are written, each gets its own elastic
+                # network, derived from a single neighbour search.
+                variants    = options['Variants'] or [{}]
+                rubberType  = options['ForceField'].EBondType
+                rubberLists = [rubberBandTable([],[],[],rubberType) for v in variants]
+                if options['ElasticNetwork'] and options['ElasticAverage']:
+                    logging.info("Elastic network from distances averaged over %d frames."%enAverage[mi].frames)
+                    beads       = set([b for v in variants for b in v.get('ElasticBeads',options['ElasticBeads'])])
+                    ids         = [i[0] for i in top.atoms if i[4] in beads]
+                    rubberLists = enAverage[mi].rubberBands(ids,[dict(options,**v) for v in variants],
+                        options['ElasticLowerBound'],
+                        options['ElasticDecayFactor'],options['ElasticDecayPower'],
+                        options['ElasticMinimumForce'],options['ElasticMaximumDeviation'],rubberType)
+                elif options['ElasticNetwork'] and options['Variants']:
+                    beads       = set([b for v in variants for b in v['ElasticBeads']])
+                    rubberLists = rubberBandVariants(
+                        [(i[0],i[4],j) for i,j in zip(top.atoms,encoords) if i[4] in beads],
+                        variants,options['ElasticLowerBound'],
+                        options['ElasticDecayFactor'],options['ElasticDecayPower'],
+                        options['ElasticMinimumForce'],rubberType,cache)
+                elif options['ElasticNetwork']:
+                    rubberLists = [rubberBands(
+                        [(i[0],j) for i,j in zip(top.atoms,encoords) if i[4] in options['ElasticBeads']],
+                        options['ElasticLowerBound'],options['ElasticUpperBound'],
+                        options['ElasticDecayFactor'],options['ElasticDecayPower'],
+                        options['ElasticMaximumForce'],options['ElasticMinimumForce'],rubberType,cache)]
+
+                # Limit the number of bands per bead and report how many there are
+                for vi,variant in enumerate(variants):
+                    if options['ElasticMaximumBonds']:
+                        rubberLists[vi] = rubberBandCap(rubberLists[vi],options['ElasticMaximumBonds'],options['ElasticBondLimit'])
+                    if options['ElasticNetwork']:
+                        beads = variant.get('ElasticBeads',options['ElasticBeads'])
+                        counts, dist = rubberBandCounts(rubberLists[vi],[i[0] for i in top.atoms if i[4] in beads])
+                        logging.info("Elastic bonds per bead%s: mean %.1f, max %d; %s"%(
+                            variant and " (%s)"%variant['type'] or "",len(counts) and counts.mean(),dist.size-1,
+                            " ".join(["%d:%d"%(i,j) for i,j in enumerate(dist.tolist()) if j])))
+
+                # Remove or split off the long bands, which limit the domain decomposition
+                longLists = [[] for v in variants]
+                for vi,variant in enumerate(variants):
+                    if options['ElasticLongBound']:
+                        rubberLists[vi], long = rubberBandSplit(rubberLists[vi],options['ElasticLongBound'])
+                        if options['ElasticSplitLong']:
+                            longLists[vi] = len(long) and [long] or []
+                        elif len(long):
+                            logging.info("Removed %d elastic bonds longer than %.3f nm."%(len(long),options['ElasticLongBound']))
+
+                # The range of the bonded interactions, which sets the minimum cell size for the
+                # domain decomposition in mdrun (-rdd and -rcon)
+                twoBody     = bondedRange([i for i in top.bonds if i.category != "Constraint"],encoords)
+                multiBody   = bondedRange(list(top.angles)+list(top.dihedrals),encoords)
+                molConstr   = constraintRange(top.bonds["Constraint"],encoords)
+                rangeConstr = max(rangeConstr,molConstr)
+                molBonded   = []
+                molLong     = []
+                for vi,variant in enumerate(variants):
+                    elastic = len(rubberLists[vi]) and rubberLists[vi].parameters[0][1].max()
+                    long    = longLists[vi] and longLists[vi][0].parameters[0][1].max() or 0
+                    logging.info("Bonded range%s: bonds %.3f nm %s, elastic bonds %.3f nm%s, angles and dihedrals %.3f nm %s."%(
+                        variant and " (%s)"%variant['type'] or "",twoBody[0],twoBody[1],elastic,
+                        long and " (%.3f nm split off)"%long or "",multiBody[0],multiBody[1]))
+                    molBonded.append(max(twoBody[0],elastic,multiBody[0]))
+                    molLong.append(long)
+                    rangeBonded[vi] = max(rangeBonded[vi],molBonded[-1])
+                    rangeLong[vi]   = max(rangeLong[vi],long)
+
+                bonds      = top.bonds
+                texts      = []
+                for variant,rubberList,longList in zip(variants,rubberLists,longLists):
+                    top.bonds   = CategorizedList(bonds+[rubberList]+longList)
+                    top.options = dict(options,**variant)
+
+                    # Write out the MoleculeType topology
+                    if options["-o"]:
+                        destination = openOutput(os.path.join(variant.get('Directory',''),moleculeTypes[mol]+".itp"),options['CompressITP'])
+                    else:
+                        destination = sys.stdout
+                    if itpKey:
+                        texts.append(str(top))
+                        destination.write(texts[-1])
+                    else:
+                        top.write(destination)
+                    if destination is not sys.stdout:
+                        destination.close()
+                top.options = options
+                natoms      = len(top.atoms)
+
+                # Keep the topology for later runs
+                if itpKey:
+                    cache.put(itpKey,itp=numpy.array(texts),natoms=natoms,
+                              bonded=numpy.array(molBonded,dtype=float),long=numpy.array(molLong,dtype=float),constr=molConstr)
+
+                # If index files for parameterization are needed, print them here
+                # This will write out separate index files for bonds, angles and dihedrals
+                # The files are opened for the first moleculetype, overwriting old files.
+                # The atom numbers are also kept as arrays, one per group label.
+                if options["-bmap"].value:
+                    logging.info("Writing index file for bonded terms.")
+                    groups = top.bondedIndex(cumulative_atoms)
+                    b_out, a_out, d_out = top.ndx(cumulative_atoms,groups)
+                    if not bmapFiles:
+                        bmapFiles = [open(options["-bmap"].value+'-%s.ndx'%kind,"w") for kind in ("bonds","angles","dihedrals")]
+                    for out,text in zip(bmapFiles,(b_out,a_out,d_out)):
+                        out.write(text)
+                    for kind,label,atoms in groups:
+                        bmapArrays.setdefault(label,[]).append(atoms)
+        
+                itp += 1
+        
+            # For the parameterization index files we need to update the cumulative number of atoms.
+            # For parameterization option SepareteTop should always be used because otherwise the numbering will fail.
+            cumulative_atoms += natoms
+        
+        logging.info('Written %d ITP file%s'%(itp,itp>1 and "s" or ""))
+
+        # Close the parameterization index files and write the arrays
+        if bmapFiles:
+            for out in bmapFiles:
+                out.close()
+            numpy.savez(options["-bmap"].value+'-bonded.npz',**dict([(label,numpy.concatenate(arrays)) for label,arrays in bmapArrays.items()]))
+                
+        ## ELASTIC NETWORK BETWEEN MOLECULES ##
+        # The beads are numbered as in the system, following the order of
+        # the molecules, with the first bead of nucleic chains left out.
+        interLists = []
+        if options['ElasticNetwork'] and options['InterElastic']:
+            variants = options['Variants'] or [{}]
+            beads    = set([b for v in variants for b in v.get('ElasticBeads',options['ElasticBeads'])])
+            atomList = []
+            atid     = 1
+            if [chain for chain in chains if chain.multiscale]:
+                logging.warning("No elastic network between molecules with multiscaled chains.")
+                beads = []
+            for mi,mol in enumerate(molecules):
+                for m in mol:
+                    for bead in m.cg()[m.type() == 'Nucleic' and 1 or 0:]:
+                        if bead[0] in beads:
+                            atomList.append((atid,mi,bead[0],bead[4:7]))
+                        atid += 1
+            interLists = interRubberBands(atomList,[dict(options,**v) for v in variants],
+                options['ElasticLowerBound'],options['ElasticDecayFactor'],options['ElasticDecayPower'],
+                options['ElasticMinimumForce'],options['ForceField'].EBondType,options['ElasticProcesses'])
+            logging.info("Elastic network between molecules: %s bonds."%", ".join([str(len(i)) for i in interLists]))
+            for vi,interList in enumerate(interLists):
+                rangeBonded[vi] = max(rangeBonded[vi],len(interList) and interList.parameters[0][1].max())
+
+        # Suggest the minimum cell size for the domain decomposition, with a 10% margin
+        for vi,variant in enumerate(options['Variants'] or [{}]):
+            suggestion = "-rdd %.2f"%(math.ceil(110*rangeBonded[vi])/100)
+            if rangeConstr:
+                suggestion += " -rcon %.2f"%(math.ceil(110*rangeConstr)/100)
+            if rangeLong[vi]:
+                suggestion += " (-rdd %.2f with the long elastic bonds)"%(math.ceil(110*max(rangeBonded[vi],rangeLong[vi]))/100)
+            logging.info("Suggested mdrun options for domain decomposition%s: %s"%(variant and " (%s)"%variant['type'] or "",suggestion))
+
+        # WRITING THE MASTER TOPOLOGY
+        # ITP file listing
+        itps = '\n'.join(['#include "%s.itp"'%molecule for molecule in set(moleculeTypes.values())])
+        
+        # Molecule listing
+        logging.info("Output contains %d molecules:"%len(molecules))
+        n = 1
+        for molecule in molecules:
+            chainInfo = (n, moleculeTypes[molecule], len(molecule)>1 and "s" or " ", " ".join([i.id for i in molecule]))
+            logging.info("  %2d->  %s (chain%s %s)"%chainInfo)
+            n += 1
+        molecules   = '\n'.join(['%s \t 1'%moleculeTypes[molecule] for molecule in molecules])
+        
+        # Set a define if we are to use rubber bands
+        useRubber   = options['ElasticNetwork'] and "#define RUBBER_BANDS" or ""
+       
+        # XXX Specify a better, version specific base-itp name.
+        # Do not set a define for position restrains here, as people are more used to do it in mdp file?
+        for vi,variant in enumerate(options['Variants'] or [{}]):
+            # Output stream
+            top = options["-o"] and open(os.path.join(variant.get('Directory',''),options['-o'].value),'w') or sys.stdout
+            top.write(
+'''#include "martini.itp"
+    
+%s
+  
+%s
+    
+[ system ]
+; name
+Martini system from %s
+    
+[ molecules ]
+; name        number
+%s''' % (useRubber, itps, options["-f"] and options["-f"].value or "stdin", molecules))
+            if interLists and len(interLists[vi]):
+                writeInterRubberBands(top,interLists[vi],dict(options,**variant)['ElasticMaximumForce'])
+            if top is not sys.stdout:
+                top.close()
+    
+        logging.info('Written topology files')
+
+    if cache:
+        logging.info('Cache %s: %d hits, %d misses.'%(cache.directory,cache.hits,cache.misses))
+    for name,hits,misses in lookupCounts(options['ForceField']):
+        logging.info('Force field lookups %s: %d hits, %d misses.'%(name,hits,misses))
+    
+    # Maybe there are forcefield specific log messages?
+    options['ForceField'].messages()
+
+    # The following lines are always printed (if no errors occur).
+    print ("\n\tThere you are. One MARTINI. Shaken, not stirred.\n")
+    Q = martiniq.pop(random.randint(0,len(martiniq)-1))
+    print ("\n", Q[1], "\n%80s"%("--"+Q[0]), "\n")
+if __name__ == '__main__':
+    import sys,logging
+    args = sys.argv[1:]
+    if '-cat' in args:
+        cat('martinize-'+version+'.py')
+        sys.exit()
+    options,lists = options,lists
+    options = option_parser(args,options,lists,version)
+
+    main(options)
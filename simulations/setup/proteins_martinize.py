@@ -1,6 +1,41 @@
 #!/usr/bin/env python
 
+# Coarse-grain all chains of the ribosome for one of the elastic network
+# variants. Run from the directory of the variant (e.g. systems/LIMP), which
+# holds the ch_X directories with kan_chain_X.pdb and, for the proteins,
+# ssdump.dat. The chains are run in a pool of worker processes, each writing
+# the martinize output to martinize.log in its chain directory. By default
+# the protein chains are run; nucleic chains can be added with -chains.
+# Chains with missing input files are reported before anything is run.
+#
+# With -f the full ribosome PDB is read once and split into chains in
+# memory. The chains are then passed to martinize on standard input, all
+# nucleic chains together in a single run of martinize-nucleotide.py, and
+# all itp files, the logs and one combined CG PDB are written to the
+# current directory. With -eic elastic bonds are made between all chains
+# of the combined CG PDB, proteins and nucleic acids alike, and written as
+# [ intermolecular_interactions ] to <x>_eic.itp (ribosome_cg_eic.itp), to
+# be included at the end of the system topology, after [ molecules ].
+#
+# martinize-nucleotide.py is compiled to bytecode once and kept in a cache
+# directory of the user (~/.cache/martinize), named after the source and
+# the Python version, so the runs skip compiling it (-nocompile runs it
+# from source). The directory of the script is added to PYTHONPATH, so
+# that external force field modules next to it are still found.
+#
+# usage: python proteins_martinize.py [-variant LIMP] [-np 8] [-f ribosome.pdb [-eic]]
+
 import os
+import sys
+import stat
+import atexit
+import gzip
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
 def process_text(filename):
     # Open the file and read the contents
     with open(filename, 'r') as f:
@@ -12,23 +47,286 @@ def process_text(filename):
     # Replace "~" with "C" in the string
     text = text.replace('~', 'C')
     # Return the resulting string
-    return text
+    return text.strip()
 
 
 CHAINS = ['0', '1', '2', '3', '4', '5', '6', '7',  'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J',
  'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',  'b',
  'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q', 'r', 's', 't',
  'u']
-home_dir = os.getcwd()
-for ef in CHAINS:
-    if ef.islower():  
-        os.chdir("./ch_%sS"%ef)
-        name = "./ch_%sS"%ef
-    else:  
-        os.chdir("./ch_%s"%ef)
-        name = "./ch_%s"%ef
-    os.system("python ../martinize.py -f kan_chain_%s.pdb -o %s.top -x %s_CG.pdb  -p backbone -ef 500 -eu 0.7 -ff elnedyn22 -ss %s"%(ef,name,name, process_text("ssdump.dat")))
-    
-    os.chdir(home_dir)
+NUCLEIC = ['A', 'a', 'B', 'x']
+
+# Options per variant: martinize.py options for the proteins, and the
+# topology type and further options of martinize-nucleotide.py for the
+# nucleic acids. Only LIMP has position restraints on the nucleic acids.
+# NONE is STIFF with the force constants zeroed afterwards (none.sh).
+VARIANTS = {
+    'STIFF': (['-ff', 'elnedyn22'], 'ss-stiff', []),
+    'SOFT':  (['-ef', '500', '-eu', '0.8', '-ff', 'elnedyn22'], 'ss-soft', []),
+    'SOFT2': (['-ef', '500', '-eu', '0.8', '-ff', 'elnedyn22'], 'ss-soft-two', []),
+    'LIMP':  (['-ef', '500', '-eu', '0.7', '-ff', 'elnedyn22'], 'ss-limp', ['-p', 'backbone']),
+    'NONE':  (['-ff', 'elnedyn22'], 'ss-stiff', []),
+}
+
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def chain_dir(ch):
+    if ch.islower():
+        return "ch_%sS"%ch
+    return "ch_%s"%ch
+
+
+def cache_dir():
+    # Directory of the user for the bytecode, only accessible to the user
+    directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "martinize")
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError:
+        pass
+    return directory
+
+
+def trusted(path):
+    # A file or directory is only used if it is owned by the user and can
+    # not be changed by others, since bytecode found there is executed.
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return (info.st_uid == os.getuid() and not stat.S_ISLNK(info.st_mode) and
+            not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def precompile(script, python):
+    # Compile a script to bytecode once, with the interpreter used for the
+    # runs, so that the runs do not compile it again. The bytecode file is
+    # named after the source and the interpreter version, and kept in the
+    # cache directory of the user for later use. If that directory can not
+    # be trusted, the script is compiled to a new temporary file, which is
+    # removed at exit. Falls back on the script itself.
+    try:
+        stamp = subprocess.check_output([python, "-c", "import sys; sys.stdout.write(sys.version)"])
+        source = open(script, "rb").read()
+    except (OSError, IOError, subprocess.CalledProcessError):
+        return script
+    digest = hashlib.sha1(source + stamp).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(script))[0]
+    directory = cache_dir()
+    if trusted(directory):
+        target = os.path.join(directory, "%s-%s.pyc"%(name, digest))
+        if trusted(target) and os.path.isfile(target):
+            return target
+        handle, temp = tempfile.mkstemp(prefix=name, suffix=".pyc", dir=directory)
+    else:
+        handle, temp = tempfile.mkstemp(prefix=name, suffix=".pyc")
+        target = temp
+        atexit.register(remove, temp)
+    os.close(handle)
+    compile_script = "import py_compile, sys; py_compile.compile(sys.argv[1], sys.argv[2], doraise=True)"
+    if subprocess.call([python, "-c", compile_script, script, temp]) != 0:
+        remove(temp)
+        return script
+    if temp != target:
+        os.rename(temp, target)
+    return target
+
+
+def chain_command(ch, variant, python, home_dir, nucleic_script=None):
+    name = chain_dir(ch)
+    protein, nucleic, restraints = VARIANTS[variant]
+    if ch in NUCLEIC:
+        script = nucleic_script or os.path.join(setup_dir, "martinize-nucleotide.py")
+        return ([python, script, "-type", nucleic, "-f", "kan_chain_%s.pdb"%ch, "-o", "%s.top"%name] +
+                restraints + ["-x", "%s_CG.pdb"%name])
+    script = os.path.join(home_dir, "martinize.py")
+    ss = process_text(os.path.join(home_dir, name, "ssdump.dat"))
+    return ([python, script, "-f", "kan_chain_%s.pdb"%ch, "-o", "./%s.top"%name, "-x", "./%s_CG.pdb"%name,
+             "-p", "backbone"] + protein + ["-ss", ss])
+
+
+def missing_inputs(ch, home_dir):
+    # Input files of a chain, for a run in its own directory, that are missing
+    name = chain_dir(ch)
+    inputs = [os.path.join(name, "kan_chain_%s.pdb"%ch)]
+    if ch not in NUCLEIC:
+        inputs.append(os.path.join(name, "ssdump.dat"))
+    return [i for i in inputs if not os.path.isfile(os.path.join(home_dir, i))]
+
+
+def read_chains(filename):
+    # Read the ATOM/HETATM records of a PDB file, split by chain identifier
+    if filename.endswith("gz"):
+        f = gzip.open(filename, "rt")
+    else:
+        f = open(filename)
+    chains = {}
+    for line in f:
+        if line.startswith("ATOM") or line.startswith("HETATM"):
+            chains.setdefault(line[21], []).append(line)
+        elif line.startswith("ENDMDL"):
+            break
+    f.close()
+    return chains
+
+
+def cg_records(filename):
+    # ATOM records of a CG PDB, split by chain identifier
+    chains = {}
+    for line in open(filename):
+        if line.startswith("ATOM"):
+            chains.setdefault(line[21], []).append(line)
+    return chains
+
+
+def run_chain(job):
+    # Run martinize for one chain, capturing the output. If an input
+    # structure is given, it is passed on standard input.
+    ch, command, cwd, log, data = job
+    log = open(os.path.join(cwd, log), "w")
+    try:
+        if data is None:
+            status = subprocess.call(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        else:
+            process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=log,
+                                       stderr=subprocess.STDOUT, universal_newlines=True)
+            process.communicate(data)
+            status = process.returncode
+    finally:
+        log.close()
+    return ch, status
+
+
+def ribosome_jobs(args, home_dir):
+    # Jobs for coarse-graining the full ribosome from a single parse:
+    # one per protein chain and one for all nucleic chains together.
+    structure = read_chains(args.f)
+    missing = [ch for ch in args.chains if ch not in structure]
+    if missing:
+        print("Chains %s not found in %s"%(" ".join(missing), args.f))
+        sys.exit(1)
+    jobs = []
+    nucleic = [ch for ch in args.chains if ch in NUCLEIC]
+    for ch in args.chains:
+        if ch in NUCLEIC:
+            continue
+        command = chain_command(ch, args.variant, args.python, home_dir, args.nucleic_script)
+        command = command[:2] + command[4:]
+        jobs.append((ch, command, home_dir, "martinize_%s.log"%chain_dir(ch), "".join(structure[ch]) + "TER\nEND\n"))
+    if nucleic:
+        command = chain_command(nucleic[0], args.variant, args.python, home_dir, args.nucleic_script)
+        command = command[:4] + ["-o", "nucleic.top"] + VARIANTS[args.variant][2] + ["-x", "nucleic_CG.pdb"]
+        data = "".join(["".join(structure[ch]) + "TER\n" for ch in nucleic]) + "END\n"
+        jobs.append(("".join(nucleic), command, home_dir, "martinize_nucleic.log", data))
+    return jobs
+
+
+def eic_job(args, home_dir):
+    # Job for the elastic bonds between all chains of the combined CG structure,
+    # with the elastic network parameters of the nucleic topology type
+    script = args.nucleic_script or os.path.join(setup_dir, "martinize-nucleotide.py")
+    command = [args.python, script, "-type", VARIANTS[args.variant][1], "-eicf", args.x,
+               "-enp", str(args.np), "-o", eic_output(args.x)]
+    return ("eic", command, home_dir, "martinize_eic.log", None)
+
+
+def eic_output(filename):
+    return os.path.splitext(filename)[0] + "_eic.itp"
+
+
+def write_ribosome(filename, chains, home_dir):
+    # Combine the CG structures of all chains in one PDB, in the order of the chains
+    records = cg_records(os.path.join(home_dir, "nucleic_CG.pdb")) if set(chains) & set(NUCLEIC) else {}
+    out = open(filename, "w")
+    atid = 1
+    for ch in chains:
+        if ch not in NUCLEIC:
+            records[ch] = cg_records(os.path.join(home_dir, "%s_CG.pdb"%chain_dir(ch))).get(ch, [])
+        for line in records.get(ch, []):
+            out.write(line[:6] + "%5d"%(atid%100000) + line[11:])
+            atid += 1
+    out.close()
+    return atid-1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coarse-grain all ribosome chains in parallel.")
+    parser.add_argument("-variant", default=os.path.basename(os.getcwd()), choices=sorted(VARIANTS),
+                        help="Elastic network variant (default: name of the current directory)")
+    parser.add_argument("-np", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("-chains", default=None,
+                        help="Chains to coarse-grain (default: the protein chains, all chains with -f)")
+    parser.add_argument("-python", default="python",
+                        help="Python interpreter used to run martinize")
+    parser.add_argument("-f", default=None,
+                        help="Full ribosome PDB to coarse-grain from a single parse")
+    parser.add_argument("-x", default="ribosome_cg.pdb",
+                        help="Combined CG structure written with -f (default: ribosome_cg.pdb)")
+    parser.add_argument("-eic", action="store_true",
+                        help="With -f, add elastic bonds between all chains of the combined structure (<x>_eic.itp)")
+    parser.add_argument("-nocompile", action="store_true",
+                        help="Run martinize-nucleotide.py from source, rather than precompiled")
+    args = parser.parse_args()
+
+    home_dir = os.getcwd()
+    if args.chains is None:
+        args.chains = "".join(args.f and CHAINS + NUCLEIC or CHAINS)
+    if not args.chains:
+        print("No chains to coarse-grain")
+        sys.exit(1)
+    if not args.f:
+        missing = [ch for ch in args.chains if missing_inputs(ch, home_dir)]
+        for ch in missing:
+            print("%-6s missing %s"%(ch, " ".join(missing_inputs(ch, home_dir))))
+        if missing:
+            sys.exit(1)
+    args.nucleic_script = None
+    if not args.nocompile and (set(args.chains) & set(NUCLEIC) or args.f and args.eic):
+        args.nucleic_script = precompile(os.path.join(setup_dir, "martinize-nucleotide.py"), args.python)
+        # Run from bytecode elsewhere, martinize no longer has its own directory
+        # on the path, where it looks for external force field modules first
+        os.environ["PYTHONPATH"] = os.pathsep.join([setup_dir] + [i for i in [os.environ.get("PYTHONPATH")] if i])
+    if args.f:
+        jobs = ribosome_jobs(args, home_dir)
+    else:
+        jobs = [(ch, chain_command(ch, args.variant, args.python, home_dir, args.nucleic_script), os.path.join(home_dir, chain_dir(ch)),
+                 "martinize.log", None) for ch in args.chains]
+
+    pool = multiprocessing.Pool(min(args.np, len(jobs)))
+    try:
+        # Results come back in the order of the chains, whatever order they finish in
+        results = pool.map(run_chain, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = [job[0] for job, (ch, status) in zip(jobs, results) if status != 0]
+    for job, (ch, status) in zip(jobs, results):
+        log = os.path.relpath(os.path.join(job[2], job[3]), home_dir)
+        print("%-6s %s"%(ch, status == 0 and "done" or "FAILED (see %s)"%log))
+    if failed:
+        sys.exit(1)
+
+    if args.f:
+        natoms = write_ribosome(args.x, args.chains, home_dir)
+        print("Written %d beads to %s"%(natoms, args.x))
+
+    if args.f and args.eic:
+        job = eic_job(args, home_dir)
+        ch, status = run_chain(job)
+        if status != 0:
+            print("%-6s FAILED (see %s)"%(ch, job[3]))
+            sys.exit(1)
+        print("Written the elastic bonds between the chains to %s; include it after [ molecules ]"%eic_output(args.x))
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Tests for martinize-nucleotide.py, which runs on Python 2. The script is
+# run in a subprocess with the interpreter given in MARTINIZE_PYTHON
+# (default: python2); the tests are skipped if that can not import numpy.
+#
+# usage: python -m pytest simulations/setup/test_martinize_nucleotide.py
+
+import os
+import glob
+import subprocess
+
+import pytest
+
+setup_dir = os.path.dirname(os.path.abspath(__file__))
+script = os.path.join(setup_dir, "martinize-nucleotide.py")
+chain_B = os.path.join(setup_dir, "..", "systems", "LIMP", "ch_B", "kan_chain_B.pdb")
+python = os.environ.get("MARTINIZE_PYTHON", "python2")
+
+
+def python_available():
+    try:
+        return subprocess.call([python, "-c", "import numpy"], stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT) == 0
+    except OSError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not python_available(), reason="no Python 2 with numpy (%s)"%python)
+
+
+def residues(filename, count):
+    # The ATOM records of the first residues of a PDB file
+    records, seen = [], []
+    for line in open(filename):
+        if line.startswith("ATOM"):
+            if line[22:27] not in seen:
+                if len(seen) == count:
+                    break
+                seen.append(line[22:27])
+            records.append(line)
+    return "".join(records) + "TER\nEND\n"
+
+
+def itp(tmpdir, topology_type):
+    # Coarse-grain the first residues of chain B and return the itp text
+    structure = tmpdir.join("chain_B.pdb")
+    structure.write(residues(chain_B, 6))
+    log = tmpdir.join("log")
+    status = subprocess.call([python, script, "-type", topology_type, "-f", str(structure), "-o", "chain_B.top"],
+                             cwd=str(tmpdir), stdout=log.open("w"), stderr=subprocess.STDOUT)
+    assert status == 0, log.read()
+    return "".join([open(i).read() for i in sorted(glob.glob(str(tmpdir.join("*.itp"))))])
+
+
+def test_no_rubber_bands_without_elastic_network(tmpdir):
+    assert "RUBBER_BANDS" not in itp(tmpdir, "ss")
+
+
+def test_rubber_bands_with_elastic_network(tmpdir):
+    assert "#ifdef RUBBER_BANDS" in itp(tmpdir, "ss-stiff")
+
+
+def test_elastic_bonds_between_chains_of_structure(tmpdir):
+    # A protein chain (P) next to an RNA chain (R): only the protein
+    # backbone bead is bound to the RNA, and not within the chains
+    line = "ATOM  %5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f  1.00  0.00\n"
+    beads = [("BB", "ALA", "P", 1, 0.0), ("SC1", "ALA", "P", 1, 1.0), ("BB", "ALA", "P", 2, 6.0),
+             ("BB1", "U", "R", 1, 0.0), ("SC1", "U", "R", 1, 1.0)]
+    structure = tmpdir.join("cg.pdb")
+    structure.write("".join([line%(k+1, n, r, c, i, 0, y, 4.0*(c == "R")) for k, (n, r, c, i, y) in enumerate(beads)]))
+    log = tmpdir.join("log")
+    status = subprocess.call([python, script, "-type", "ss-limp", "-eicf", str(structure), "-o", "eic.itp"],
+                             cwd=str(tmpdir), stdout=log.open("w"), stderr=subprocess.STDOUT)
+    assert status == 0, log.read()
+    text = tmpdir.join("eic.itp").read()
+    assert "[ intermolecular_interactions ]" in text
+    pairs = [tuple(int(i) for i in l.split()[:2]) for l in text.splitlines() if l.strip()[:1].isdigit()]
+    assert sorted(pairs) == [(1, 4), (1, 5)]